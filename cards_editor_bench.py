@@ -0,0 +1,254 @@
+
+# -*- coding: utf-8 -*-
+"""
+cards_editor_bench.py — бенчмарк движка разбора/замены cards_editor_no_abilities.py
+Что меряем:
+  • parse_array / replace_array, parse_bunkers / replace_bunkers,
+    parse_cataclysms / replace_cataclysms, ensure_abilities_preserved
+  • полные GET/POST через Flask test client (оболочка, /full, /api, сохранение формы)
+На каждой колоде: от настоящего data/cards.js до синтетической на 100k элементов
+и тысячи бункеров. Для каждого случая — min/медиана времени и пиковая память (tracemalloc).
+
+Запуск:
+  python cards_editor_bench.py                         # все колоды, отчёт в консоль
+  python cards_editor_bench.py --decks shipped,10k --out bench.json
+  python cards_editor_bench.py --compare bench.json    # код возврата 1 при регрессии
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import statistics
+import subprocess
+import tempfile
+import tracemalloc
+import importlib.util
+from pathlib import Path
+from typing import Optional, List, Dict, Any, Callable, Tuple
+
+BASE_DIR = Path(__file__).resolve().parent
+SHIPPED_CARDS = BASE_DIR / "data" / "cards.js"
+EDITOR_PATH = BASE_DIR / "cards_editor_no_abilities.py"
+
+# имя -> (элементов в каждом списке ARRAY_KEYS, бункеров, катаклизмов); None — как в data/cards.js
+DECKS: Dict[str, Optional[Tuple[int, int, int]]] = {
+    "shipped": None,
+    "10k": (1_000, 200, 50),
+    "100k": (10_000, 2_000, 500),
+}
+
+WORDS = ("бункер", "радиация", "аптечка", "фильтр", "консервы", "генератор", "рация", "карта",
+         "нож", "фонарь", "верёвка", "палатка", "компас", "спички", "вода", "семена", "ключ",
+         "опыт", "страх", "навык", "здоровье", "хобби", "профессия", "тайна", "мутант")
+
+
+# ---------- Генератор колод ----------
+def _phrase(rnd: random.Random, n: int) -> str:
+    return " ".join(rnd.choice(WORDS) for _ in range(n)).capitalize()
+
+def generate_cards_js(ed: Any, items_per_key: int, bunkers: int, cataclysms: int, seed: int = 1) -> str:
+    """Синтетический cards.js: каркас (ABILITIES, хелперы, module.exports) берётся
+    из data/cards.js, списки, бункеры и катаклизмы генерируются."""
+    rnd = random.Random(seed)
+    text = SHIPPED_CARDS.read_text(encoding="utf-8")
+    blocks: Dict[str, str] = {}
+    for key in ed.ARRAY_KEYS:
+        items = [f"{_phrase(rnd, 3)} ({key.lower()} #{i})" for i in range(items_per_key)]
+        blocks[key] = ed.format_array_block(key, items)
+    blocks["BUNKERS"] = ed.format_bunkers_block([{
+        "description": _phrase(rnd, 25) + ". " + _phrase(rnd, 15) + ".",
+        "items": [_phrase(rnd, 2) for _ in range(rnd.randint(2, 6))],
+        "sizeM2": rnd.randint(20, 500),
+        "stayText": f"{rnd.randint(1, 5)} год {rnd.randint(0, 11)} месяцев",
+        "foodText": f"{rnd.randint(1, 5)} год",
+        "places": rnd.randint(2, 8),
+    } for _ in range(bunkers)])
+    cats = [{
+        "id": f"cat-{i}",
+        "title": "Катаклизм",
+        "description": _phrase(rnd, 60) + ".\n\nОстаток населения — " + str(rnd.randint(10**6, 10**9)),
+        "image": f"/cataclysms/cat-{i}.jpg",
+    } for i in range(cataclysms)]
+    text = ed.splice_blocks(text, blocks)
+    return ed.replace_cataclysms(text, cats, text)
+
+
+# ---------- Замеры ----------
+def _measure(fn: Callable[[], Any], repeat: int, reset: Callable[[], None]) -> Dict[str, float]:
+    times: List[float] = []
+    for _ in range(repeat):
+        reset()
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    reset()
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "min_ms": min(times) * 1000,
+        "median_ms": statistics.median(times) * 1000,
+        "peak_kb": peak / 1024,
+    }
+
+def _form_from_doc(ed: Any, doc: Dict[str, Any]) -> List[Tuple[str, str]]:
+    """Поля формы /full в том виде, в каком их отправляет браузер."""
+    fields: List[Tuple[str, str]] = []
+    for key in ed.ARRAY_KEYS:
+        fields += [(f"{key}_item", v) for v in doc["arrays"][key]]
+    for i, b in enumerate(doc["bunkers"]):
+        fields += [("bunk_idx", str(i)), (f"bunk_desc_{i}", b["description"]),
+                   (f"bunk_size_{i}", str(b["sizeM2"])), (f"bunk_stay_{i}", b["stayText"]),
+                   (f"bunk_food_{i}", b["foodText"]), (f"bunk_places_{i}", str(b["places"]))]
+        fields += [(f"bunk_item_{i}", it) for it in b["items"]]
+    for c in doc["cats"]:
+        fields += [("cat_id", c["id"]), ("cat_title", c["title"]),
+                   ("cat_description", c["description"]), ("cat_image", c["image"])]
+    return fields
+
+def bench_deck(ed: Any, name: str, text: str, repeat: int) -> List[Dict[str, Any]]:
+    from werkzeug.datastructures import MultiDict
+
+    ed.save_text(text)
+    doc = ed.parse_document(text)
+    results: List[Dict[str, Any]] = []
+
+    def reset() -> None:
+        ed._INDEX_CACHE.clear()
+
+    last: Dict[str, int] = {}   # код ответа последнего HTTP-запроса
+
+    def record(case: str, fn: Callable[[], Any], reset_fn: Callable[[], None] = reset) -> None:
+        last.clear()
+        row = {"deck": name, "case": case, **_measure(fn, repeat, reset_fn), **last}
+        results.append(row)
+        print(f"  {case:<34} {row['median_ms']:>10.2f} ms  (min {row['min_ms']:.2f})  "
+              f"peak {row['peak_kb']:>9.0f} KB" + (f"  status {last['status']}" if last else ""),
+              flush=True)
+
+    key = "HOBBIES"
+    items = list(doc["arrays"][key]) + ["Новый элемент"]
+    no_abilities = text.replace(ed.extract_verbatim(text, "ABILITIES") or "", "")
+
+    record("parse_array[all keys]", lambda: [ed.parse_array(text, k) for k in ed.ARRAY_KEYS])
+    record(f"replace_array[{key}]", lambda: ed.replace_array(text, key, items))
+    record("parse_bunkers", lambda: ed.parse_bunkers(text))
+    record("replace_bunkers", lambda: ed.replace_bunkers(text, doc["bunkers"]))
+    record("parse_cataclysms", lambda: ed.parse_cataclysms(text))
+    record("replace_cataclysms", lambda: ed.replace_cataclysms(text, doc["cats"], text))
+    record("ensure_abilities_preserved", lambda: ed.ensure_abilities_preserved(text, no_abilities))
+    record("parse_document", lambda: ed.parse_document(text))
+
+    client = ed.app.test_client()
+
+    def reset_all() -> None:
+        reset()
+        ed.invalidate_document()
+        with ed._DOC_LOCK:
+            ed._DOC_CACHE.clear()
+        with ed._COMPRESS_LOCK:
+            ed._COMPRESSED.clear()
+
+    def get(path: str) -> Callable[[], Any]:
+        def run() -> None:
+            last["status"] = client.get(path).status_code
+        return run
+
+    for path in ("/", "/full", f"/api/{key}?limit=50"):
+        record(f"GET {path} (cold)", get(path), reset_all)
+        record(f"GET {path} (cached)", get(path), lambda: None)
+
+    form = MultiDict(_form_from_doc(ed, doc))
+    changed = MultiDict(_form_from_doc(ed, doc))
+    changed.add(f"{key}_item", "Новый элемент")
+
+    def post(data: MultiDict) -> Callable[[], Any]:
+        def run() -> None:
+            last["status"] = client.post("/", data=data).status_code
+        return run
+
+    def restore() -> None:
+        ed.save_text(text)
+        reset_all()
+
+    record("POST / (no changes)", post(form), restore)
+    record("POST / (one item added)", post(changed), restore)
+    return results
+
+
+# ---------- Отчёт ----------
+def _git_rev() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], threshold: float,
+            min_delta_ms: float = 1.0) -> List[str]:
+    """Случаи, где медиана выросла больше чем в threshold раз относительно baseline
+    (и не меньше чем на min_delta_ms — чтобы не ловить шум на субмиллисекундных замерах)."""
+    base = {(r["deck"], r["case"]): r for r in baseline.get("results", [])}
+    regressions: List[str] = []
+    for r in report["results"]:
+        old = base.get((r["deck"], r["case"]))
+        if not old or old["median_ms"] <= 0:
+            continue
+        ratio = r["median_ms"] / old["median_ms"]
+        if ratio > threshold and r["median_ms"] - old["median_ms"] >= min_delta_ms:
+            regressions.append(f"{r['deck']} / {r['case']}: {old['median_ms']:.2f} → {r['median_ms']:.2f} ms (×{ratio:.2f})")
+    return regressions
+
+def load_editor(cards_path: Path) -> Any:
+    """Импортирует редактор так, чтобы он работал с временным файлом, а не с data/cards.js."""
+    os.environ["CARDS_PATH"] = str(cards_path)
+    spec = importlib.util.spec_from_file_location("cards_editor_no_abilities", EDITOR_PATH)
+    ed = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(ed)
+    return ed
+
+def main(argv: Optional[List[str]] = None) -> int:
+    ap = argparse.ArgumentParser(description="Бенчмарк редактора cards.js")
+    ap.add_argument("--decks", default=",".join(DECKS), help=f"колоды через запятую: {', '.join(DECKS)}")
+    ap.add_argument("--repeat", type=int, default=5, help="повторов на случай (берётся медиана)")
+    ap.add_argument("--out", help="записать отчёт в JSON")
+    ap.add_argument("--compare", help="сравнить с прошлым JSON-отчётом")
+    ap.add_argument("--threshold", type=float, default=1.25, help="допустимый рост медианы, раз")
+    ap.add_argument("--min-delta-ms", type=float, default=1.0, help="рост меньше этого не считается регрессией")
+    args = ap.parse_args(argv)
+
+    workdir = Path(tempfile.mkdtemp(prefix="cards-bench-"))
+    ed = load_editor(workdir / "cards.js")
+    report: Dict[str, Any] = {
+        "meta": {"python": sys.version.split()[0], "platform": platform.platform(),
+                 "git": _git_rev(), "date": time.strftime("%Y-%m-%d %H:%M:%S"), "repeat": args.repeat},
+        "results": [],
+    }
+    for name in [d.strip() for d in args.decks.split(",") if d.strip()]:
+        if name not in DECKS:
+            ap.error(f"неизвестная колода: {name}")
+        shape = DECKS[name]
+        text = SHIPPED_CARDS.read_text(encoding="utf-8") if shape is None else generate_cards_js(ed, *shape)
+        print(f"[{name}] {len(text.encode('utf-8')) / 1024:.0f} KB", flush=True)
+        report["results"] += bench_deck(ed, name, text, args.repeat)
+
+    if args.out:
+        Path(args.out).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f"Отчёт: {args.out}")
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        regressions = compare(report, baseline, args.threshold, args.min_delta_ms)
+        for line in regressions:
+            print(f"[РЕГРЕССИЯ] {line}")
+        if regressions:
+            return 1
+        print(f"Регрессий нет (порог ×{args.threshold})")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,22 +4,114 @@
 cards_editor_no_abilities.py — редактор SERVER/data/cards.js
 Фичи:
   • Простые списки: GENDERS, BODIES, TRAITS, PROFESSIONS, HEALTHS, HOBBIES, PHOBIAS, BIG_ITEMS, BACKPACK, EXTRAS
-  • Объекты: BUNKERS, CATAclySMS
+  • Объекты: BUNKERS, CATACLYSMS (разбор и запись по схеме полей)
   • Кнопки: "⬇️ Скачать данные из GitHub", "↻ Перезагрузка"
   • Автоподкачка: если cards.js отсутствует — скачиваем из GitHub (по умолчанию jester19686/YGsere@main)
+  • Синхронизация идёт фоновой задачей, ход виден на /sync/<id>
   • ABILITIES не изменяется и не теряется
+  • При каждом сохранении рядом с cards.js пишется снапшот колоды (cards.snapshot.json / .bin)
+  • JSON API: /api/<раздел>[/<индекс>] (GET/POST/PATCH/DELETE, ETag/If-Match)
+  • История правок (/history): версии по содержимому, diff и откат
+  • /metrics — время этапов и счётчики для Prometheus; X-Cards-Profile: 1 — cProfile одного запроса
+  • Превью и WebP-варианты картинок катаклизмов (кэш по хэшу), отчёт /images
+  • Поиск по всей колоде (/search) и отчёт о похожих записях (/duplicates)
+  • /simulate — Монте-Карло баланса колоды (совпадения карт, пары способностей, места в бункере)
+  • Главная — лёгкая оболочка, разделы подгружаются постранично с поиском; /full — вся колода одной формой
+  • Пакетный режим без браузера: операции из JSONL/CSV одной записью, синхронизация из консоли
+  • Запись cards.js атомарная (временный файл + fsync + rename) и под межпроцессной блокировкой;
+    форма /full, открытая до чужой правки того же раздела, не перезаписывает её
+  • Выгрузка и загрузка колоды потоком: /export.jsonl|csv, POST /import.jsonl|csv (merge/replace, дедупликация;
+    тело импорта — до CARDS_IMPORT_MAX_BYTES, по умолчанию 32 МБ)
+  • Слежение за cards.js и картинками (inotify, иначе опрос): открытые вкладки по /events (SSE)
+    перерисовывают только изменившиеся на диске разделы; CARDS_WATCH=0 — выключить
+  • Ответы GET со сильным ETag (от хэша cards.js) и 304, сжатие gzip/brotli с кэшем готовых тел
+  • CARDS_STORAGE=shards: каждый раздел — свой файл в data/cards/, читается и пишется отдельно;
+    cards.js собирается из них атомарно, правки cards.js мимо редактора раскладываются обратно
+  • Несколько колод в одном процессе (data/decks.json, /d/<имя>/): у каждой свои repo@branch и cards.js;
+    картинки всех колод — в общем хранилище по хэшу, в папках колод только жёсткие ссылки
+  • Компактная модель в памяти: списки — одна строка + array('I'), бункеры и катаклизмы — записи
+    со __slots__, повторяющиеся короткие строки интернируются; /cache → model — память по разделам
 
-Запуск: python cards_editor_no_abilities.py
+Запуск: python cards_editor_no_abilities.py                    (локально, debug)
+        python cards_editor_no_abilities.py serve --workers 4    (gunicorn/waitress, без debug)
+        gunicorn -w 4 --threads 4 cards_editor_no_abilities:app
+        python cards_editor_no_abilities.py serve --decks data/decks.json   (несколько колод)
+Пакетный режим (через -m байткод берётся из __pycache__, запуск быстрее):
+        python -m cards_editor_no_abilities apply ops.jsonl [ops.csv ...] [--dry-run] [--json]
+        python -m cards_editor_no_abilities sync [--repo owner/name] [--branch main] [--prune]
+        python -m cards_editor_no_abilities export [--format csv] [--sections HOBBIES,bunkers] [-o deck.jsonl]
+        python -m cards_editor_no_abilities import deck.jsonl [--mode replace] [--no-dedupe] [--dry-run]
+        python -m cards_editor_no_abilities --deck season sync   (любая команда для колоды из decks.json)
+Проверки: python -m pytest tests   (каждый тест — на своей копии data/cards.js)
 """
 
+import io
 import os
 import re
-import io
+import sys
+import csv
+import json
+import mmap
+import queue
+import select
+import time
+import struct
+import zlib
+import heapq
+import bisect
+import difflib
+import shutil
+import uuid
+import hashlib
+import tempfile
+import threading
+import contextvars
 import zipfile
-import urllib.request
-from typing import Optional, Tuple, List, Dict, Any
+import argparse
+import urllib.error
+from array import array
+from contextlib import contextmanager
+from collections import OrderedDict
+from collections.abc import Sequence
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple, List, Dict, Any, NamedTuple, Callable, Iterable, Iterator
 from pathlib import Path
-from flask import Flask, request, redirect, url_for, render_template_string, flash
+from functools import lru_cache, wraps
+from itertools import accumulate, islice
+
+try:
+    import fcntl
+except ImportError:  # Windows: запись cards.js сериализуется только внутри процесса
+    fcntl = None
+
+# Flask/Jinja импортируются ниже, перед веб-частью: команды CLI выполняются раньше
+# и за импорт веб-стека не платят. numpy и Pillow (~100 мс на импорт) нужны только
+# симуляции, отчёту о дублях и картинкам — они грузятся при первом обращении.
+np: Any = None
+Image: Any = None
+ImageOps: Any = None
+
+@lru_cache(maxsize=None)
+def _numpy() -> bool:
+    """True, если numpy установлен (при первом вызове импортирует его в np)."""
+    global np
+    try:
+        import numpy
+    except ImportError:  # без numpy недоступна только симуляция баланса
+        return False
+    np = numpy
+    return True
+
+@lru_cache(maxsize=None)
+def _pillow() -> bool:
+    """True, если Pillow установлен (при первом вызове импортирует Image/ImageOps)."""
+    global Image, ImageOps
+    try:
+        from PIL import Image as pil_image, ImageOps as pil_ops
+    except ImportError:  # без Pillow нет превью и WebP-вариантов картинок, отчёт по файлам остаётся
+        return False
+    Image, ImageOps = pil_image, pil_ops
+    return True
 
 # ---------- Пути и конфиг ----------
 BASE_DIR = Path(__file__).resolve().parent
@@ -44,359 +136,4377 @@ LABELS: Dict[str, str] = {
     "EXTRAS": "EXTRAS - Доп. сведение",
 }
 
-app = Flask(__name__)
-app.secret_key = "cards-editor-secret"
+# --- GitHub источники по умолчанию ---
+GITHUB_REPO = os.environ.get('CARDS_GITHUB_REPO', 'jester19686/YGsere')
+GITHUB_BRANCH = os.environ.get('CARDS_GITHUB_BRANCH', 'main')
+IMAGES_DIR = Path(os.environ.get('CARDS_IMAGES_DIR') or (BASE_DIR / 'client' / 'public' / 'cataclysms')).resolve()
+# Общее хранилище картинок по содержимому (см. «Хранилище картинок»); пусто — картинки пишутся в IMAGES_DIR как есть
+IMAGE_STORE: Optional[Path] = Path(os.environ['CARDS_IMAGE_STORE']).resolve() if os.environ.get('CARDS_IMAGE_STORE') else None
+# Источник архива; {repo} и {branch} подставляются. Для тестов можно указать локальный HTTP-сервер.
+GITHUB_ARCHIVE_URL = os.environ.get('CARDS_ARCHIVE_URL', 'https://codeload.github.com/{repo}/zip/refs/heads/{branch}')
+# удалять ли картинки, пропавшие из архива (можно переопределить в форме /sync)
+SYNC_PRUNE = os.environ.get('CARDS_SYNC_PRUNE', '') == '1'
+# потоков для распаковки и записи файлов при синхронизации
+SYNC_WORKERS = max(1, int(os.environ.get('CARDS_SYNC_WORKERS') or os.cpu_count() or 1))
+DOWNLOAD_CHUNK = 256 * 1024
+
+# ---------- Колода ----------
+# Всё, что относится к одной колоде: cards.js, картинки, служебные файлы рядом с cards.js,
+# блокировка записи, задачи синхронизации, слежение и привязка файла к кэшу модели.
+# Код редактора берёт колоду через current_deck(): в одиночном запуске это PRIMARY_DECK
+# из окружения, в рабочем пространстве каждая колода привязывается к своим запросам
+# (см. «Несколько колод»). Кэши по содержимому (модель, индекс, сжатые ответы), пулы
+# потоков и метрики общие для всех колод процесса.
+class DeckState:
+    def __init__(self, name: str, path: Path, images: Path, repo: str, branch: str,
+                 image_store: Optional[Path] = None):
+        self.name = name                # имя в рабочем пространстве; "" — одиночный запуск
+        self.path = path
+        self.images = images
+        self.repo = repo
+        self.branch = branch
+        self.image_store = image_store  # общее хранилище картинок (см. «Хранилище картинок»)
+        root = path.parent
+        # ETag/Last-Modified последнего успешно применённого архива для каждого repo@branch
+        self.sync_state_path = root / ".cards_sync.json"
+        # size/CRC32/mtime каждого файла, пришедшего из архива, — чтобы не перечитывать неизменённые
+        self.sync_manifest_path = root / ".cards_manifest.json"
+        self.jobs_dir = root / ".cards_jobs"
+        self.lock_path = root / ".cards.lock"
+        self.shard_dir = root / path.stem
+        self.snapshot_json_path = path.with_suffix(".snapshot.json")
+        self.snapshot_bin_path = path.with_suffix(".snapshot.bin")
+        self.history_dir = root / ".cards_history"
+        self.image_cache_dir = root / ".cards_images"
+        # состояние в памяти процесса
+        self.write_lock = threading.RLock()
+        self.lock_state: Dict[str, Any] = {"depth": 0, "file": None}
+        self.doc_stat: Dict[str, Any] = {"key": None, "hash": None}   # stat cards.js -> хэш в кэше модели
+        self.shard_cache: Dict[str, Dict[str, Any]] = {}   # имя -> {key: stat, text, items}
+        self.search: Dict[str, Dict[str, Any]] = {}        # раздел -> индекс поиска
+        self.sync_jobs: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.active_sync: Dict[str, str] = {}              # repo@branch -> id незавершённой задачи
+        self.image_job: Dict[str, Any] = {"future": None}
+        self.watch: Dict[str, Any] = {"thread": None, "mode": None, "subs": [], "key": None,
+                                      "hash": None, "versions": {}, "images": {}}
+
+PRIMARY_DECK = DeckState("", FILE_PATH, IMAGES_DIR, GITHUB_REPO, GITHUB_BRANCH, IMAGE_STORE)
+_CURRENT_DECK: "contextvars.ContextVar[DeckState]" = contextvars.ContextVar("cards_deck", default=PRIMARY_DECK)
+
+def current_deck() -> DeckState:
+    return _CURRENT_DECK.get()
+
+@contextmanager
+def use_deck(deck: DeckState) -> Iterator[DeckState]:
+    """Выполнить блок для колоды deck (CLI --deck, фоновые задачи)."""
+    token = _CURRENT_DECK.set(deck)
+    try:
+        yield deck
+    finally:
+        _CURRENT_DECK.reset(token)
+
+def in_deck(fn: Callable[..., Any]) -> Callable[..., Any]:
+    """fn, привязанная к текущей колоде, — для пулов потоков и фоновых потоков,
+    которые контекст вызывающего не наследуют."""
+    deck = current_deck()
+
+    @wraps(fn)
+    def run(*args: Any, **kwargs: Any) -> Any:
+        with use_deck(deck):
+            return fn(*args, **kwargs)
+    return run
+
+# ---------- Метрики ----------
+# Таймеры этапов (гистограммы) и счётчики для /metrics в формате Prometheus.
+# Запись — пара perf_counter() и короткая секция под блокировкой.
+METRIC_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0)
+METRIC_HELP: Dict[str, str] = {
+    "cards_stage_seconds": "Время этапов обработки (чтение, разбор, рендер, запись, синхронизация)",
+    "cards_request_seconds": "Время обработки HTTP-запроса",
+    "cards_requests_total": "HTTP-запросы по эндпоинтам и кодам ответа",
+    "cards_bytes_read_total": "Прочитано байт cards.js",
+    "cards_bytes_written_total": "Записано байт cards.js",
+    "cards_items_parsed_total": "Разобрано записей по разделам",
+    "cards_sync_bytes_total": "Скачано байт архива при синхронизации",
+    "cards_sync_files_changed_total": "Файлов обновлено синхронизацией",
+    "cards_profiles_total": "Запросов, снятых с профилировщиком",
+    "cards_stale_rejected_total": "Сохранений формы, отклонённых из-за правок в другом окне",
+    "cards_watch_events_total": "Изменений cards.js и картинок, замеченных на диске",
+    "cards_not_modified_total": "Ответов 304 Not Modified по эндпоинтам",
+    "cards_image_store_total": "Картинок, положенных в общее хранилище (stored) или найденных в нём (reused)",
+    "cards_image_store_links_total": "Картинок, связанных с IMAGES_DIR колоды (link) или скопированных (copy)",
+}
+_HISTOGRAMS: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], List[float]] = {}
+_COUNTERS: Dict[Tuple[str, Tuple[Tuple[str, str], ...]], float] = {}
+_METRICS_LOCK = threading.Lock()
+
+def observe(name: str, seconds: float, **labels: str) -> None:
+    key = (name, tuple(sorted(labels.items())))
+    with _METRICS_LOCK:
+        h = _HISTOGRAMS.get(key)
+        if h is None:
+            h = _HISTOGRAMS[key] = [0.0] * (len(METRIC_BUCKETS) + 2)   # бакеты, sum, count
+        for i, le in enumerate(METRIC_BUCKETS):
+            if seconds <= le:
+                h[i] += 1
+        h[-2] += seconds
+        h[-1] += 1
+
+def count(name: str, value: float = 1, **labels: str) -> None:
+    key = (name, tuple(sorted(labels.items())))
+    with _METRICS_LOCK:
+        _COUNTERS[key] = _COUNTERS.get(key, 0) + value
+
+def timed(stage: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """Декоратор: время вызова попадает в cards_stage_seconds{stage=...}."""
+    def wrap(fn: Callable[..., Any]) -> Callable[..., Any]:
+        @wraps(fn)
+        def inner(*args: Any, **kwargs: Any) -> Any:
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                observe("cards_stage_seconds", time.perf_counter() - t0, stage=stage)
+        return inner
+    return wrap
+
+def _prom_labels(labels: Tuple[Tuple[str, str], ...], le: Optional[str] = None) -> str:
+    if le is not None:
+        labels = labels + (("le", le),)
+    if not labels:
+        return ""
+    esc = lambda v: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return "{" + ",".join(f'{k}="{esc(v)}"' for k, v in labels) + "}"
+
+def render_metrics() -> str:
+    with _METRICS_LOCK:
+        hists = sorted((k, list(v)) for k, v in _HISTOGRAMS.items())
+        counters = sorted(_COUNTERS.items())
+    out: List[str] = []
+    seen: set = set()
+
+    def head(name: str, kind: str) -> None:
+        if name not in seen:
+            seen.add(name)
+            out.append(f"# HELP {name} {METRIC_HELP.get(name, name)}")
+            out.append(f"# TYPE {name} {kind}")
+
+    for (name, labels), h in hists:
+        head(name, "histogram")
+        for i, le in enumerate(METRIC_BUCKETS):
+            out.append(f"{name}_bucket{_prom_labels(labels, f'{le:g}')} {h[i]:g}")
+        out.append(f"{name}_bucket{_prom_labels(labels, '+Inf')} {h[-1]:g}")
+        out.append(f"{name}_sum{_prom_labels(labels)} {h[-2]:.6f}")
+        out.append(f"{name}_count{_prom_labels(labels)} {h[-1]:g}")
+    for (name, labels), v in counters:
+        head(name, "counter")
+        out.append(f"{name}{_prom_labels(labels)} {v:g}")
+    cache = doc_cache_stats()
+    for key in ("hits", "misses", "evictions"):
+        head(f"cards_doc_cache_{key}_total", "counter")
+        out.append(f"cards_doc_cache_{key}_total {cache[key]}")
+    head("cards_doc_cache_bytes", "gauge")
+    out.append(f"cards_doc_cache_bytes {cache['bytes']}")
+    return "\n".join(out) + "\n"
+
+# ---------- Хранилище картинок ----------
+# С CARDS_IMAGE_STORE картинки всех колод лежат один раз в IMAGE_STORE/objects/<sha1>,
+# а в IMAGES_DIR каждой колоды — жёсткие ссылки на них. Ветки с почти одинаковыми
+# картинками занимают место только под различающиеся файлы. IMAGE_STORE/crc/<crc>-<size>
+# хранит sha1 по CRC32 и размеру из каталога ZIP: картинка, которая уже есть в хранилище
+# (от другой колоды или ветки), не распаковывается — сразу ставится ссылка.
+# Файлы в IMAGES_DIR меняются только заменой (rename), не на месте: иначе правка
+# видна во всех колодах. Если жёсткие ссылки недоступны (другая ФС), файл копируется.
+IMAGE_STORE_GC_AGE = 3600.0   # с; блоб без ссылок моложе этого не удаляется — его могут связывать прямо сейчас
+
+def _blob_path(digest: str) -> Path:
+    return current_deck().image_store / "objects" / digest[:2] / digest
+
+def _blob_ref(info: zipfile.ZipInfo) -> Path:
+    return current_deck().image_store / "crc" / f"{info.CRC:08x}-{info.file_size}"
+
+def _known_blob(info: zipfile.ZipInfo) -> Optional[Path]:
+    """Блоб с теми же CRC32 и размером, если он уже есть в хранилище."""
+    try:
+        digest = _blob_ref(info).read_text(encoding="ascii").strip()
+        blob = _blob_path(digest)
+        if blob.stat().st_size != info.file_size:
+            return None
+        os.utime(blob)   # свежий mtime — чтобы gc_image_store не удалил его до ссылки
+        return blob
+    except (OSError, ValueError):
+        return None
+
+def store_member(zf: zipfile.ZipFile, info: zipfile.ZipInfo) -> Path:
+    """Кладёт член архива в хранилище (если такого содержимого там ещё нет) и
+    возвращает путь к блобу. Блоб создаётся жёсткой ссылкой на готовый временный
+    файл: одновременные синхронизации нескольких колод не пишут его дважды."""
+    known = _known_blob(info)
+    if known is not None:
+        count("cards_image_store_total", result="reused")
+        return known
+    store = current_deck().image_store
+    store.mkdir(parents=True, exist_ok=True)
+    tmp = store / f".{os.getpid()}.{threading.get_ident()}.tmp"
+    h = hashlib.sha1()
+    try:
+        with zf.open(info) as src, open(tmp, "wb") as out:
+            for chunk in iter(lambda: src.read(DOWNLOAD_CHUNK), b""):
+                h.update(chunk)
+                out.write(chunk)
+            out.flush()
+            os.fsync(out.fileno())
+        blob = _blob_path(h.hexdigest())
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        try:
+            os.link(tmp, blob)
+            count("cards_image_store_total", result="stored")
+        except FileExistsError:
+            count("cards_image_store_total", result="reused")
+    finally:
+        tmp.unlink(missing_ok=True)
+    _write_atomic(_blob_ref(info), h.hexdigest().encode("ascii"), durable=False)
+    return blob
+
+def link_blob(blob: Path, dst: Path) -> None:
+    """Атомарно ставит dst жёсткой ссылкой на blob (или копией, если ссылки не работают)."""
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dst.with_name(f".{dst.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    tmp.unlink(missing_ok=True)
+    try:
+        try:
+            os.link(blob, tmp)
+        except (FileExistsError, FileNotFoundError):
+            raise
+        except OSError:   # EXDEV, EPERM: другая ФС или ссылки запрещены
+            shutil.copyfile(blob, tmp)
+            count("cards_image_store_links_total", kind="copy")
+        else:
+            count("cards_image_store_links_total", kind="link")
+        os.replace(tmp, dst)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+def gc_image_store(max_age: float = IMAGE_STORE_GC_AGE) -> int:
+    """Удаляет блобы, на которые не ссылается ни одна колода (st_nlink == 1) и которые
+    старше max_age, и записи crc/ на них. Возвращает число удалённых блобов."""
+    store = current_deck().image_store
+    if store is None or not store.is_dir():
+        return 0
+    cutoff = time.time() - max_age
+    removed = 0
+    for blob in store.glob("objects/*/*"):
+        try:
+            st = blob.stat()
+            if st.st_nlink == 1 and st.st_mtime < cutoff:
+                blob.unlink()
+                removed += 1
+        except OSError:
+            continue
+    if removed:
+        for ref in store.glob("crc/*"):
+            try:
+                if not _blob_path(ref.read_text(encoding="ascii").strip()).exists():
+                    ref.unlink()
+            except (OSError, ValueError):
+                continue
+    return removed
+
+def image_store_stats(store: Optional[Path] = None) -> Dict[str, Any]:
+    """Блобов и байт в хранилище; shared — блобы, на которые ссылаются несколько колод."""
+    store = store or current_deck().image_store
+    stats = {"path": str(store) if store else None, "blobs": 0, "bytes": 0, "shared": 0}
+    if store is None or not store.is_dir():
+        return stats
+    for blob in store.glob("objects/*/*"):
+        try:
+            st = blob.stat()
+        except OSError:
+            continue
+        stats["blobs"] += 1
+        stats["bytes"] += st.st_size
+        stats["shared"] += st.st_nlink > 2
+    return stats
+
+# ---------- GitHub Sync ----------
+Progress = Callable[[str, int], None]
+
+def _load_sync_state() -> Dict[str, Dict[str, str]]:
+    try:
+        return json.loads(current_deck().sync_state_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+def _save_sync_state(state: Dict[str, Dict[str, str]]) -> None:
+    _write_atomic(current_deck().sync_state_path, json.dumps(state, ensure_ascii=False, indent=2).encode("utf-8"))
+
+def _download_repo_zip(repo: str, branch: str, dest: Path,
+                       validators: Optional[Dict[str, str]] = None,
+                       progress: Optional[Progress] = None) -> Dict[str, Any]:
+    """Скачивает архив в dest кусками по DOWNLOAD_CHUNK. С validators отправляет условный
+    запрос; ответ 304 возвращается как not_modified без записи файла."""
+    import urllib.request   # http.client и ssl нужны только здесь
+    url = GITHUB_ARCHIVE_URL.format(repo=repo, branch=branch)
+    req = urllib.request.Request(url)
+    if validators:
+        if validators.get("etag"):
+            req.add_header("If-None-Match", validators["etag"])
+        if validators.get("last_modified"):
+            req.add_header("If-Modified-Since", validators["last_modified"])
+    started = time.monotonic()
+    size = 0
+    try:
+        with urllib.request.urlopen(req, timeout=60) as resp, open(dest, "wb") as out:
+            if progress and resp.headers.get("Content-Length", "").isdigit():
+                progress("total_bytes", int(resp.headers["Content-Length"]))
+            while True:
+                chunk = resp.read(DOWNLOAD_CHUNK)
+                if not chunk:
+                    break
+                out.write(chunk)
+                size += len(chunk)
+                if progress:
+                    progress("bytes", size)
+            headers = resp.headers
+    except urllib.error.HTTPError as e:
+        if e.code != 304:
+            raise
+        return {"not_modified": True, "bytes": 0, "seconds": time.monotonic() - started, "validators": validators}
+    return {
+        "not_modified": False,
+        "bytes": size,
+        "seconds": time.monotonic() - started,
+        "validators": {"etag": headers.get("ETag") or "", "last_modified": headers.get("Last-Modified") or ""},
+    }
+
+def _file_crc32(path: Path) -> int:
+    crc = 0
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK), b""):
+            crc = zlib.crc32(chunk, crc)
+    return crc
+
+def _load_manifest() -> Dict[str, Dict[str, int]]:
+    try:
+        return json.loads(current_deck().sync_manifest_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return {}
+
+def _save_manifest(manifest: Dict[str, Dict[str, int]]) -> None:
+    _write_atomic(current_deck().sync_manifest_path, json.dumps(manifest, ensure_ascii=False, indent=1, sort_keys=True).encode("utf-8"))
+
+def _member_unchanged(dst: Path, info: zipfile.ZipInfo, entry: Optional[Dict[str, int]]) -> bool:
+    """Совпадает ли локальный файл с членом архива. Если файл не трогали после прошлой
+    синхронизации (size/mtime как в манифесте), хватает CRC из центрального каталога ZIP;
+    иначе CRC локального файла пересчитывается — архив при этом не распаковывается."""
+    try:
+        st = dst.stat()
+    except FileNotFoundError:
+        return False
+    if st.st_size != info.file_size:
+        return False
+    if entry and entry.get("mtime_ns") == st.st_mtime_ns and entry.get("size") == st.st_size:
+        return entry.get("crc") == info.CRC
+    return _file_crc32(dst) == info.CRC
+
+def _write_member(zf: zipfile.ZipFile, info: zipfile.ZipInfo, dst: Path) -> None:
+    """Распаковывает член архива во временный файл рядом с dst и атомарно подменяет dst
+    (fsync перед rename — после сбоя на месте будет либо старый, либо новый файл).
+    Картинки при заданном IMAGE_STORE идут через общее хранилище."""
+    deck = current_deck()
+    if deck.image_store is not None and deck.images in dst.parents:
+        link_blob(store_member(zf, info), dst)
+        return
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dst.with_name(f".{dst.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with zf.open(info) as src, open(tmp, "wb") as out:
+            shutil.copyfileobj(src, out, DOWNLOAD_CHUNK)
+            out.flush()
+            os.fsync(out.fileno())
+        os.replace(tmp, dst)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+def _sync_targets(zf: zipfile.ZipFile) -> List[Tuple[zipfile.ZipInfo, Path]]:
+    """Члены архива, которые нужно синхронизировать, и их локальные пути."""
+    infos = zf.infolist()
+    if not infos:
+        return []
+    # Имя корневой папки в архиве, например YGsere-main/
+    root = infos[0].filename.split('/')[0]
+    cards_member = f"{root}/data/cards.js"
+    prefix = f"{root}/client/public/cataclysms/"
+    deck = current_deck()
+    images_root = deck.images.resolve()
+    targets: List[Tuple[zipfile.ZipInfo, Path]] = []
+    for info in infos:
+        name = info.filename
+        if name == cards_member:
+            targets.append((info, deck.path))
+        elif name.startswith(prefix) and not info.is_dir():
+            rel = name[len(prefix):]
+            dst = (deck.images / rel).resolve()
+            if rel and images_root in dst.parents:
+                targets.append((info, dst))
+    return targets
+
+def _extract_and_copy(zip_path: Path, prune: bool = False, workers: int = SYNC_WORKERS,
+                      progress: Optional[Progress] = None) -> int:
+    """Копирует data/cards.js и client/public/cataclysms/* из архива репо в локальные папки.
+
+    Изменения определяются по манифесту (size, CRC32, mtime) и центральному каталогу ZIP:
+    распаковываются и пишутся только изменившиеся файлы. prune=True удаляет картинки,
+    которые раньше пришли из архива, а теперь из него пропали. Проверка, распаковка и
+    запись идут в пуле из workers потоков; у каждого потока свой дескриптор архива.
+    """
+    deck = current_deck()
+    manifest = _load_manifest()
+    new_manifest: Dict[str, Dict[str, int]] = {}
+    deck.images.mkdir(parents=True, exist_ok=True)
+    with zipfile.ZipFile(zip_path) as zf:
+        targets = _sync_targets(zf)
+    if progress:
+        progress("files_total", len(targets))
+
+    local = threading.local()
+    handles: List[zipfile.ZipFile] = []
+    handles_lock = threading.Lock()
+
+    def sync_one(target: Tuple[zipfile.ZipInfo, Path]) -> Tuple[str, Dict[str, int], bool]:
+        info, dst = target
+        key = str(dst)
+        written = False
+        if not _member_unchanged(dst, info, manifest.get(key)):
+            zf = getattr(local, "zf", None)
+            if zf is None:
+                zf = local.zf = zipfile.ZipFile(zip_path)
+                with handles_lock:
+                    handles.append(zf)
+            _write_member(zf, info, dst)
+            written = True
+        st = dst.stat()
+        if progress:
+            progress("file", int(written))
+        return key, {"size": st.st_size, "crc": info.CRC, "mtime_ns": st.st_mtime_ns}, written
+
+    try:
+        if workers > 1 and len(targets) > 1:
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cards-sync") as pool:
+                results = list(pool.map(in_deck(sync_one), targets))
+        else:
+            results = [sync_one(t) for t in targets]
+    finally:
+        for zf in handles:
+            zf.close()
+    # результаты собираются в порядке архива, поэтому счётчик и манифест детерминированы
+    changed = 0
+    for key, entry, written in results:
+        new_manifest[key] = entry
+        changed += written
+    images_root = str(deck.images.resolve()) + os.sep
+    for key in manifest:
+        if key in new_manifest:
+            continue
+        if prune and key.startswith(images_root):
+            Path(key).unlink(missing_ok=True)
+            changed += 1
+        elif not prune:
+            new_manifest[key] = manifest[key]
+    _save_manifest(new_manifest)
+    if prune and deck.image_store is not None:
+        gc_image_store()
+    return changed
+
+@timed("sync")
+def sync_from_github(repo: Optional[str] = None, branch: Optional[str] = None,
+                     prune: bool = SYNC_PRUNE, progress: Optional[Progress] = None) -> Dict[str, Any]:
+    """Синхронизация с repo@branch (по умолчанию — источник текущей колоды). Возвращает
+    отчёт: changed (обновлено файлов), bytes/seconds (скачано и за сколько), not_modified
+    (архив не менялся, ответ 304). progress(event, value) получает ход работы:
+    total_bytes, bytes, files_total, file."""
+    deck = current_deck()
+    repo, branch = repo or deck.repo, branch or deck.branch
+    key = f"{repo}@{branch}"
+    state = _load_sync_state()
+    # без локального cards.js условный запрос не имеет смысла — качаем заново
+    validators = state.get(key) if deck.path.exists() else None
+    fd, tmp = tempfile.mkstemp(prefix="cards-sync-", suffix=".zip")
+    os.close(fd)
+    try:
+        report = _download_repo_zip(repo, branch, Path(tmp), validators, progress)
+        report["changed"] = 0
+        if not report["not_modified"]:
+            # скачивание идёт без блокировки, подмена файлов — под ней
+            with deck_lock():
+                _record_current("local")
+                try:
+                    report["changed"] = _extract_and_copy(Path(tmp), prune, progress=progress)
+                finally:
+                    invalidate_document()
+                if report["changed"] and deck.path.exists():
+                    text = deck.path.read_text(encoding="utf-8")
+                    _record_history(text, "sync")
+                    _refresh_snapshot(text)
+                state = _load_sync_state()   # могла обновиться другим процессом за время скачивания
+                state[key] = report["validators"]
+                _save_sync_state(state)
+            # варианты новых картинок готовятся в фоне, уже без блокировки колоды
+            if report["changed"]:
+                schedule_images()
+    finally:
+        os.unlink(tmp)
+    del report["validators"]
+    count("cards_sync_bytes_total", report["bytes"])
+    count("cards_sync_files_changed_total", report["changed"])
+    return report
+
+def format_sync_report(report: Dict[str, Any]) -> str:
+    if report["not_modified"]:
+        return f"Архив не изменился (304), за {report['seconds']:.2f} с"
+    return (f"Обновлено файлов: {report['changed']}, скачано {report['bytes'] / 1024:.0f} КБ "
+            f"за {report['seconds']:.2f} с")
+
+# ---------- Фоновые задачи синхронизации ----------
+# Синхронизация идёт в отдельном потоке; задачи выполняются по одной (все пишут в одни
+# и те же файлы), повторный запрос того же repo@branch возвращает уже идущую задачу.
+# Задачи у каждой колоды свои (DeckState.sync_jobs), пул потоков общий. Снимки задач
+# дублируются в DeckState.jobs_dir: при нескольких воркерах опрос /sync/<id> может
+# прийти не в тот процесс, где задача идёт.
+SYNC_JOBS_KEEP = 50
+SYNC_JOB_SAVE_EVERY = 0.5   # с, не чаще — снимок хода задачи на диск
+_JOB_ID_RE = re.compile(r"[0-9a-f]{12}")
+_JOBS_LOCK = threading.Lock()
+_SYNC_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cards-sync-job")
+
+def _save_job(job: Dict[str, Any]) -> None:
+    with _JOBS_LOCK:
+        snapshot = dict(job)
+    try:
+        _write_atomic(current_deck().jobs_dir / f"{snapshot['id']}.json",
+                      json.dumps(snapshot, ensure_ascii=False, default=str).encode("utf-8"), durable=False)
+    except OSError as e:
+        print(f"[WARN] Не удалось сохранить состояние задачи {snapshot['id']}: {e}")
+
+def _prune_saved_jobs() -> None:
+    try:
+        files = sorted(current_deck().jobs_dir.glob("*.json"), key=lambda f: f.stat().st_mtime)
+    except OSError:
+        return
+    for f in files[:max(0, len(files) - SYNC_JOBS_KEEP)]:
+        f.unlink(missing_ok=True)
+
+def _job_progress(job: Dict[str, Any]) -> Progress:
+    saved = [0.0]
+    def update(event: str, value: int) -> None:
+        with _JOBS_LOCK:
+            if event == "file":
+                job["files_done"] += 1
+                job["files_written"] += value
+            else:
+                job[event] = value
+        if time.monotonic() - saved[0] >= SYNC_JOB_SAVE_EVERY:
+            saved[0] = time.monotonic()
+            _save_job(job)
+    return update
+
+def _run_sync_job(job: Dict[str, Any], prune: bool) -> None:
+    with _JOBS_LOCK:
+        job["state"] = "running"
+        job["started"] = time.time()
+    _save_job(job)
+    try:
+        report = sync_from_github(job["repo"], job["branch"], prune, progress=_job_progress(job))
+        with _JOBS_LOCK:
+            job["state"] = "done"
+            job["result"] = report
+            job["message"] = format_sync_report(report)
+    except Exception as e:
+        with _JOBS_LOCK:
+            job["state"] = "failed"
+            job["error"] = str(e)
+    finally:
+        with _JOBS_LOCK:
+            job["finished"] = time.time()
+            active = current_deck().active_sync
+            if active.get(job["key"]) == job["id"]:
+                del active[job["key"]]
+        _save_job(job)
+
+def start_sync_job(repo: str, branch: str, prune: bool = SYNC_PRUNE) -> Dict[str, Any]:
+    """Ставит синхронизацию в очередь и возвращает снимок задачи (или уже идущей для repo@branch)."""
+    key = f"{repo}@{branch}"
+    deck = current_deck()
+    with _JOBS_LOCK:
+        active = deck.active_sync.get(key)
+        if active:
+            return dict(deck.sync_jobs[active])
+        job = {"id": uuid.uuid4().hex[:12], "key": key, "repo": repo, "branch": branch,
+               "state": "queued", "bytes": 0, "total_bytes": None,
+               "files_total": 0, "files_done": 0, "files_written": 0,
+               "created": time.time(), "started": None, "finished": None,
+               "result": None, "message": None, "error": None}
+        deck.sync_jobs[job["id"]] = job
+        deck.active_sync[key] = job["id"]
+        finished = [jid for jid, j in deck.sync_jobs.items() if j["finished"]]
+        for jid in finished[:max(0, len(deck.sync_jobs) - SYNC_JOBS_KEEP)]:
+            del deck.sync_jobs[jid]
+        snapshot = dict(job)
+    _save_job(job)
+    _prune_saved_jobs()
+    _SYNC_EXECUTOR.submit(in_deck(_run_sync_job), job, prune)
+    return snapshot
+
+def sync_job_status(job_id: str) -> Optional[Dict[str, Any]]:
+    with _JOBS_LOCK:
+        job = current_deck().sync_jobs.get(job_id)
+        if job:
+            return dict(job)
+    if not _JOB_ID_RE.fullmatch(job_id):
+        return None
+    try:   # задача другого воркера
+        return json.loads((current_deck().jobs_dir / f"{job_id}.json").read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+# ---------- Общие утилиты ----------
+@timed("load_text")
+def load_text() -> str:
+    path = current_deck().path
+    # Автоподкачка, если файла нет
+    if not path.exists():
+        try:
+            report = sync_from_github()
+            print(f"[INFO] Автоскачивание из GitHub: {format_sync_report(report)}")
+        except Exception as e:
+            raise FileNotFoundError(f"Не найден {path}, и не удалось скачать: {e}")
+    text = path.read_text(encoding="utf-8")
+    count("cards_bytes_read_total", path.stat().st_size)
+    return text
+
+def _fsync_dir(path: Path) -> None:
+    """fsync каталога — чтобы после сбоя питания переименование не потерялось."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:   # Windows не открывает каталоги
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def _write_atomic(path: Path, data: bytes, durable: bool = True) -> None:
+    """Пишет файл целиком или никак: временный файл рядом, fsync, rename поверх.
+    durable=False — без fsync (для кэшей, которые можно пересчитать)."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=f".{path.name}.", dir=path.parent)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            if durable:
+                f.flush()
+                os.fsync(f.fileno())
+        # mkstemp создаёт файл с правами 0600 — оставляем права заменяемого файла
+        try:
+            os.chmod(tmp, path.stat().st_mode & 0o7777)
+        except FileNotFoundError:
+            os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    if durable:
+        _fsync_dir(path.parent)
+
+# ---------- Блокировка записи ----------
+# Чтение-изменение-запись cards.js идёт под deck_lock(): RLock сериализует потоки
+# процесса, flock на DeckState.lock_path — процессы (воркеры gunicorn, CLI, синхронизация).
+# Блокировка у каждой колоды своя и реентерабельна: save_text() внутри уже взятой
+# блокировки её не ждёт.
+LOCK_TIMEOUT = float(os.environ.get("CARDS_LOCK_TIMEOUT") or 30)
+
+class DeckLockTimeout(RuntimeError):
+    """Другой процесс держит блокировку cards.js дольше LOCK_TIMEOUT."""
+
+def _lock_file(path: Path) -> Any:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    f = open(path, "a+b")
+    if fcntl is None:
+        return f
+    deadline = time.monotonic() + LOCK_TIMEOUT
+    while True:
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return f
+        except BlockingIOError:
+            if time.monotonic() >= deadline:
+                f.close()
+                raise DeckLockTimeout(f"cards.js занят другим процессом дольше {LOCK_TIMEOUT:.0f} с")
+            time.sleep(0.02)
+
+@contextmanager
+def deck_lock() -> Iterator[None]:
+    """Эксклюзивный доступ к cards.js на время чтения-изменения-записи."""
+    deck = current_deck()
+    state = deck.lock_state
+    with deck.write_lock:
+        if state["depth"] == 0:
+            started = time.perf_counter()
+            state["file"] = _lock_file(deck.lock_path)
+            observe("cards_stage_seconds", time.perf_counter() - started, stage="lock_wait")
+        state["depth"] += 1
+        try:
+            yield
+        finally:
+            state["depth"] -= 1
+            if state["depth"] == 0:
+                state["file"].close()   # закрытие снимает flock
+                state["file"] = None
+
+def _commit_text(text: str, source: str) -> None:
+    """Запись cards.js и версии в историю; вызывается под deck_lock()."""
+    # правки мимо редактора (git pull, ручные) попадают в историю до перезаписи
+    _record_current("external")
+    path = current_deck().path
+    _write_atomic(path, text.encode("utf-8"))
+    count("cards_bytes_written_total", path.stat().st_size)
+    if STORAGE == "shards":
+        _save_build(text)
+    invalidate_document()
+    _record_history(text, source)
+
+@timed("save_text")
+def save_text(text: str, source: str = "save") -> None:
+    """Весь cards.js целиком. В режиме шардов текст ещё и раскладывается по шардам."""
+    with deck_lock():
+        if STORAGE == "shards":
+            write_shards(split_shards(text), prune=True)
+        _commit_text(text, source)
+    _refresh_snapshot(text)
+    _refresh_search(text)
+
+# ---------- Индекс блоков cards.js ----------
+# Один проход по файлу: строки (с экранированием) и комментарии поглощаются
+# регулярным выражением целиком, наружу выходят только скобки. По ним строится
+# индекс всех 'const NAME = [...]' верхнего уровня; парсеры и замены читают его.
+_STR = r"""'[^'\\\n]*(?:\\.[^'\\\n]*)*'|"[^"\\\n]*(?:\\.[^"\\\n]*)*"|`[^`\\]*(?:\\.[^`\\]*)*`"""
+_COM = r"//[^\n]*|/\*.*?(?:\*/|\Z)"
+_BRACKET_RE = re.compile(rf"""(?:[^\[\]{{}}()'"`/]++|{_STR}|{_COM}|['"`/])*+([\[\]{{}}()]|\Z)""", re.DOTALL)
+_LITERAL_RE = re.compile(rf"(?P<com>{_COM})|(?P<str>{_STR})|(?P<br>[\[\]{{}}()])", re.DOTALL)
+_DECL_TAIL_RE = re.compile(r"(?<![\w$.])const\s+([A-Za-z_$][\w$]*)\s*=\s*\Z")
+_EXPORTS_TAIL_RE = re.compile(r"(?<![\w$.])module\.exports\s*=\s*\Z")
+_TAIL_WINDOW = 256
+_SEMI_RE = re.compile(r"\s*;")
+_SPACE_RE = re.compile(r"\s*")
+_ESCAPE_RE = re.compile(r"\\(u\{[0-9a-fA-F]+\}|u[0-9a-fA-F]{4}|x[0-9a-fA-F]{2}|\r\n|.)", re.DOTALL)
+_ESCAPES = {"n": "\n", "t": "\t", "r": "\r", "b": "\b", "f": "\f", "v": "\v", "0": "\0",
+            "\n": "", "\r\n": "", "\u2028": "", "\u2029": ""}
+
+class ArraySpan(NamedTuple):
+    """Массив верхнего уровня 'const NAME = [...]'.
+
+    start/end — границы всей декларации (end — после ';'), open/close — позиции
+    скобок. objects — объекты {...} первого уровня, смещения относительно open
+    (так их не нужно пересчитывать при сдвиге блока). nested — внутри есть скобки.
+    """
+    start: int
+    end: int
+    open: int
+    close: int
+    objects: List[Tuple[int, int]]
+    nested: bool
+
+class TextIndex(NamedTuple):
+    spans: Dict[str, ArraySpan]
+    exports: Optional[int]   # позиция 'module.exports = {'
+
+_INDEX_CACHE: "OrderedDict[str, TextIndex]" = OrderedDict()
+_INDEX_CACHE_SIZE = 4
+_INDEX_LOCK = threading.Lock()   # сервер многопоточный: get/move_to_end и popitem не атомарны вместе
+
+def _tokenize(text: str) -> TextIndex:
+    spans: Dict[str, ArraySpan] = {}
+    exports: Optional[int] = None
+    depth = 0
+    cur: Optional[Dict[str, Any]] = None   # текущий массив верхнего уровня
+    obj_start = 0
+    for m in _BRACKET_RE.finditer(text):
+        ch = m.group(1)
+        if not ch:
+            break
+        pos = m.start(1)
+        if ch in "]})":
+            if depth == 0:
+                continue
+            depth -= 1
+            if cur is None:
+                continue
+            if depth == 1 and ch == "}":
+                cur["objects"].append((obj_start - cur["open"], pos + 1 - cur["open"]))
+            elif depth == 0:
+                semi = _SEMI_RE.match(text, pos + 1)
+                span = ArraySpan(cur["start"], semi.end() if semi else pos + 1, cur["open"], pos,
+                                 cur["objects"], cur["nested"])
+                spans.setdefault(cur["name"], span)
+                cur = None
+            continue
+        if depth == 0:
+            lo = max(0, pos - _TAIL_WINDOW)
+            if ch == "[":
+                d = _DECL_TAIL_RE.search(text, lo, pos)
+                if d:
+                    cur = {"name": d.group(1), "start": d.start(), "open": pos,
+                           "objects": [], "nested": False}
+            elif ch == "{" and exports is None:
+                e = _EXPORTS_TAIL_RE.search(text, lo, pos)
+                if e:
+                    exports = e.start()
+        elif cur is not None:
+            cur["nested"] = True
+            if depth == 1 and ch == "{":
+                obj_start = pos
+        depth += 1
+    return TextIndex(spans, exports)
+
+def _top_level_strings(text: str, sp: ArraySpan) -> List[str]:
+    """Строковые литералы первого уровня массива (комментарии и вложенные структуры пропускаются)."""
+    if not sp.nested:
+        return [js_unquote(m.group()) for m in _LITERAL_RE.finditer(text, sp.open + 1, sp.close)
+                if m.lastgroup == "str"]
+    res: List[str] = []
+    depth = 0
+    for m in _LITERAL_RE.finditer(text, sp.open + 1, sp.close):
+        kind = m.lastgroup
+        if kind == "str":
+            if depth == 0:
+                res.append(js_unquote(m.group()))
+        elif kind == "br":
+            depth += 1 if m.group() in "[{(" else -1
+    return res
+
+def _remember_index(text: str, idx: TextIndex) -> TextIndex:
+    with _INDEX_LOCK:
+        _INDEX_CACHE[text] = idx
+        _INDEX_CACHE.move_to_end(text)
+        while len(_INDEX_CACHE) > _INDEX_CACHE_SIZE:
+            _INDEX_CACHE.popitem(last=False)
+    return idx
+
+def index_text(text: str) -> TextIndex:
+    """Индекс массивов верхнего уровня. Повторные вызовы с тем же текстом бесплатны."""
+    with _INDEX_LOCK:
+        idx = _INDEX_CACHE.get(text)
+        if idx is not None:
+            _INDEX_CACHE.move_to_end(text)
+            return idx
+    # токенизация идёт без блокировки: два потока в худшем случае посчитают индекс дважды
+    return _remember_index(text, _tokenize(text))
+
+def _shift(sp: ArraySpan, delta: int) -> ArraySpan:
+    return sp._replace(start=sp.start + delta, end=sp.end + delta,
+                       open=sp.open + delta, close=sp.close + delta)
+
+def _splice(text: str, start: int, end: int, repl: str) -> str:
+    """Заменяет text[start:end] на repl и выводит индекс нового текста из старого:
+    токенизируется только repl, остальные блоки просто сдвигаются."""
+    idx = index_text(text)
+    new_text = text[:start] + repl + text[end:]
+    delta = len(repl) - (end - start)
+    sub = _tokenize(repl)
+    spans: Dict[str, ArraySpan] = {}
+    for name, sp in idx.spans.items():
+        if sp.end <= start:
+            spans[name] = sp
+    for name, sp in sub.spans.items():
+        spans.setdefault(name, _shift(sp, start))
+    for name, sp in idx.spans.items():
+        if sp.start >= end:
+            spans.setdefault(name, _shift(sp, delta))
+    exports = idx.exports
+    if exports is not None and exports >= end:
+        exports += delta
+    elif exports is None or exports >= start:
+        exports = None if sub.exports is None else sub.exports + start
+    _remember_index(new_text, TextIndex(spans, exports))
+    return new_text
+
+def _insert_block(text: str, block: str) -> str:
+    """Вставляет новый блок перед 'module.exports = {' (если экспорта нет — текст без изменений)."""
+    exports = index_text(text).exports
+    if exports is None:
+        return text
+    return _splice(text, exports, exports, block + "\n\n")
+
+def js_unquote(literal: str) -> str:
+    """Значение JS-строкового литерала (в кавычках) с раскрытием escape-последовательностей."""
+    body = literal[1:-1]
+    if "\\" not in body:
+        return body
+    def repl(m: "re.Match[str]") -> str:
+        seq = m.group(1)
+        if seq in _ESCAPES:
+            return _ESCAPES[seq]
+        if seq[0] == "u" or (seq[0] == "x" and len(seq) == 3):
+            return chr(int(seq[1:].strip("{}"), 16))
+        return seq
+    return _ESCAPE_RE.sub(repl, body)
+
+def js_escape(s: str) -> str:
+    return (s or "").replace("\\", "\\\\").replace("'", "\\'").replace("\r\n", "\n").replace("\n", "\\n")
+
+def find_block(text: str, key: str) -> Optional[Tuple[int, int, str]]:
+    """Возвращает (start, end, inner) для 'const KEY = [ inner ];'"""
+    sp = index_text(text).spans.get(key)
+    if not sp:
+        return None
+    return (sp.start, sp.end, text[sp.open + 1:sp.close])
+
+def extract_verbatim(text: str, key: str) -> Optional[str]:
+    sp = index_text(text).spans.get(key)
+    return text[sp.start:sp.end] if sp else None
+
+def parse_array(text: str, key: str) -> List[str]:
+    sp = index_text(text).spans.get(key)
+    if not sp:
+        return []
+    return _top_level_strings(text, sp)
+
+def format_array_block(key: str, items: List[str]) -> str:
+    inner = ",\n  ".join(f"'{js_escape(s.strip())}'" for s in items if s.strip())
+    return f"const {key} = [\n  {inner}\n];"
+
+def replace_array(text: str, key: str, items: List[str]) -> str:
+    new_block = format_array_block(key, items)
+    sp = index_text(text).spans.get(key)
+    if sp:
+        return _splice(text, sp.start, sp.end, new_block)
+    return _insert_block(text, new_block)
+
+# ---------- Массивы объектов по схеме ----------
+# BUNKERS и CATACLYSMS описаны схемой: имя поля, тип и синонимы, под которыми поле
+# может встретиться в файле. Разбор — один проход по токенам массива (без regex-поиска
+# по каждому полю), запись — по той же схеме, так что чтение и запись не расходятся.
+class Field(NamedTuple):
+    name: str
+    kind: str                        # "str" | "int" | "list" (список строк)
+    aliases: Tuple[str, ...] = ()    # другие имена ключа; основное имя важнее
+    wrap: bool = False               # значение пишется с новой строки (длинные тексты)
+
+OBJECT_SCHEMAS: Dict[str, Tuple[Field, ...]] = {
+    "BUNKERS": (
+        Field("description", "str", wrap=True),
+        Field("items", "list"),
+        Field("sizeM2", "int"),
+        Field("stayText", "str"),
+        Field("foodText", "str"),
+        Field("places", "int"),
+    ),
+    "CATACLYSMS": (
+        Field("id", "str"),
+        Field("title", "str"),
+        Field("description", "str", ("text",), wrap=True),
+        Field("image", "str"),
+    ),
+}
+# Прежние имена констант. Старые версии редактора искали катаклизмы в 'CATAclySMS',
+# не находили настоящий блок и дописывали рядом второй — при записи он убирается.
+LEGACY_NAMES: Dict[str, Tuple[str, ...]] = {"CATACLYSMS": ("CATAclySMS",)}
+# целые поля попадают в бинарный снапшот как int32 — больше этого в колоду не пишется
+INT_FIELD_MAX = 2**31 - 1
+
+_EMPTY: Dict[str, Callable[[], Any]] = {"str": str, "int": int, "list": list}
+# пробелы и запятые поглощаются перед каждым токеном (в объекте после запятой всегда
+# идёт ключ, так что граница поля — следующий 'key:'), прочие символы — последней веткой
+_OBJECT_TOKEN_RE = re.compile(
+    rf"[\s,]*+(?:(?P<com>{_COM})|(?:(?P<str>{_STR})|(?P<word>[A-Za-z_$][\w$]*+))(?P<colon>\s*:)?"
+    rf"|(?P<num>-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?)|(?P<br>[\[\]{{}}()])|.)", re.DOTALL)
+
+@lru_cache(maxsize=None)
+def _field_lookup(name: str) -> Dict[str, Tuple[Field, int]]:
+    """Ключ в файле -> (поле схемы, приоритет): 0 — основное имя, дальше синонимы."""
+    lookup: Dict[str, Tuple[Field, int]] = {}
+    for f in OBJECT_SCHEMAS[name]:
+        for rank, key in enumerate((f.name,) + f.aliases):
+            lookup.setdefault(key, (f, rank))
+    return lookup
+
+def _object_span(idx: TextIndex, name: str) -> Optional[ArraySpan]:
+    sp = idx.spans.get(name)
+    if sp is None:
+        for old in LEGACY_NAMES.get(name, ()):
+            sp = idx.spans.get(old)
+            if sp is not None:
+                break
+    return sp
+
+def _field_value(f: Field, tokens: List[Tuple[str, str]]) -> Any:
+    """Значение поля из токенов (вид, текст) после 'key:'; None — если привести к типу нельзя."""
+    if f.kind == "list":
+        return [js_unquote(raw) for kind, raw in tokens if kind == "str"]
+    if f.kind == "int":
+        for kind, raw in tokens:
+            try:
+                return int(float(js_unquote(raw) if kind == "str" else raw))
+            except ValueError:
+                return None
+        return None
+    parts = [js_unquote(raw) for kind, raw in tokens if kind == "str"]
+    if parts:
+        return "".join(parts)   # 'a' + 'b' склеивается
+    nums = [raw for kind, raw in tokens if kind == "num"]
+    return nums[0] if nums else None
+
+def parse_objects(text: str, name: str) -> List[Dict[str, Any]]:
+    """Объекты массива name по схеме OBJECT_SCHEMAS[name]. Отсутствующие поля получают
+    пустое значение своего типа; незнакомые ключи и вложенные структуры пропускаются."""
+    sp = _object_span(index_text(text), name)
+    if sp is None:
+        return []
+    schema = OBJECT_SCHEMAS[name]
+    lookup = _field_lookup(name)
+    res: List[Dict[str, Any]] = []
+    found: Optional[Dict[str, Tuple[int, Any]]] = None   # поле -> (приоритет, значение)
+    key: Optional[Tuple[Field, int]] = None
+    tokens: List[Tuple[str, str]] = []
+    depth = 0
+    in_list = False
+
+    def commit() -> None:
+        if key is None or found is None:
+            return
+        f, rank = key
+        if f.name in found and found[f.name][0] <= rank:
+            return
+        value = _field_value(f, tokens)
+        if value is not None:
+            found[f.name] = (rank, value)
+
+    for m in _OBJECT_TOKEN_RE.finditer(text, sp.open + 1, sp.close):
+        kind = m.lastgroup
+        if kind is None or kind == "com":
+            continue
+        if kind == "br":
+            ch = m.group(kind)
+            if ch in "[{(":
+                depth += 1
+                if depth == 1:
+                    found = {} if ch == "{" else None
+                    key, tokens = None, []
+                elif depth == 2:
+                    in_list = ch == "[" and key is not None and key[0].kind == "list"
+            else:
+                depth -= 1
+                if depth == 0 and found is not None:
+                    commit()
+                    res.append({f.name: found[f.name][1] if f.name in found else _EMPTY[f.kind]()
+                                for f in schema})
+                    found = None
+            continue
+        if found is None:
+            continue
+        if depth == 1:
+            if m.group("colon"):
+                commit()
+                raw = m.group("word") or js_unquote(m.group("str"))
+                key, tokens = lookup.get(raw), []
+            elif key is not None:
+                tokens.append((kind, m.group(kind)))
+        elif depth == 2 and in_list and kind == "str":
+            tokens.append((kind, m.group(kind)))
+    return res
+
+def _format_value(f: Field, value: Any) -> str:
+    if f.kind == "int":
+        return str(int(value or 0))
+    if f.kind == "list":
+        inner = ", ".join(f"'{js_escape(str(x))}'" for x in (value or []) if str(x).strip())
+        return f"[{inner}]"
+    return f"'{js_escape(str(value or ''))}'"
+
+def format_object(name: str, o: Dict[str, Any]) -> str:
+    """Один объект '{...}' массива name с отступами data/cards.js."""
+    lines = []
+    for f in OBJECT_SCHEMAS[name]:
+        value = _format_value(f, o.get(f.name))
+        lines.append(f"    {f.name}:\n      {value}," if f.wrap else f"    {f.name}: {value},")
+    return "{\n" + "\n".join(lines) + "\n  }"
+
+def format_objects_block(name: str, items: List[Dict[str, Any]]) -> str:
+    """Блок 'const NAME = [...]' в формате data/cards.js (поля — в порядке схемы)."""
+    if not items:
+        return f"const {name} = [];"
+    inner = ",\n  ".join(format_object(name, o) for o in items)
+    return f"const {name} = [\n  {inner},\n];"
+
+# ---------- CATACLYSMS ----------
+def parse_cataclysms(text: str) -> List[Dict[str, str]]:
+    return parse_objects(text, "CATACLYSMS")
+
+def normalize_cataclysms(items: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    """Отбрасывает пустые строки формы и приводит пути картинок к /cataclysms/..."""
+    normalized: List[Dict[str, str]] = []
+    for o in items:
+        idv = (o.get("id","") or "").strip()
+        ttl = (o.get("title","") or "").strip()
+        dsc = (o.get("description","") or "")
+        img = (o.get("image","") or "").strip()
+        if img and not img.startswith("/") and not img.startswith("http"):
+            img = f"/cataclysms/{img}"
+        if any((idv, ttl, dsc.strip(), img)):
+            normalized.append({"id": idv, "title": ttl, "description": dsc.replace("\r\n", "\n"), "image": img})
+    return normalized
+
+def format_cataclysms_block(normalized: List[Dict[str, str]]) -> str:
+    return format_objects_block("CATACLYSMS", normalized)
+
+def replace_cataclysms(text: str, items: List[Dict[str, str]], original_text: str) -> str:
+    normalized = normalize_cataclysms(items)
+    if not normalized:
+        return text
+    return splice_blocks(text, {"CATACLYSMS": format_cataclysms_block(normalized)})
+
+# ---------- BUNKERS ----------
+def parse_bunkers(text: str) -> List[Dict[str, Any]]:
+    return parse_objects(text, "BUNKERS")
+
+def normalize_bunkers(bunkers: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Отбрасывает пустые карточки формы и приводит поля к типам, которые пишутся в файл."""
+    valid: List[Dict[str, Any]] = []
+    for b in bunkers:
+        if any([
+            (b.get("description") or "").strip(),
+            b.get("items"),
+            int(b.get("sizeM2") or 0) > 0,
+            (b.get("stayText") or "").strip(),
+            (b.get("foodText") or "").strip(),
+            int(b.get("places") or 0) > 0,
+        ]):
+            valid.append({
+                "description": str(b.get("description") or "").replace("\r\n", "\n"),
+                "items": [str(x) for x in (b.get("items") or []) if str(x).strip()],
+                "sizeM2": min(max(0, int(b.get("sizeM2") or 0)), INT_FIELD_MAX),
+                "stayText": str(b.get("stayText") or "").replace("\r\n", "\n"),
+                "foodText": str(b.get("foodText") or "").replace("\r\n", "\n"),
+                "places": min(max(0, int(b.get("places") or 0)), INT_FIELD_MAX),
+            })
+    return valid
+
+def format_bunkers_block(valid: List[Dict[str, Any]]) -> str:
+    return format_objects_block("BUNKERS", valid)
+
+def replace_bunkers(text: str, bunkers: List[Dict[str, Any]]) -> str:
+    valid = normalize_bunkers(bunkers)
+    if not valid:
+        return text
+    return splice_blocks(text, {"BUNKERS": format_bunkers_block(valid)})
+
+# ---------- ABILITIES сохранение ----------
+def ensure_abilities_preserved(original_text: str, new_text: str) -> str:
+    if extract_verbatim(new_text, "ABILITIES"):
+        return new_text
+    orig = extract_verbatim(original_text, "ABILITIES")
+    if orig:
+        return _insert_block(new_text, orig)
+    fallback = "const ABILITIES = [\n  // редактор не изменяет этот блок\n];"
+    return _insert_block(new_text, fallback)
+
+# ---------- Компактная модель ----------
+# Модель живёт в кэше документа (и в каждом воркере), поэтому хранится плотно:
+#   списки ARRAY_KEYS — StringList: все строки раздела склеены в одну, границы — в array('I')
+#     (≈4 байта на элемент вместо отдельного str с заголовком ~50–75 байт и указателя в list);
+#   бункеры и катаклизмы — записи со __slots__ (без __dict__ на каждую), items — кортеж;
+#   короткие строки полей (предметы бункеров, stayText, foodText, заголовки) интернируются
+#     через sys.intern: один объект на все бункеры и на все версии колоды в кэше.
+#     Таблица интернирования общая для процесса и сама отпускает строки, на которые
+#     больше никто не ссылается.
+# parse_array/parse_objects по-прежнему возвращают list/dict — компактной модель
+# становится в parse_document и shard_items. Записи читаются как словари
+# (rec["items"], rec.get(...), dict(rec)), но не изменяются: модель общая для запросов.
+INTERN_MAX_LEN = 200   # символов; длинные тексты (описания) уникальны, интернировать их незачем
+
+def _intern(value: Any) -> Any:
+    if isinstance(value, str):
+        return sys.intern(value) if len(value) <= INTERN_MAX_LEN else value
+    if isinstance(value, list):
+        return tuple(_intern(v) for v in value)
+    return value
+
+class StringList(Sequence):
+    """Неизменяемый список строк в одной строке и массиве концов: элемент — срез,
+    создаётся при обращении. Сравнивается со списками и кортежами как список."""
+    __slots__ = ("_data", "_ends")
+
+    def __init__(self, items: Iterable[str] = ()) -> None:
+        items = list(items)
+        self._data = "".join(items)
+        self._ends = array("I", accumulate(map(len, items)))
+
+    def __len__(self) -> int:
+        return len(self._ends)
+
+    def __getitem__(self, i: Any) -> Any:
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        n = len(self._ends)
+        if i < 0:
+            i += n
+        if not 0 <= i < n:
+            raise IndexError("StringList index out of range")
+        end = self._ends[i]
+        return self._data[self._ends[i - 1] if i else 0:end]
+
+    def __iter__(self) -> Iterator[str]:
+        data, start = self._data, 0
+        for end in self._ends:
+            yield data[start:end]
+            start = end
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, StringList):
+            return self._ends == other._ends and self._data == other._data
+        if isinstance(other, (list, tuple)):
+            return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+        return NotImplemented
+
+    __hash__ = None   # type: ignore[assignment]
+
+    def __repr__(self) -> str:
+        return f"StringList({list(self)!r})"
+
+    def nbytes(self) -> int:
+        return sys.getsizeof(self) + sys.getsizeof(self._data) + sys.getsizeof(self._ends)
+
+class Record:
+    """Запись раздела-объекта: поля схемы в слотах. Доступ как к словарю и как к атрибутам
+    (b.description в шаблонах); метода items() нет — это имя поля бункера."""
+    __slots__ = ()
+
+    def __init__(self, values: Dict[str, Any]) -> None:
+        for name in self.__slots__:
+            setattr(self, name, _intern(values.get(name)))
+
+    def __getitem__(self, key: str) -> Any:
+        if key in self.__slots__:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def get(self, key: str, default: Any = None) -> Any:
+        return getattr(self, key) if key in self.__slots__ else default
+
+    def keys(self) -> Tuple[str, ...]:
+        return self.__slots__
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.__slots__)
+
+    def __len__(self) -> int:
+        return len(self.__slots__)
+
+    def __contains__(self, key: Any) -> bool:
+        return key in self.__slots__
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Обычный словарь (списки — list), например для JSON."""
+        values = {k: getattr(self, k) for k in self.__slots__}
+        return {k: list(v) if isinstance(v, tuple) else v for k, v in values.items()}
+
+    def __eq__(self, other: Any) -> bool:
+        if isinstance(other, Record):
+            return type(self) is type(other) and all(getattr(self, k) == getattr(other, k) for k in self.__slots__)
+        if isinstance(other, dict):
+            return self.as_dict() == other
+        return NotImplemented
+
+    __hash__ = None   # type: ignore[assignment]
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.as_dict()!r})"
+
+class Bunker(Record):
+    __slots__ = tuple(f.name for f in OBJECT_SCHEMAS["BUNKERS"])
+
+class Cataclysm(Record):
+    __slots__ = tuple(f.name for f in OBJECT_SCHEMAS["CATACLYSMS"])
+
+RECORD_TYPES: Dict[str, type] = {"BUNKERS": Bunker, "CATACLYSMS": Cataclysm}
+
+def compact_section(name: str, items: List[Any]) -> Any:
+    """Разобранный раздел -> компактный: StringList или список записей."""
+    cls = RECORD_TYPES.get(name)
+    if cls is None:
+        return StringList(items)
+    return [cls(o) for o in items]
+
+def _deep_size(obj: Any, seen: set, shared: Optional[List[int]] = None) -> int:
+    """Память объекта вместе с вложенными; объект, уже учтённый в seen, не считается
+    повторно (shared[0] — сколько таких повторных ссылок на строки встретилось)."""
+    if id(obj) in seen:
+        if shared is not None and isinstance(obj, str):
+            shared[0] += 1
+        return 0
+    seen.add(id(obj))
+    if isinstance(obj, StringList):
+        return obj.nbytes()
+    size = sys.getsizeof(obj)
+    if isinstance(obj, Record):
+        size += sum(_deep_size(getattr(obj, k), seen, shared) for k in obj.__slots__)
+    elif isinstance(obj, (list, tuple)):
+        size += sum(_deep_size(x, seen, shared) for x in obj)
+    elif isinstance(obj, dict):
+        size += sum(_deep_size(k, seen, shared) + _deep_size(v, seen, shared) for k, v in obj.items())
+    return size
+
+def _plain_size(items: Any) -> int:
+    """Сколько тот же раздел занимал бы списком dict/str без интернирования."""
+    size = sys.getsizeof([None] * len(items))
+    for it in items:
+        if isinstance(it, Record):
+            size += sys.getsizeof(dict.fromkeys(it.keys()))
+            for k in it.keys():
+                v = it[k]
+                if isinstance(v, tuple):
+                    size += sys.getsizeof(list(v)) + sum(map(sys.getsizeof, v))
+                else:
+                    size += sys.getsizeof(v)
+        else:
+            size += sys.getsizeof(it)
+    return size
+
+def model_footprint(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """Память модели колоды по разделам: bytes — как хранится, plain_bytes — оценка
+    для list/dict без интернирования, shared_strings — ссылок на уже учтённые строки."""
+    seen: set = set()
+    shared = [0]
+    sections: Dict[str, Dict[str, int]] = {}
+    for name, items in [*doc["arrays"].items(), ("bunkers", doc["bunkers"]), ("cataclysms", doc["cats"])]:
+        sections[name] = {"items": len(items), "bytes": _deep_size(items, seen, shared),
+                          "plain_bytes": _plain_size(items)}
+    text = sys.getsizeof(doc["text"])
+    return {
+        "hash": doc["hash"],
+        "text_bytes": text,
+        "bytes": text + sum(s["bytes"] for s in sections.values()),
+        "plain_bytes": text + sum(s["plain_bytes"] for s in sections.values()),
+        "shared_strings": shared[0],
+        "sections": sections,
+    }
+
+# ---------- Кэш разобранного документа ----------
+# Модель (тексты + разобранные списки) кэшируется по хэшу содержимого, а связь
+# "файл -> хэш" — по (mtime, size). Пока файл не менялся, запрос стоит один stat().
+DOC_CACHE_BUDGET = int(os.environ.get("CARDS_CACHE_BYTES") or 64 * 1024 * 1024)
+DOC_CACHE_STATS: Dict[str, int] = {"hits": 0, "misses": 0, "evictions": 0}
+_DOC_CACHE: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_DOC_LOCK = threading.Lock()
+
+def _section_size(items: Any) -> int:
+    return _deep_size(items, set())
+
+def _model_size(doc: Dict[str, Any]) -> int:
+    """Память модели (строки + контейнеры); общие интернированные строки — один раз."""
+    seen: set = set()
+    sections = [*doc["arrays"].values(), doc["bunkers"], doc["cats"]]
+    return sys.getsizeof(doc["text"]) + sum(_deep_size(items, seen) for items in sections)
+
+_HASH_MEMO: Dict[str, Tuple[Optional[str], str]] = {"last": (None, "")}
+
+def text_hash(text: str) -> str:
+    # один и тот же текст за запрос хэшируется несколько раз (запись, сборка, ETag) —
+    # на колоде в мегабайты encode+sha1 стоит десятки мс
+    last, digest = _HASH_MEMO["last"]
+    if last is not text:
+        digest = hashlib.sha1(text.encode("utf-8")).hexdigest()
+        _HASH_MEMO["last"] = (text, digest)
+    return digest
+
+@timed("parse")
+def parse_document(text: str, digest: Optional[str] = None) -> Dict[str, Any]:
+    doc = {
+        "text": text,
+        "hash": digest or text_hash(text),
+        "arrays": {key: compact_section(key, parse_array(text, key)) for key in ARRAY_KEYS},
+        "bunkers": compact_section("BUNKERS", parse_bunkers(text)),
+        "cats": compact_section("CATACLYSMS", parse_cataclysms(text)),
+    }
+    for key in ARRAY_KEYS:
+        count("cards_items_parsed_total", len(doc["arrays"][key]), section=key)
+    count("cards_items_parsed_total", len(doc["bunkers"]), section="bunkers")
+    count("cards_items_parsed_total", len(doc["cats"]), section="cataclysms")
+    return doc
+
+def invalidate_document() -> None:
+    """Сбрасывает привязку файла к кэшу: следующий load_document() перечитает cards.js."""
+    stat = current_deck().doc_stat
+    with _DOC_LOCK:
+        stat["key"] = None
+        stat["hash"] = None
+
+def cached_document(text: str, digest: Optional[str] = None) -> Dict[str, Any]:
+    """Модель для произвольного текста cards.js через тот же кэш по хэшу."""
+    digest = digest or text_hash(text)
+    with _DOC_LOCK:
+        doc = _DOC_CACHE.get(digest)
+        if doc is not None:
+            DOC_CACHE_STATS["hits"] += 1
+            _DOC_CACHE.move_to_end(digest)
+            return doc
+        DOC_CACHE_STATS["misses"] += 1
+    return _remember_document(parse_document(text, digest))
+
+def _remember_document(doc: Dict[str, Any]) -> Dict[str, Any]:
+    if "size" not in doc:
+        doc["size"] = _model_size(doc)
+    with _DOC_LOCK:
+        _DOC_CACHE[doc["hash"]] = doc
+        total = sum(d["size"] for d in _DOC_CACHE.values())
+        while len(_DOC_CACHE) > 1 and total > DOC_CACHE_BUDGET:
+            _, old = _DOC_CACHE.popitem(last=False)
+            total -= old["size"]
+            DOC_CACHE_STATS["evictions"] += 1
+    return doc
+
+def load_document() -> Dict[str, Any]:
+    """Разобранный cards.js. Результат общий для всех запросов — не изменять."""
+    if STORAGE == "shards":
+        return load_sharded_document()
+    path, stat = current_deck().path, current_deck().doc_stat
+    try:
+        st = path.stat()
+        key: Optional[Tuple[str, int, int]] = (str(path), st.st_mtime_ns, st.st_size)
+    except FileNotFoundError:
+        key = None
+    with _DOC_LOCK:
+        if key is not None and stat["key"] == key and stat["hash"] in _DOC_CACHE:
+            DOC_CACHE_STATS["hits"] += 1
+            _DOC_CACHE.move_to_end(stat["hash"])
+            return _DOC_CACHE[stat["hash"]]
+
+    text = load_text()
+    digest = text_hash(text)
+    doc = cached_document(text, digest)
+    if key is None:
+        try:
+            st = path.stat()
+            key = (str(path), st.st_mtime_ns, st.st_size)
+        except FileNotFoundError:
+            pass
+    with _DOC_LOCK:
+        stat["key"] = key
+        stat["hash"] = digest
+    return doc
+
+def doc_cache_stats() -> Dict[str, Any]:
+    with _DOC_LOCK:
+        return dict(DOC_CACHE_STATS, entries=len(_DOC_CACHE),
+                    bytes=sum(d["size"] for d in _DOC_CACHE.values()), budget=DOC_CACHE_BUDGET)
+
+# ---------- Инкрементальное сохранение ----------
+@timed("diff")
+def diff_sections(doc: Dict[str, Any], arrays: Dict[str, List[str]],
+                  bunkers: List[Dict[str, Any]], cats: List[Dict[str, str]]) -> Dict[str, List[Any]]:
+    """Сравнивает присланную модель с разобранной и возвращает {NAME: элементы}
+    (нормализованные) только для изменившихся секций."""
+    changes: Dict[str, List[Any]] = {}
+    for key in ARRAY_KEYS:
+        if key not in arrays:
+            continue
+        items = [s.strip() for s in arrays[key] if s.strip()]
+        if items != [s.strip() for s in doc["arrays"].get(key, []) if s.strip()]:
+            changes[key] = items
+    valid = normalize_bunkers(bunkers)
+    if valid and valid != normalize_bunkers(doc["bunkers"]):
+        changes["BUNKERS"] = valid
+    normalized = normalize_cataclysms(cats)
+    if normalized and normalized != normalize_cataclysms(doc["cats"]):
+        changes["CATACLYSMS"] = normalized
+    return changes
+
+def diff_blocks(doc: Dict[str, Any], arrays: Dict[str, List[str]],
+                bunkers: List[Dict[str, Any]], cats: List[Dict[str, str]]) -> Dict[str, str]:
+    """То же, что diff_sections, но {NAME: новый блок}, собранный правкой старого."""
+    return {name: edit_block(doc["text"], name, items)
+            for name, items in diff_sections(doc, arrays, bunkers, cats).items()}
+
+def _block_version(block: str) -> str:
+    return hashlib.sha1(block.encode("utf-8")).hexdigest()[:16]
+
+def section_version(name: str, items: List[Any]) -> str:
+    """Версия раздела — хэш канонического блока (format_*_block) его нормализованных
+    элементов, а не того, что лежит в файле: комментарии и отступы на неё не влияют,
+    и версию присланных формой элементов можно сравнить с версией на диске."""
+    return _block_version(_full_block(name, items))
+
+def section_versions(doc: Dict[str, Any]) -> Dict[str, str]:
+    """Версии всех разделов документа (см. section_version). Форма /full отправляет
+    версии, с которых начиналась правка."""
+    versions = doc.get("versions")
+    if versions is None:
+        versions = {key: section_version(key, [s.strip() for s in doc["arrays"][key] if s.strip()])
+                    for key in ARRAY_KEYS}
+        versions["BUNKERS"] = section_version("BUNKERS", normalize_bunkers(doc["bunkers"]))
+        versions["CATACLYSMS"] = section_version("CATACLYSMS", normalize_cataclysms(doc["cats"]))
+        doc["versions"] = versions
+    return versions
+
+def reconcile_changes(doc: Dict[str, Any], changes: Dict[str, List[Any]],
+                      base: Dict[str, str]) -> Tuple[Dict[str, List[Any]], List[str]]:
+    """Сверяет изменения формы (результат diff_sections) с версиями base, от которых она начиналась.
+    Раздел, который форма не меняла, а кто-то другой уже переписал, из изменений выпадает —
+    иначе форма откатила бы чужую правку. Раздел, изменённый с обеих сторон, — конфликт.
+    Возвращает (что записать, конфликтующие разделы)."""
+    current = section_versions(doc)
+    kept: Dict[str, List[Any]] = {}
+    conflicts: List[str] = []
+    for name, items in changes.items():
+        if name not in base or base[name] == current.get(name):
+            kept[name] = items
+        elif section_version(name, items) != base[name]:
+            conflicts.append(name)
+    return kept, conflicts
+
+@timed("splice")
+def splice_blocks(text: str, blocks: Dict[str, str]) -> str:
+    """Подставляет блоки за один проход; блоки, которых нет в файле, вставляются
+    перед module.exports. Всё остальное остаётся байт в байт."""
+    if not blocks:
+        return text
+    idx = index_text(text)
+    edits: List[Tuple[int, int, str]] = []
+    missing: List[str] = []
+    for name, block in blocks.items():
+        sp = idx.spans.get(name)
+        legacy = [idx.spans[old] for old in LEGACY_NAMES.get(name, ()) if old in idx.spans]
+        if sp is None and legacy:
+            sp = legacy.pop(0)   # блок под старым именем переименовывается
+        if sp:
+            edits.append((sp.start, sp.end, block))
+        else:
+            missing.append(block)
+        for old in legacy:   # дубль под старым именем больше не нужен
+            edits.append((old.start, _SPACE_RE.match(text, old.end).end(), ""))
+    if missing and idx.exports is not None:
+        edits.append((idx.exports, idx.exports, "\n\n".join(missing) + "\n\n"))
+    edits.sort(key=lambda e: e[0])
+    out: List[str] = []
+    pos = 0
+    for start, end, repl in edits:
+        out.append(text[pos:start])
+        out.append(repl)
+        pos = end
+    out.append(text[pos:])
+    return "".join(out)
+
+# Правка раздела поштучно: блок раздела собирается из старого текста, где заменены,
+# удалены или вставлены только изменившиеся элементы (выравнивание — difflib по
+# нормализованным значениям). Нетронутые элементы, комментарии групп ('// Тёмные')
+# и отступы остаются байт в байт. Если блок так собрать нельзя (пустой раздел,
+# старое имя, элементы, которые форма отбросила бы), пишется format_*_block.
+_COMMA_RE = re.compile(r"\s*,")
+
+def _element_spans(text: str, name: str, sp: ArraySpan) -> List[Tuple[int, int, Any]]:
+    """(начало, конец, нормализованное значение) элементов блока; значение None —
+    элемент, который при записи отбросился бы."""
+    if name in OBJECT_SCHEMAS:
+        objects = parse_objects(text[sp.start:sp.end], name) if sp.objects else []
+        if len(objects) != len(sp.objects):
+            return []
+        norm = normalize_bunkers if name == "BUNKERS" else normalize_cataclysms
+        return [(sp.open + a, sp.open + b, (norm([o]) or [None])[0])
+                for (a, b), o in zip(sp.objects, objects)]
+    res: List[Tuple[int, int, Any]] = []
+    depth = 0
+    for m in _LITERAL_RE.finditer(text, sp.open + 1, sp.close):
+        kind = m.lastgroup
+        if kind == "str" and depth == 0:
+            res.append((m.start(), m.end(), js_unquote(m.group()).strip() or None))
+        elif kind == "br":
+            depth += 1 if m.group() in "[{(" else -1
+    return res
+
+def _full_block(name: str, items: List[Any]) -> str:
+    if name in OBJECT_SCHEMAS:
+        return format_objects_block(name, items)
+    return format_array_block(name, items)
+
+def edit_block(text: str, name: str, items: List[Any]) -> str:
+    """Новый блок раздела name (ARRAY_KEYS, BUNKERS, CATACLYSMS) со значениями items
+    (уже нормализованными), собранный правкой только изменившихся элементов."""
+    sp = index_text(text).spans.get(name)
+    if sp is None or not items or any(old in index_text(text).spans for old in LEGACY_NAMES.get(name, ())):
+        return _full_block(name, items)
+    elems = _element_spans(text, name, sp)
+    if not elems or any(v is None for _, _, v in elems):
+        return _full_block(name, items)
+    if name in OBJECT_SCHEMAS:
+        fmt: Callable[[Any], str] = lambda o: format_object(name, o)
+        key: Callable[[Any], str] = lambda o: json.dumps(o, ensure_ascii=False, sort_keys=True)
+    else:
+        fmt = lambda v: f"'{js_escape(v)}'"
+        key = lambda v: v
+    edits: List[Tuple[int, int, str]] = []
+
+    def insert_after(p: int, new: List[Any]) -> None:
+        if p < 0:
+            edits.append((elems[0][0], elems[0][0], "".join(fmt(x) + ",\n  " for x in new)))
+            return
+        if _COMMA_RE.match(text, elems[p][1]):
+            pos = text.index(",", elems[p][1]) + 1
+            edits.append((pos, pos, "".join("\n  " + fmt(x) + "," for x in new)))
+        else:
+            edits.append((elems[p][1], elems[p][1], "".join(",\n  " + fmt(x) for x in new)))
+
+    def delete(a: int, b: int) -> None:
+        # уходят отступ перед элементами и запятая после них; у последнего элемента
+        # без запятой — запятая перед ним
+        k = elems[a][0]
+        while k > sp.open + 1 and text[k - 1].isspace():
+            k -= 1
+        m = _COMMA_RE.match(text, elems[b - 1][1])
+        if m:
+            edits.append((k, text.index(",", elems[b - 1][1]) + 1, ""))
+        elif text[k - 1] == ",":
+            edits.append((k - 1, elems[b - 1][1], ""))
+        else:
+            edits.append((k, elems[b - 1][1], ""))
+
+    matcher = difflib.SequenceMatcher(None, [key(v) for _, _, v in elems], [key(v) for v in items], autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == "equal":
+            continue
+        n = min(i2 - i1, j2 - j1)
+        for k in range(n):
+            edits.append((elems[i1 + k][0], elems[i1 + k][1], fmt(items[j1 + k])))
+        if i2 - i1 > n:
+            delete(i1 + n, i2)
+        elif j2 - j1 > n:
+            insert_after(i1 + n - 1, items[j1 + n:j2])
+    edits.sort(key=lambda e: (e[0], e[1]))
+    out: List[str] = [text[sp.start:edits[0][0]]] if edits else [text[sp.start:sp.end]]
+    for (start, end, repl), nxt in zip(edits, edits[1:] + [(sp.end, sp.end, "")]):
+        if nxt[0] < end:
+            return _full_block(name, items)   # правки пересеклись — не гадаем
+        out += [repl, text[end:nxt[0]]]
+    block = "".join(out)
+    # контроль: блок читается ровно в items, иначе — обычная запись раздела
+    if name in OBJECT_SCHEMAS:
+        got = (normalize_bunkers if name == "BUNKERS" else normalize_cataclysms)(parse_objects(block, name))
+    else:
+        got = [v.strip() for v in parse_array(block, name) if v.strip()]
+    return block if got == items else _full_block(name, items)
+
+# ---------- Шардированное хранилище ----------
+# CARDS_STORAGE=shards: каждый раздел (списки ARRAY_KEYS, BUNKERS, CATACLYSMS,
+# ABILITIES) лежит своим файлом data/cards/<ИМЯ>.js — ровно тот текст блока, что
+# был в cards.js. Всё остальное (шапка, хелперы, module.exports) — в _frame.js,
+# где на месте блоков стоят метки /*@shard:ИМЯ*/. Шард читается и разбирается,
+# только когда изменился его stat(); правка раздела переписывает один шард, а
+# cards.js собирается из шардов склейкой строк (без разбора) как артефакт для игры.
+# cards.js, изменённый мимо редактора (синхронизация, git pull), раскладывается
+# по шардам заново — _build.json помнит, какой cards.js собран последним.
+STORAGE = "shards" if os.environ.get("CARDS_STORAGE") == "shards" else "file"
+SHARD_NAMES: List[str] = ARRAY_KEYS + ["BUNKERS", "CATACLYSMS", "ABILITIES"]
+SHARD_FRAME = "_frame"
+_SHARD_MARK_RE = re.compile(r"/\*@shard:([A-Za-z_$][\w$]*)\*/")
+_SHARD_LOCK = threading.Lock()
+
+def _shard_path(name: str) -> Path:
+    return current_deck().shard_dir / f"{name}.js"
+
+def _build_path() -> Path:
+    return current_deck().shard_dir / "_build.json"
+
+def _stat_key(path: Path) -> Optional[Tuple[int, int, int]]:
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+def _shard_mark(name: str) -> str:
+    return f"/*@shard:{name}*/"
+
+def read_shard(name: str) -> Optional[str]:
+    """Текст шарда (None — такого раздела нет); с диска — только если файл изменился."""
+    path = _shard_path(name)
+    key = _stat_key(path)
+    cache = current_deck().shard_cache
+    with _SHARD_LOCK:
+        entry = cache.get(name)
+        if entry is not None and entry["key"] == key:
+            return entry["text"]
+    text = path.read_text(encoding="utf-8") if key is not None else None
+    with _SHARD_LOCK:
+        cache[name] = {"key": key, "text": text}
+    return text
+
+def shard_items(name: str) -> Any:
+    """Разобранный раздел: список строк, бункеров или катаклизмов. Разбирается
+    только этот шард и только при первом обращении после его изменения."""
+    text = read_shard(name)
+    cache = current_deck().shard_cache
+    with _SHARD_LOCK:
+        entry = cache[name]
+        if "items" in entry and entry["text"] is text:
+            return entry["items"]
+    if name == "BUNKERS":
+        items: Any = parse_bunkers(text) if text else []
+    elif name == "CATACLYSMS":
+        items = parse_cataclysms(text) if text else []
+    else:
+        items = parse_array(text, name) if text else []
+    if name != "ABILITIES":
+        count("cards_items_parsed_total", len(items), section=name.lower() if name in OBJECT_SCHEMAS else name)
+    items = compact_section(name, items)
+    with _SHARD_LOCK:
+        if cache[name]["text"] is text:
+            cache[name]["items"] = items
+            cache[name]["size"] = _section_size(items)
+    return items
+
+def _shard_size(name: str) -> int:
+    with _SHARD_LOCK:
+        return current_deck().shard_cache.get(name, {}).get("size", 0)
+
+def split_shards(text: str) -> Dict[str, str]:
+    """cards.js -> {имя: блок} плюс каркас с метками под именем SHARD_FRAME."""
+    idx = index_text(text)
+    parts: Dict[str, str] = {}
+    edits: List[Tuple[int, int, str]] = []
+    for name in SHARD_NAMES:
+        sp = idx.spans.get(name)
+        if sp is None:
+            sp = next((idx.spans[old] for old in LEGACY_NAMES.get(name, ()) if old in idx.spans), None)
+        if sp is not None:
+            parts[name] = text[sp.start:sp.end]
+            edits.append((sp.start, sp.end, _shard_mark(name)))
+    edits.sort()
+    frame: List[str] = []
+    pos = 0
+    for start, end, mark in edits:
+        frame.append(text[pos:start])
+        frame.append(mark)
+        pos = end
+    frame.append(text[pos:])
+    parts[SHARD_FRAME] = "".join(frame)
+    return parts
+
+def write_shards(parts: Dict[str, str], prune: bool = False) -> List[str]:
+    """Пишет изменившиеся шарды (под deck_lock). Новый раздел получает метку в каркасе
+    перед module.exports. prune — удалить шарды разделов, которых нет в parts.
+    Возвращает имена записанных файлов."""
+    written: List[str] = []
+    frame = parts.get(SHARD_FRAME) or read_shard(SHARD_FRAME) or ""
+    missing = [n for n in parts if n != SHARD_FRAME and _shard_mark(n) not in frame]
+    if missing:
+        frame = splice_blocks(frame, {n: _shard_mark(n) for n in missing})
+    for name, content in {**parts, SHARD_FRAME: frame}.items():
+        if read_shard(name) == content:
+            continue
+        path = _shard_path(name)
+        _write_atomic(path, content.encode("utf-8"))
+        with _SHARD_LOCK:
+            current_deck().shard_cache[name] = {"key": _stat_key(path), "text": content}
+        written.append(name)
+    if prune:
+        for name in SHARD_NAMES:
+            if name not in parts and _shard_path(name).exists():
+                _shard_path(name).unlink()
+                written.append(name)
+    return written
+
+def assemble_shards() -> str:
+    """cards.js из каркаса и шардов — склейка строк, без разбора."""
+    frame = read_shard(SHARD_FRAME) or ""
+    return _SHARD_MARK_RE.sub(lambda m: read_shard(m.group(1)) or "", frame)
+
+def _load_build() -> Dict[str, Any]:
+    try:
+        return json.loads(_build_path().read_text(encoding="utf-8"))
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def _save_build(text: str) -> None:
+    key = _stat_key(current_deck().path)
+    _write_atomic(_build_path(), json.dumps({"hash": text_hash(text), "stat": list(key) if key else None})
+                  .encode("utf-8"), durable=False)
+
+def sync_shards() -> str:
+    """Сводит шарды и cards.js к одному состоянию и возвращает текст колоды.
+    cards.js, записанный не сборкой, раскладывается по шардам; изменённые шарды
+    (ручная правка, git) собираются в новый cards.js."""
+    path = current_deck().path
+    build = _load_build()
+    js_key = _stat_key(path)
+    outside = js_key is not None and list(js_key) != build.get("stat")
+    if outside or read_shard(SHARD_FRAME) is None:
+        if js_key is None:
+            load_text()   # шардов нет — cards.js скачивается из GitHub
+        with deck_lock():
+            build, js_key = _load_build(), _stat_key(path)
+            if list(js_key) != build.get("stat") or read_shard(SHARD_FRAME) is None:
+                text = path.read_text(encoding="utf-8")
+                written = write_shards(split_shards(text), prune=True)
+                _save_build(text)
+                if written:
+                    print(f"[INFO] cards.js разложен по шардам: {', '.join(written)}")
+                return text
+    text = assemble_shards()
+    if js_key is None or text_hash(text) != build.get("hash"):
+        with deck_lock():
+            _commit_text(text, "shards")
+    return text
+
+@timed("parse")
+def parse_shards(text: str, digest: str) -> Dict[str, Any]:
+    """Модель из разобранных шардов: заново разбираются только изменившиеся.
+    Размер модели для бюджета кэша тоже складывается из запомненных размеров шардов."""
+    doc = {
+        "text": text,
+        "hash": digest,
+        "arrays": {key: shard_items(key) for key in ARRAY_KEYS},
+        "bunkers": shard_items("BUNKERS"),
+        "cats": shard_items("CATACLYSMS"),
+    }
+    doc["size"] = sys.getsizeof(text) + sum(_shard_size(n) for n in SHARD_NAMES)
+    return doc
+
+def shards_key() -> Tuple[Optional[Tuple[int, int, int]], ...]:
+    """stat() всех шардов и cards.js: пока он тот же, модель не перечитывается."""
+    return tuple(_stat_key(_shard_path(n)) for n in (SHARD_FRAME, *SHARD_NAMES)) + (_stat_key(current_deck().path),)
+
+def load_sharded_document() -> Dict[str, Any]:
+    key = shards_key()
+    stat = current_deck().doc_stat
+    with _DOC_LOCK:
+        if stat["key"] == key and stat["hash"] in _DOC_CACHE:
+            DOC_CACHE_STATS["hits"] += 1
+            _DOC_CACHE.move_to_end(stat["hash"])
+            return _DOC_CACHE[stat["hash"]]
+    text = sync_shards()
+    digest = text_hash(text)
+    with _DOC_LOCK:
+        doc = _DOC_CACHE.get(digest)
+        if doc is not None:
+            DOC_CACHE_STATS["hits"] += 1
+        else:
+            DOC_CACHE_STATS["misses"] += 1
+    if doc is None:
+        doc = _remember_document(parse_shards(text, digest))
+    # sync_shards мог переписать шарды или cards.js — ключ снимается заново
+    key = shards_key()
+    with _DOC_LOCK:
+        stat["key"] = key
+        stat["hash"] = digest
+    return doc
+
+def save_blocks(doc: Dict[str, Any], blocks: Dict[str, str], source: str = "save") -> str:
+    """Записывает изменённые блоки модели doc и возвращает новый текст cards.js.
+    В режиме файла — splice и запись целиком, в режиме шардов — только шарды этих
+    разделов, cards.js пересобирается из них."""
+    if not blocks:
+        return doc["text"]
+    if STORAGE != "shards":
+        text = ensure_abilities_preserved(doc["text"], splice_blocks(doc["text"], blocks))
+        if text != doc["text"]:
+            save_text(text, source)
+        return text
+    with deck_lock():
+        if not write_shards(blocks):
+            return doc["text"]
+        text = assemble_shards()
+        _commit_text(text, source)
+        # модель нового текста — из шардов, чтобы снапшот и поиск не разбирали cards.js целиком
+        doc = _remember_document(parse_shards(text, text_hash(text)))
+        key, stat = shards_key(), current_deck().doc_stat
+        with _DOC_LOCK:
+            stat["key"] = key
+            stat["hash"] = doc["hash"]
+    _refresh_snapshot(text)
+    _refresh_search(text)
+    return text
+
+# ---------- Снапшот колоды ----------
+# Рядом с cards.js после каждого сохранения и синхронизации пишутся готовые
+# данные колоды, чтобы игровой сервер не исполнял JS-модуль при каждом старте:
+#   cards.snapshot.json — {format, version, hash, source, arrays, abilities, bunkers, cataclysms}
+#   cards.snapshot.bin  — то же в компактном виде (little-endian, читается через mmap):
+#     magic 'CRDSNAP\\0' | u16 версия | u16 резерв | 20 байт sha1 содержимого
+#     u32 число строк | строки: u32 длина + UTF-8 (каждая строка хранится один раз)
+#     u32 число секций | секция: u32 имя | u8 вид | u32 число записей | записи
+#       вид 0 (список строк): u32 строка
+#       вид 1 (бункер):  u32 description, i32 sizeM2, u32 stayText, u32 foodText, i32 places, u32 n, n × u32 items
+#       вид 2 (катаклизм): u32 id, title, description, image
+#   Все "u32 строка" — номера в таблице строк. Записи пишутся 32-битными словами со знаком
+#   (array 'i'): номера строк и счётчики не доходят до 2^31, поэтому для них байты те же, что у u32,
+#   а числа из файла, правленного руками, могут быть и отрицательными. hash — sha1 данных, а не текста:
+#   правка комментария в cards.js снапшот не меняет, и потребителю не нужно перезагружаться.
+SNAPSHOT_ENABLED = os.environ.get("CARDS_SNAPSHOT", "1") != "0"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_MAGIC = b"CRDSNAP\0"
+_SNAP_HEADER = struct.Struct("<8sHH20s")
+_U32 = struct.Struct("<I")
+_SNAP_SECTION = struct.Struct("<IBI")
+_SNAP_STRINGS, _SNAP_BUNKERS, _SNAP_CATACLYSMS = 0, 1, 2
+
+def _snap_int(value: int) -> int:
+    # числа вне int32 из файла, правленного руками, насыщаются: иначе снапшот не записать
+    return max(-INT_FIELD_MAX - 1, min(int(value), INT_FIELD_MAX))
+
+def snapshot_data(text: str) -> Dict[str, Any]:
+    """Данные колоды для снапшота (без служебных полей)."""
+    doc = cached_document(text)
+    return {
+        "arrays": {key: list(doc["arrays"][key]) for key in ARRAY_KEYS},
+        "abilities": parse_array(text, "ABILITIES"),
+        "bunkers": [{"description": b["description"], "items": b["items"], "sizeM2": _snap_int(b["sizeM2"]),
+                     "stayText": b["stayText"], "foodText": b["foodText"], "places": _snap_int(b["places"])}
+                    for b in doc["bunkers"]],
+        "cataclysms": [{k: c[k] for k in ("id", "title", "description", "image")} for c in doc["cats"]],
+    }
+
+def snapshot_hash(data: Dict[str, Any]) -> str:
+    canon = json.dumps(data, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha1(canon.encode("utf-8")).hexdigest()
+
+def encode_snapshot(data: Dict[str, Any], digest: str) -> bytes:
+    # записи пишутся через array('i') в нативном порядке байт
+    if sys.byteorder != "little" or array("i").itemsize != 4:
+        raise RuntimeError("бинарный снапшот поддерживается только на little-endian с 32-битным 'i'")
+    strings: Dict[str, int] = {}
+
+    def sid(s: str) -> int:
+        i = strings.get(s)
+        if i is None:
+            i = strings[s] = len(strings)
+        return i
+
+    sections: List[bytes] = []
+
+    def section(name: str, kind: int, n: int, ids: List[int]) -> None:
+        sections.append(_SNAP_SECTION.pack(sid(name), kind, n) + array("i", ids).tobytes())
+
+    for key in ARRAY_KEYS:
+        section(key, _SNAP_STRINGS, len(data["arrays"][key]), [sid(s) for s in data["arrays"][key]])
+    section("ABILITIES", _SNAP_STRINGS, len(data["abilities"]), [sid(s) for s in data["abilities"]])
+    ids: List[int] = []
+    for b in data["bunkers"]:
+        ids += [sid(b["description"]), b["sizeM2"], sid(b["stayText"]), sid(b["foodText"]),
+                b["places"], len(b["items"])]
+        ids += [sid(s) for s in b["items"]]
+    section("BUNKERS", _SNAP_BUNKERS, len(data["bunkers"]), ids)
+    ids = []
+    for c in data["cataclysms"]:
+        ids += [sid(c["id"]), sid(c["title"]), sid(c["description"]), sid(c["image"])]
+    section("CATACLYSMS", _SNAP_CATACLYSMS, len(data["cataclysms"]), ids)
+
+    out = [_SNAP_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, 0, bytes.fromhex(digest)),
+           _U32.pack(len(strings))]
+    for s in strings:
+        raw = s.encode("utf-8")
+        out += [_U32.pack(len(raw)), raw]
+    out.append(_U32.pack(len(sections)))
+    out += sections
+    return b"".join(out)
+
+def read_snapshot_hash(path: Optional[Path] = None) -> Optional[str]:
+    """Хэш содержимого из заголовка бинарного снапшота (читаются только первые 32 байта);
+    по умолчанию — снапшот текущей колоды."""
+    path = path or current_deck().snapshot_bin_path
+    try:
+        with open(path, "rb") as f:
+            head = f.read(_SNAP_HEADER.size)
+    except OSError:
+        return None
+    if len(head) < _SNAP_HEADER.size:
+        return None
+    magic, version, _, digest = _SNAP_HEADER.unpack(head)
+    if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+        return None
+    return digest.hex()
+
+def load_snapshot(path: Optional[Path] = None) -> Dict[str, Any]:
+    """Читает бинарный снапшот через mmap; формат результата — как в cards.snapshot.json."""
+    path = path or current_deck().snapshot_bin_path
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        magic, version, _, digest = _SNAP_HEADER.unpack_from(mm, 0)
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise ValueError(f"{path}: не снапшот колоды версии {SNAPSHOT_VERSION}")
+        pos = _SNAP_HEADER.size
+        (n,) = _U32.unpack_from(mm, pos)
+        pos += 4
+        strings: List[str] = []
+        for _ in range(n):
+            (ln,) = _U32.unpack_from(mm, pos)
+            strings.append(mm[pos + 4:pos + 4 + ln].decode("utf-8"))
+            pos += 4 + ln
+        (n,) = _U32.unpack_from(mm, pos)
+        pos += 4
+        result: Dict[str, Any] = {"format": "cards-snapshot", "version": version, "hash": digest.hex(),
+                                  "arrays": {}, "abilities": [], "bunkers": [], "cataclysms": []}
+
+        def take(k: int) -> List[int]:
+            nonlocal pos
+            vals = array("i")
+            vals.frombytes(mm[pos:pos + 4 * k])
+            pos += 4 * k
+            return vals.tolist()
+
+        for _ in range(n):
+            name_id, kind, length = _SNAP_SECTION.unpack_from(mm, pos)
+            pos += _SNAP_SECTION.size
+            name = strings[name_id]
+            if kind == _SNAP_STRINGS:
+                items = [strings[i] for i in take(length)]
+                if name == "ABILITIES":
+                    result["abilities"] = items
+                else:
+                    result["arrays"][name] = items
+            elif kind == _SNAP_BUNKERS:
+                for _ in range(length):
+                    desc, size, stay, food, places, k = take(6)
+                    result["bunkers"].append({
+                        "description": strings[desc], "items": [strings[i] for i in take(k)],
+                        "sizeM2": size, "stayText": strings[stay], "foodText": strings[food],
+                        "places": places,
+                    })
+            elif kind == _SNAP_CATACLYSMS:
+                for _ in range(length):
+                    cid, title, desc, image = take(4)
+                    result["cataclysms"].append({"id": strings[cid], "title": strings[title],
+                                                 "description": strings[desc], "image": strings[image]})
+            else:
+                raise ValueError(f"{path}: неизвестный вид секции {kind}")
+    return result
+
+@timed("snapshot")
+def write_snapshot(text: str) -> Optional[str]:
+    """Пишет оба снапшота для текста cards.js. Если данные не изменились — файлы
+    не трогаются. Возвращает хэш содержимого (None, если снапшоты выключены)."""
+    if not SNAPSHOT_ENABLED:
+        return None
+    data = snapshot_data(text)
+    digest = snapshot_hash(data)
+    deck = current_deck()
+    if read_snapshot_hash(deck.snapshot_bin_path) == digest and deck.snapshot_json_path.exists():
+        return digest
+    payload = {"format": "cards-snapshot", "version": SNAPSHOT_VERSION, "hash": digest,
+               "source": text_hash(text), **data}
+    # JSON первым: бинарный заголовок служит признаком того, что оба файла актуальны
+    _write_atomic(deck.snapshot_json_path, json.dumps(payload, ensure_ascii=False).encode("utf-8"), durable=False)
+    _write_atomic(deck.snapshot_bin_path, encode_snapshot(data, digest), durable=False)
+    return digest
+
+def _refresh_snapshot(text: str) -> None:
+    # cards.js уже записан; сбой снапшота не должен срывать сохранение
+    try:
+        write_snapshot(text)
+    except Exception as e:
+        print(f"[WARN] Не удалось записать снапшот колоды: {e}")
+
+# ---------- Симуляция баланса колоды ----------
+# Повторяет раздачу игрового сервера: generateHand() берёт по одной карте из
+# каждого списка ARRAY_KEYS и две разные ABILITIES, generateBunker() — один
+# бункер на комнату. Комнаты разыгрываются пачками массивами NumPy, без цикла
+# по рукам. Одинаковые тексты в списке считаются одной картой, так что
+# повторы в колоде видны как лишние совпадения.
+# Каждая пачка — комнаты на максимальное число игроков; комната из n игроков —
+# первые n мест той же раздачи, поэтому все размеры считаются за один проход.
+SIM_ROOMS = int(os.environ.get("CARDS_SIM_ROOMS") or 1_000_000)
+SIM_MAX_ROOMS = 20_000_000
+# /simulate считается в потоке запроса — для веба потолок ниже, большие прогоны через CLI
+SIM_WEB_MAX_ROOMS = int(os.environ.get("CARDS_SIM_WEB_MAX_ROOMS") or 2_000_000)
+SIM_BATCH_ROOMS = 250_000
+SIM_PLAYERS = list(range(2, 17))  # размеры комнат, как в routes/rooms.js
+SIM_TOP_PAIRS = 5
+
+def _room_places(players: int) -> int:
+    """Мест в бункере, которые сервер назначает комнате (index.js, старт игры)."""
+    return 2 if 3 <= players <= 5 else max(1, players // 2)
+
+def _ideal_collision(distinct: int, players: int) -> float:
+    """Вероятность совпадения при равновероятных distinct разных картах (задача о днях рождения)."""
+    if players > distinct:
+        return 1.0
+    p = 1.0
+    for i in range(players):
+        p *= (distinct - i) / distinct
+    return 1.0 - p
+
+def _batches(rooms: int) -> List[int]:
+    return [min(SIM_BATCH_ROOMS, rooms - i) for i in range(0, rooms, SIM_BATCH_ROOMS)]
+
+def _codes(items: List[str]) -> Tuple[Any, Any]:
+    """Уникальные тексты и номер уникального текста для каждой позиции списка."""
+    distinct, codes = np.unique(np.array(list(items), dtype=object), return_inverse=True)
+    return distinct, codes.astype(_code_dtype(len(items)))
+
+def _code_dtype(size: int) -> Any:
+    # узкий тип — меньше памяти на пачку и быстрее сравнения
+    return np.int16 if size < 2 ** 15 else np.int32
+
+def _count_repeats(seats: List[List[Any]], players: List[int], hits: Dict[int, int], repeats: Dict[int, int]) -> None:
+    """seats[j] — карты j-го места, по вектору длины B на карту. Для каждого n из
+    players добавляет число комнат с совпадением среди первых n мест и число лишних копий."""
+    rows = len(seats[0][0])
+    seen: List[Any] = list(seats[0])
+    hit = np.zeros(rows, dtype=bool)
+    dup = np.zeros(rows, dtype=np.int32)
+    for j in range(1, max(players)):
+        for card in seats[j]:
+            eq = np.zeros(rows, dtype=bool)     # карта уже есть у кого-то из первых j мест
+            for prev in seen:
+                eq |= prev == card
+            hit |= eq
+            dup += eq
+        seen += seats[j]
+        if j + 1 in hits:
+            hits[j + 1] += int(np.count_nonzero(hit))
+            repeats[j + 1] += int(dup.sum())
+
+def _simulate_category(items: List[str], players: List[int], rooms: int,
+                       rng: "np.random.Generator") -> Dict[str, Any]:
+    distinct, codes = _codes(items)
+    counts = np.bincount(codes)
+    hits = dict.fromkeys(players, 0)
+    repeats = dict.fromkeys(players, 0)
+    for b in _batches(rooms):
+        draws = rng.integers(0, len(items), size=(max(players), b), dtype=codes.dtype)
+        if len(distinct) < len(items):    # без повторов номер позиции и есть карта
+            draws = codes[draws]
+        _count_repeats([[seat] for seat in draws], players, hits, repeats)
+    return {
+        "size": len(items),
+        "distinct": len(distinct),
+        "repeated": [str(distinct[i]) for i in np.flatnonzero(counts > 1)],
+        "by_players": {n: {"collision_rate": hits[n] / rooms,
+                           "ideal_rate": _ideal_collision(len(distinct), n),
+                           "mean_repeats": repeats[n] / rooms} for n in players},
+    }
+
+def _simulate_abilities(items: List[str], players: List[int], rooms: int,
+                        rng: "np.random.Generator") -> Dict[str, Any]:
+    distinct, codes = _codes(items)
+    u, size = len(distinct), len(items)
+    # ABILITIES.filter(a => a !== abilityA): для каждой карты A — индексы, из которых тянется B
+    allowed = np.zeros((u, size), dtype=np.int64)
+    allowed_len = np.zeros(u, dtype=np.int64)
+    for c in range(u):
+        idx = np.flatnonzero(codes != c)
+        if not len(idx):          # rest.length === 0 — берём из всего списка
+            idx = np.arange(size)
+        allowed[c, :len(idx)] = idx
+        allowed_len[c] = len(idx)
+
+    n_max = max(players)
+    pair_counts = np.zeros(u * u, dtype=np.int64)
+    hits = dict.fromkeys(players, 0)
+    repeats = dict.fromkeys(players, 0)
+    for b in _batches(rooms):
+        a = codes[rng.integers(0, size, size=(n_max, b), dtype=np.int32)]
+        pick_b = (rng.random((n_max, b)) * allowed_len[a]).astype(np.int64)
+        bb = codes[allowed[a, pick_b]]
+        lo, hi = np.minimum(a, bb), np.maximum(a, bb)
+        pair_counts += np.bincount((lo.astype(np.int64) * u + hi).ravel(), minlength=u * u)
+        _count_repeats([[a[j], bb[j]] for j in range(n_max)], players, hits, repeats)
+    hands = rooms * n_max
+
+    lo_idx, hi_idx = np.triu_indices(u, 1)
+    pairs = pair_counts.reshape(u, u)[lo_idx, hi_idx]
+    share = pairs / hands
+    order = np.argsort(share, kind="stable")
+
+    def row(i: int) -> Dict[str, Any]:
+        return {"a": str(distinct[lo_idx[i]]), "b": str(distinct[hi_idx[i]]), "share": float(share[i])}
+
+    appear = np.bincount(np.concatenate([lo_idx, hi_idx]), weights=np.concatenate([pairs, pairs]),
+                         minlength=u) / hands
+    return {
+        "size": size,
+        "distinct": u,
+        "pairs": len(pairs),
+        "hands": hands,
+        "same_pair_rate": float(pair_counts.reshape(u, u).diagonal().sum() / hands),
+        "pair_share_expected": 1.0 / len(pairs) if len(pairs) else 0.0,
+        "pair_share_min": float(share.min()) if len(share) else 0.0,
+        "pair_share_max": float(share.max()) if len(share) else 0.0,
+        "top": [row(i) for i in order[::-1][:SIM_TOP_PAIRS]],
+        "bottom": [row(i) for i in order[:SIM_TOP_PAIRS]],
+        "per_ability": {str(distinct[i]): float(appear[i]) for i in range(u)},
+        "by_players": {n: {"collision_rate": hits[n] / rooms, "mean_repeats": repeats[n] / rooms}
+                       for n in players},
+    }
+
+def _bunker_places(bunkers: List[Dict[str, Any]], players: List[int]) -> Dict[str, Any]:
+    # бункер тянется один на комнату — распределение мест считается точно, без выборки;
+    # отрицательные места из файла, правленного руками, считаются нулём
+    places = np.array([max(0, int(b.get("places") or 0)) for b in bunkers] or [0])
+    hist = np.bincount(places)
+    res: Dict[str, Any] = {
+        "count": len(bunkers),
+        "places_hist": {int(p): int(c) for p, c in enumerate(hist) if c},
+        "by_players": {},
+    }
+    for n in players:
+        res["by_players"][n] = {
+            "covered_rate": float(np.mean(places >= n)),
+            "survivors_share": float(np.mean(np.minimum(places, n) / n)),
+            "server_places": _room_places(n),
+        }
+    return res
+
+@timed("simulate")
+def simulate_deck(text: str, rooms: int = SIM_ROOMS, players: Optional[List[int]] = None,
+                  seed: Optional[int] = None) -> Dict[str, Any]:
+    """Монте-Карло по колоде: частота совпадений карт в комнате по каждому списку,
+    распределение пар способностей и места в бункере против размера комнаты."""
+    if not _numpy():
+        raise RuntimeError("Для симуляции нужен numpy (pip install numpy)")
+    players = players or SIM_PLAYERS
+    rooms = max(1, min(int(rooms), SIM_MAX_ROOMS))
+    doc = cached_document(text)
+    rng = np.random.default_rng(seed)
+    t0 = time.perf_counter()
+    categories = {key: _simulate_category(doc["arrays"][key], players, rooms, rng)
+                  for key in ARRAY_KEYS if doc["arrays"][key]}
+    abilities = parse_array(text, "ABILITIES")
+    return {
+        "hash": doc["hash"],
+        "rooms": rooms,
+        "players": players,
+        "seed": seed,
+        "categories": categories,
+        "abilities": _simulate_abilities(abilities, players, rooms, rng) if abilities else None,
+        "bunkers": _bunker_places(doc["bunkers"], players),
+        "seconds": time.perf_counter() - t0,
+    }
+
+def parse_players(spec: str) -> List[int]:
+    """'8' | '4,6,8' | '2-16' -> отсортированный список размеров комнат."""
+    out: set = set()
+    for part in (spec or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        lo, _, hi = part.partition("-")
+        a, b = int(lo), int(hi or lo)
+        out.update(range(max(1, a), min(b, 64) + 1))
+    if not out:
+        raise ValueError("нет размеров комнат")
+    return sorted(out)
+
+# ---------- Поиск и похожие записи ----------
+# Инвертированный индекс по всей колоде: слово -> записи, где оно встречается.
+# Индекс строится по разделам (списки ARRAY_KEYS, bunkers, cataclysms); после
+# сохранения перестраиваются только разделы, которые изменились.
+# Запись — (раздел, индекс, предмет): для бункера предмет — номер в items,
+# None — описание; для остальных разделов всегда None.
+SEARCH_LIMIT = 50
+SEARCH_MAX_LIMIT = 500
+DUP_SHINGLE = 3           # символьные n-граммы для MinHash
+DUP_HASHES = 32
+DUP_BANDS = 8             # LSH: 8 полос по 4 хэша — порог около 0.6
+DUP_THRESHOLD = 0.6
+DUP_BUCKET_MAX = 64       # в переполненной корзине сравниваются только соседи
+DUP_CONTAIN_MAX = 8       # "аптечка" ⊂ "аптечка первой помощи" ищется среди коротких записей
+DUP_POSTING_MAX = 2000    # слова чаще этого не годятся для поиска вложений
+_WORD_RE = re.compile(r"\w+")
+_DUP_MASKS = [int.from_bytes(hashlib.sha1(f"minhash-{i}".encode()).digest()[:8], "little")
+              for i in range(DUP_HASHES)]
+_SEARCH_LOCK = threading.Lock()
+# последний отчёт о похожих записях: (хэш документа, порог, лимит) -> отчёт
+_DUP_CACHE: Dict[str, Any] = {"key": None, "report": None}
+_DUP_LOCK = threading.Lock()    # и для _DUP_CACHE, и для подписей разделов индекса
+
+def fold(s: str) -> str:
+    """Нормализация для поиска: без регистра, ё = е."""
+    return s.casefold().replace("ё", "е")
+
+def _search_sections(doc: Dict[str, Any]) -> Dict[str, Any]:
+    secs: Dict[str, Any] = {key: doc["arrays"][key] for key in ARRAY_KEYS}
+    secs["bunkers"] = doc["bunkers"]
+    secs["cataclysms"] = doc["cats"]
+    return secs
+
+def _section_entries(name: str, source: Sequence) -> Tuple[List[Tuple[int, Optional[int]]], Sequence]:
+    if name not in ("bunkers", "cataclysms"):
+        # тексты — сами элементы списка (StringList), без второй копии строк
+        return [(i, None) for i in range(len(source))], source
+    refs: List[Tuple[int, Optional[int]]] = []
+    texts: List[str] = []
+    for i, it in enumerate(source):
+        refs.append((i, None))
+        if name == "bunkers":
+            texts.append(it["description"])
+            for j, s in enumerate(it["items"]):
+                refs.append((i, j))
+                texts.append(s)
+        else:
+            texts.append(f"{it['title']} {it['id']} {it['description']}")
+    return refs, texts
+
+def _build_section(name: str, source: List[Any]) -> Dict[str, Any]:
+    refs, texts = _section_entries(name, source)
+    postings: Dict[str, List[int]] = {}
+    words: List[Tuple[str, ...]] = []
+    for n, text in enumerate(texts):
+        toks = tuple(dict.fromkeys(_WORD_RE.findall(fold(text))))
+        words.append(toks)
+        for t in toks:
+            postings.setdefault(t, []).append(n)
+    return {"source": source, "refs": refs, "texts": texts, "words": words,
+            "postings": postings, "vocab": sorted(postings), "sigs": None}
+
+@timed("search_index")
+def search_index(doc: Dict[str, Any]) -> Dict[str, Dict[str, Any]]:
+    """Индекс, приведённый к doc: перестраиваются только разделы, чьи данные изменились."""
+    index = current_deck().search
+    with _SEARCH_LOCK:
+        for name, source in _search_sections(doc).items():
+            sec = index.get(name)
+            if sec is None or (sec["source"] is not source and sec["source"] != source):
+                index[name] = _build_section(name, source)
+        return dict(index)
+
+def _refresh_search(text: str) -> None:
+    # после сохранения обновляем индекс сразу, но только если им уже пользовались
+    if current_deck().search:
+        search_index(cached_document(text))
+
+def _prefix_hits(sec: Dict[str, Any], prefix: str) -> set:
+    vocab = sec["vocab"]
+    hits: set = set()
+    i = bisect.bisect_left(vocab, prefix)
+    while i < len(vocab) and vocab[i].startswith(prefix):
+        hits.update(sec["postings"][vocab[i]])
+        i += 1
+    return hits
+
+def _entry(name: str, sec: Dict[str, Any], n: int) -> Dict[str, Any]:
+    index, item = sec["refs"][n]
+    return {"section": name, "index": index, "item": item, "text": sec["texts"][n]}
+
+def search_deck(doc: Dict[str, Any], query: str, sections: Optional[List[str]] = None,
+                limit: int = SEARCH_LIMIT) -> Dict[str, Any]:
+    """Записи, где для каждого слова запроса есть слово, начинающееся с него."""
+    terms = list(dict.fromkeys(_WORD_RE.findall(fold(query))))
+    index = search_index(doc)
+    results: List[Dict[str, Any]] = []
+    total = 0
+    if terms:
+        for name, sec in index.items():
+            if sections and name not in sections:
+                continue
+            found: Optional[set] = None
+            for t in sorted(terms, key=len, reverse=True):   # длинный префикс — меньше кандидатов
+                hits = _prefix_hits(sec, t)
+                found = hits if found is None else found & hits
+                if not found:
+                    break
+            if not found:
+                continue
+            total += len(found)
+            for n in sorted(found)[:max(0, limit - len(results))]:
+                results.append(_entry(name, sec, n))
+    return {"query": query, "total": total, "results": results}
+
+# --- похожие записи: MinHash по n-граммам + вложения по словам ---
+def _minhash(text: str) -> Tuple[int, ...]:
+    s = " ".join(_WORD_RE.findall(fold(text)))
+    grams = {s[i:i + DUP_SHINGLE] for i in range(max(1, len(s) - DUP_SHINGLE + 1))}
+    hs = [zlib.crc32(g.encode("utf-8")) * 0x9E3779B97F4A7C15 & 0xFFFFFFFFFFFFFFFF for g in grams]
+    if len(hs) > 8 and _numpy():
+        arr = np.array(hs, dtype=np.uint64)
+        return tuple(np.bitwise_xor.outer(np.array(_DUP_MASKS, dtype=np.uint64), arr).min(axis=1).tolist())
+    return tuple(min(h ^ m for h in hs) for m in _DUP_MASKS)
+
+def _section_sigs(sec: Dict[str, Any]) -> List[Tuple[int, ...]]:
+    # подписи считаются при первом запросе отчёта и живут вместе с разделом индекса
+    with _DUP_LOCK:
+        if sec["sigs"] is None:
+            sec["sigs"] = [_minhash(t) for t in sec["texts"]]
+        return sec["sigs"]
+
+@timed("duplicates")
+def near_duplicates(doc: Dict[str, Any], threshold: float = DUP_THRESHOLD,
+                    limit: int = SEARCH_MAX_LIMIT) -> Dict[str, Any]:
+    """Пары почти одинаковых записей по всей колоде.
+    similar — оценка сходства n-грамм (MinHash) не ниже threshold;
+    contained — все слова короткой записи есть в записи чуть длиннее."""
+    cache_key = (doc["hash"], threshold, limit)
+    with _DUP_LOCK:
+        if _DUP_CACHE["key"] == cache_key:
+            return _DUP_CACHE["report"]
+    index = search_index(doc)
+    entries: List[Tuple[str, int]] = []
+    sigs: List[Tuple[int, ...]] = []
+    start: Dict[str, int] = {}
+    for name, sec in index.items():
+        start[name] = len(entries)
+        entries += [(name, n) for n in range(len(sec["texts"]))]
+        sigs += _section_sigs(sec)
+
+    # пара (a, b), a < b, кодируется числом a * total + b
+    total = len(entries)
+    rows = DUP_HASHES // DUP_BANDS
+    candidates: set = set()
+    for band in range(DUP_BANDS):
+        buckets: Dict[Tuple[int, ...], List[int]] = {}
+        for e, sig in enumerate(sigs):
+            buckets.setdefault(sig[band * rows:(band + 1) * rows], []).append(e)
+        for members in buckets.values():
+            if len(members) < 2:
+                continue
+            if len(members) > DUP_BUCKET_MAX:
+                candidates.update(a * total + b for a, b in zip(members, members[1:]))
+            else:
+                candidates.update(a * total + b for k, a in enumerate(members) for b in members[k + 1:])
+    pairs: Dict[int, Tuple[str, float]] = {}
+    if candidates and _numpy():
+        mat = np.array(sigs, dtype=np.uint64)
+        keys = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+        scores = np.count_nonzero(mat[keys // total] == mat[keys % total], axis=1) / DUP_HASHES
+        ok = scores >= threshold
+        pairs = dict(zip(keys[ok].tolist(), (("similar", s) for s in scores[ok].tolist())))
+    else:
+        for key in candidates:
+            s = sum(x == y for x, y in zip(sigs[key // total], sigs[key % total])) / DUP_HASHES
+            if s >= threshold:
+                pairs[key] = ("similar", s)
+
+    # вложения: короткая запись, все слова которой входят в запись того же раздела
+    for name, sec in index.items():
+        offset = start[name]
+        for n, words in enumerate(sec["words"]):
+            if not words or len(words) > DUP_CONTAIN_MAX:
+                continue
+            rarest = min((sec["postings"][w] for w in words), key=len)
+            if len(rarest) > DUP_POSTING_MAX:
+                continue
+            for m in rarest:
+                other = sec["words"][m]
+                if m == n or len(other) > 2 * len(words) + 2 or not all(w in other for w in words):
+                    continue
+                if len(sec["words"][m]) == len(words) and m < n:
+                    continue          # одинаковый набор слов — пара уже учтена с другой стороны
+                a, b = sorted((offset + n, offset + m))
+                pairs.setdefault(a * total + b, ("contained", len(words) / len(other)))
+
+    def ent(e: int) -> Dict[str, Any]:
+        name, n = entries[e]
+        return _entry(name, index[name], n)
+
+    top = heapq.nsmallest(limit, pairs.items(), key=lambda kv: (-kv[1][1], kv[0]))
+    report = {
+        "threshold": threshold,
+        "entries": total,
+        "total": len(pairs),
+        "pairs": [{"kind": kind, "score": score, "a": ent(p // total), "b": ent(p % total)}
+                  for p, (kind, score) in top],
+    }
+    with _DUP_LOCK:
+        _DUP_CACHE.update(key=cache_key, report=report)
+    return report
+
+# ---------- История правок ----------
+# Каждое сохранение (и каждая синхронизация) записывает версию cards.js в
+# хранилище по содержимому в data/.cards_history:
+#   objects/xx/<sha1> — части файла (объявления верхнего уровня и текст между
+#     ними), zlib. Одинаковая часть хранится один раз. Изменившийся блок по
+#     возможности пишется дельтой по строкам к своей прошлой версии; не чаще
+#     чем через HISTORY_CHAIN_MAX дельт — снова целиком, чтобы восстановление
+#     не разматывало длинные цепочки.
+#   versions.jsonl — по строке на версию: id, time, hash, size, source, tree
+#     (tree — объект со списком частей: строка "имя\tsha1" на часть).
+HISTORY_ENABLED = os.environ.get("CARDS_HISTORY", "1") != "0"
+HISTORY_CHAIN_MAX = 32
+HISTORY_DIFF_CONTEXT = 2
+_HISTORY_LOCK = threading.RLock()
+_OBJ_FULL, _OBJ_DELTA = b"F", b"D"
+_DELTA_HEAD = struct.Struct("<cH20s")     # вид, глубина цепочки, sha1 базы
+
+def _history_segments(text: str) -> List[Tuple[str, str]]:
+    """Текст, разрезанный на объявления верхнего уровня и промежутки между ними."""
+    parts: List[Tuple[str, str]] = []
+    pos = 0
+    for name, sp in sorted(index_text(text).spans.items(), key=lambda kv: kv[1].start):
+        if sp.start > pos:
+            parts.append((f"~{len(parts)}", text[pos:sp.start]))
+        parts.append((name, text[sp.start:sp.end]))
+        pos = sp.end
+    if pos < len(text) or not parts:
+        parts.append((f"~{len(parts)}", text[pos:]))
+    return parts
+
+def _obj_path(digest: str) -> Path:
+    return current_deck().history_dir / "objects" / digest[:2] / digest[2:]
+
+def _encode_delta(base: List[str], new: List[str]) -> List[Any]:
+    """Операции над строками базы: число — скопировать столько строк, -число —
+    пропустить, список — вставить эти строки."""
+    ops: List[Any] = []
+    sm = difflib.SequenceMatcher(None, base, new, autojunk=False)
+    for tag, i1, i2, j1, j2 in sm.get_opcodes():
+        if tag == "equal":
+            ops.append(i2 - i1)
+            continue
+        if i2 > i1:
+            ops.append(-(i2 - i1))
+        if j2 > j1:
+            ops.append(new[j1:j2])
+    return ops
+
+def _apply_delta(base: List[str], ops: List[Any]) -> str:
+    out: List[str] = []
+    pos = 0
+    for op in ops:
+        if isinstance(op, list):
+            out += op
+        elif op >= 0:
+            out += base[pos:pos + op]
+            pos += op
+        else:
+            pos -= op
+    return "".join(out)
+
+@lru_cache(maxsize=64)
+def _read_object(digest: str) -> str:
+    raw = zlib.decompress(_obj_path(digest).read_bytes())
+    if raw[:1] == _OBJ_FULL:
+        return raw[1:].decode("utf-8")
+    _, _, base = _DELTA_HEAD.unpack_from(raw)
+    ops = json.loads(raw[_DELTA_HEAD.size:].decode("utf-8"))
+    return _apply_delta(_read_object(base.hex()).splitlines(keepends=True), ops)
+
+def _object_depth(digest: str) -> int:
+    head = zlib.decompressobj().decompress(_obj_path(digest).read_bytes(), _DELTA_HEAD.size)
+    return _DELTA_HEAD.unpack(head)[1] if head[:1] == _OBJ_DELTA else 0
+
+def _store_object(content: str, base: Optional[str] = None) -> str:
+    digest = hashlib.sha1(content.encode("utf-8")).hexdigest()
+    path = _obj_path(digest)
+    if path.exists():
+        return digest
+    full = zlib.compress(_OBJ_FULL + content.encode("utf-8"), 6)
+    data = full
+    if base and base != digest:
+        depth = _object_depth(base) + 1
+        if depth <= HISTORY_CHAIN_MAX:
+            ops = _encode_delta(_read_object(base).splitlines(keepends=True), content.splitlines(keepends=True))
+            delta = zlib.compress(_DELTA_HEAD.pack(_OBJ_DELTA, depth, bytes.fromhex(base)) +
+                                  json.dumps(ops, ensure_ascii=False, separators=(",", ":")).encode("utf-8"), 6)
+            if len(delta) < len(full):
+                data = delta
+    _write_atomic(path, data)
+    return digest
+
+def _versions_from_end(chunk: int = 64 * 1024) -> Iterator[Dict[str, Any]]:
+    """Записи versions.jsonl от последней к первой: файл читается с конца кусками,
+    без разбора всей истории."""
+    try:
+        f = open(current_deck().history_dir / "versions.jsonl", "rb")
+    except FileNotFoundError:
+        return
+    with f:
+        pos = f.seek(0, os.SEEK_END)
+        head = b""
+        while pos > 0:
+            step = min(chunk, pos)
+            pos -= step
+            f.seek(pos)
+            lines = (f.read(step) + head).split(b"\n")
+            head = lines.pop(0)     # начало строки может лежать в предыдущем куске
+            for line in reversed(lines):
+                if line.strip():
+                    yield json.loads(line)
+        if head.strip():
+            yield json.loads(head)
+
+def _last_version() -> Optional[Dict[str, Any]]:
+    return next(_versions_from_end(), None)
+
+def _history_tree(version: Dict[str, Any]) -> List[Tuple[str, str]]:
+    return [tuple(line.split("\t")) for line in _read_object(version["tree"]).splitlines()]
+
+@timed("history")
+def record_version(text: str, source: str = "save") -> Optional[Dict[str, Any]]:
+    """Записывает версию, если она отличается от последней. Возвращает запись версии."""
+    if not HISTORY_ENABLED:
+        return None
+    digest = text_hash(text)
+    with _HISTORY_LOCK:
+        last = _last_version()
+        if last and last["hash"] == digest:
+            return None
+        prev = dict(_history_tree(last)) if last else {}
+        # дерево — по строке "имя\tsha1" на часть, чтобы и оно хранилось дельтой
+        tree = "".join(f"{name}\t{_store_object(part, prev.get(name))}\n" for name, part in _history_segments(text))
+        version = {
+            "id": (last["id"] + 1) if last else 1,
+            "time": time.time(),
+            "hash": digest,
+            "size": len(text.encode("utf-8")),
+            "source": source,
+            "tree": _store_object(tree, last["tree"] if last else None),
+        }
+        history_dir = current_deck().history_dir
+        history_dir.mkdir(parents=True, exist_ok=True)
+        with open(history_dir / "versions.jsonl", "a", encoding="utf-8") as f:
+            f.write(json.dumps(version, ensure_ascii=False) + "\n")
+        return version
+
+def _record_history(text: str, source: str) -> None:
+    try:
+        record_version(text, source)
+    except Exception as e:
+        print(f"[WARN] Не удалось записать версию в историю: {e}")
+
+def _disk_hash() -> Optional[str]:
+    """Хэш cards.js на диске, если файл (шарды) не менялся с последнего load_document()."""
+    deck = current_deck()
+    if STORAGE == "shards":
+        key: Any = shards_key()
+    else:
+        st = _stat_key(deck.path)
+        key = st and (str(deck.path), st[1], st[2])
+    with _DOC_LOCK:
+        return deck.doc_stat["hash"] if key and deck.doc_stat["key"] == key else None
+
+def _record_current(source: str) -> None:
+    """Сохраняет в историю то, что сейчас лежит на диске (правки мимо редактора,
+    состояние перед синхронизацией)."""
+    path = current_deck().path
+    if not HISTORY_ENABLED or not path.exists():
+        return
+    # файл тот же, что при последнем разборе, и эта версия уже записана — не перечитываем
+    known = _disk_hash()
+    if known is not None:
+        last = _last_version()
+        if last and last["hash"] == known:
+            return
+    _record_history(path.read_text(encoding="utf-8"), source)
+
+def history_version(version_id: int) -> Optional[Dict[str, Any]]:
+    """Версия по номеру. Номера растут к концу файла, поиск идёт с конца: свежие
+    версии, которые открывают чаще всего, находятся без чтения всей истории."""
+    for v in _versions_from_end():
+        if v["id"] == version_id:
+            return v
+        if v["id"] < version_id:
+            break
+    return None
+
+def version_text(version: Dict[str, Any]) -> str:
+    return "".join(_read_object(h) for _, h in _history_tree(version))
+
+def diff_versions(a: Dict[str, Any], b: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Поблочный diff: сравниваются только части, чей sha1 различается."""
+    ta, tb = dict(_history_tree(a)), dict(_history_tree(b))
+    changes: List[Dict[str, Any]] = []
+    for name in list(ta) + [n for n in tb if n not in ta]:
+        ha, hb = ta.get(name), tb.get(name)
+        if ha == hb:
+            continue
+        old = _read_object(ha).splitlines(keepends=True) if ha else []
+        new = _read_object(hb).splitlines(keepends=True) if hb else []
+        changes.append({
+            "block": name,
+            "status": "added" if not ha else "removed" if not hb else "changed",
+            "diff": "".join(difflib.unified_diff(old, new, f"{a['id']}/{name}", f"{b['id']}/{name}",
+                                                 n=HISTORY_DIFF_CONTEXT)),
+        })
+    return changes
+
+# ---------- Картинки катаклизмов ----------
+# Для каждой картинки колоды в кэш кладутся уменьшенные WebP-варианты:
+#   data/.cards_images/xx/<sha1 исходника>/<вариант>.webp
+# Ключ — хэш содержимого, поэтому варианты не устаревают и отдаются с вечным
+# кэшем; изменённый исходник просто получает новый каталог. index.json помнит
+# (size, mtime) -> sha1 и размеры, чтобы не перечитывать мегабайтные JPG.
+IMAGE_VARIANTS: Dict[str, int] = {"thumb": 240, "large": 1280}   # вариант -> макс. сторона, px
+IMAGE_QUALITY = 80
+IMAGE_WARN_BYTES = int(os.environ.get("CARDS_IMAGE_WARN_BYTES") or 500 * 1024)
+IMAGE_WARN_SIDE = 2000
+IMAGE_SUFFIXES = (".jpg", ".jpeg", ".png", ".webp", ".gif")
+IMAGE_URL_PREFIX = "/cataclysms/"
+_IMAGES_LOCK = threading.Lock()
+_IMAGE_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="cards-images")
+
+def _image_index_path() -> Path:
+    return current_deck().image_cache_dir / "index.json"
+
+def _load_image_index() -> Dict[str, Dict[str, Any]]:
+    try:
+        return json.loads(_image_index_path().read_text(encoding="utf-8"))
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def _image_files() -> List[str]:
+    """Картинки колоды — пути относительно её каталога картинок, через '/'."""
+    images = current_deck().images
+    if not images.is_dir():
+        return []
+    return sorted(p.relative_to(images).as_posix() for p in images.rglob("*")
+                  if p.is_file() and p.suffix.lower() in IMAGE_SUFFIXES)
+
+def _variant_path(digest: str, variant: str) -> Path:
+    return current_deck().image_cache_dir / digest[:2] / digest / f"{variant}.webp"
+
+def _process_image(rel: str, old: Optional[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Запись индекса для картинки; недостающие варианты создаются."""
+    path = current_deck().images / rel
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return None
+    if old and old["size"] == st.st_size and old["mtime_ns"] == st.st_mtime_ns:
+        entry = dict(old)
+    else:
+        h = hashlib.sha1()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK), b""):
+                h.update(chunk)
+        entry = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "sha1": h.hexdigest(),
+                 "width": None, "height": None, "variants": {}}
+    if not _pillow():
+        return entry
+    todo = [v for v in IMAGE_VARIANTS if v not in entry["variants"] or not _variant_path(entry["sha1"], v).exists()]
+    if not todo and entry["width"]:
+        return entry
+    try:
+        with Image.open(path) as im:
+            im = ImageOps.exif_transpose(im)
+            entry["width"], entry["height"] = im.size
+            if im.mode not in ("RGB", "RGBA"):
+                im = im.convert("RGBA" if "transparency" in im.info or im.mode in ("LA", "PA") else "RGB")
+            for variant in todo:
+                side = IMAGE_VARIANTS[variant]
+                out = im.copy()
+                out.thumbnail((side, side), Image.LANCZOS)
+                buf = io.BytesIO()
+                out.save(buf, "WEBP", quality=IMAGE_QUALITY, method=4)
+                _write_atomic(_variant_path(entry["sha1"], variant), buf.getvalue(), durable=False)
+                entry["variants"][variant] = {"width": out.width, "height": out.height, "bytes": buf.tell()}
+    except (OSError, ValueError) as e:    # битый или неподдерживаемый файл
+        entry["error"] = str(e)
+    return entry
+
+@timed("images")
+def process_images(names: Optional[List[str]] = None, workers: int = SYNC_WORKERS) -> Dict[str, Dict[str, Any]]:
+    """Обновляет индекс и варианты для names (по умолчанию — для всех картинок
+    колоды) в пуле потоков: декодирование и сжатие Pillow отпускают GIL."""
+    with _IMAGES_LOCK:
+        index = _load_image_index()
+    full = names is None
+    names = _image_files() if full else names
+    if workers > 1 and len(names) > 1:
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="cards-img") as pool:
+            entries = list(pool.map(in_deck(lambda rel: _process_image(rel, index.get(rel))), names))
+    else:
+        entries = [_process_image(rel, index.get(rel)) for rel in names]
+    with _IMAGES_LOCK:
+        index = _load_image_index()
+        for rel, entry in zip(names, entries):
+            if entry is None:
+                index.pop(rel, None)
+            else:
+                index[rel] = entry
+        if full:
+            for rel in set(index) - set(names):
+                del index[rel]
+            # каталоги вариантов, на которые больше не ссылается ни одна картинка
+            live = {e["sha1"] for e in index.values()}
+            for d in current_deck().image_cache_dir.glob("??/*"):
+                if d.is_dir() and d.name not in live:
+                    shutil.rmtree(d, ignore_errors=True)
+        _write_atomic(_image_index_path(), json.dumps(index, ensure_ascii=False, indent=1).encode("utf-8"), durable=False)
+    return index
+
+def _refresh_images(names: Optional[List[str]] = None) -> None:
+    try:
+        process_images(names)
+    except Exception as e:
+        print(f"[WARN] Не удалось обработать картинки: {e}")
+
+def schedule_images() -> None:
+    """Фоновая обработка картинок без вариантов (не чаще одной задачи за раз)."""
+    with _IMAGES_LOCK:
+        job = current_deck().image_job
+        fut = job["future"]
+        if fut is None or fut.done():
+            job["future"] = _IMAGE_EXECUTOR.submit(in_deck(_refresh_images))
+
+def image_urls() -> Dict[str, Dict[str, Any]]:
+    """'/cataclysms/x.jpg' -> {thumb, large, bytes, big}: то, что знает индекс, без обработки.
+    Если в индексе есть не все картинки, их обработка запускается в фоне."""
+    with _IMAGES_LOCK:
+        index = _load_image_index()
+    files = _image_files()
+    if any(rel not in index or len(index[rel]["variants"]) < len(IMAGE_VARIANTS) for rel in files) and _pillow():
+        schedule_images()
+    out: Dict[str, Dict[str, Any]] = {}
+    for rel in files:
+        e = index.get(rel) or {}
+        urls = {v: url_for("image_variant", digest=e["sha1"], variant=v)
+                for v in e.get("variants", {}) if v in IMAGE_VARIANTS}
+        size = e.get("size") or (current_deck().images / rel).stat().st_size
+        out[IMAGE_URL_PREFIX + rel] = dict(urls, bytes=size, big=_image_is_big(e, size))
+    return out
+
+def _image_is_big(entry: Dict[str, Any], size: int) -> bool:
+    return size > IMAGE_WARN_BYTES or max(entry.get("width") or 0, entry.get("height") or 0) > IMAGE_WARN_SIDE
+
+def image_report(doc: Dict[str, Any]) -> Dict[str, Any]:
+    """Картинки: используемые, отсутствующие на диске, лишние и слишком большие."""
+    index = process_images()
+    referenced: Dict[str, List[str]] = {}
+    for c in doc["cats"]:
+        img = c.get("image") or ""
+        if img.startswith(IMAGE_URL_PREFIX):
+            referenced.setdefault(img[len(IMAGE_URL_PREFIX):], []).append(c.get("id") or "")
+    images = []
+    for rel, e in sorted(index.items()):
+        images.append({
+            "path": IMAGE_URL_PREFIX + rel, "bytes": e["size"], "width": e["width"], "height": e["height"],
+            "sha1": e["sha1"], "variants": e["variants"], "error": e.get("error"),
+            "used_by": referenced.get(rel, []), "big": _image_is_big(e, e["size"]),
+        })
+    return {
+        "pillow": _pillow(),
+        "images": images,
+        "missing": [{"path": IMAGE_URL_PREFIX + rel, "used_by": ids}
+                    for rel, ids in sorted(referenced.items()) if rel not in index],
+        "unreferenced": [IMAGE_URL_PREFIX + rel for rel in sorted(index) if rel not in referenced],
+        "oversized": [i["path"] for i in images if i["big"]],
+        "bytes": sum(i["bytes"] for i in images),
+        "variant_bytes": {v: sum(i["variants"].get(v, {}).get("bytes", 0) for i in images) for v in IMAGE_VARIANTS},
+    }
+
+# ---------- Слежение за файлами ----------
+# Фоновый поток замечает изменения cards.js (сохранение в другом окне или воркере,
+# синхронизация, git pull) и картинок колоды. На Linux — inotify через libc,
+# иначе опрос stat() раз в WATCH_POLL. Подписчики (потоки /events) получают
+# события с версиями разделов: вкладка перерисовывает только изменившиеся разделы.
+# У каждой колоды свой поток и свои подписчики (DeckState.watch).
+WATCH_ENABLED = os.environ.get("CARDS_WATCH", "1") != "0"
+WATCH_POLL = float(os.environ.get("CARDS_WATCH_POLL") or 1.0)   # с
+WATCH_DEBOUNCE = 0.1        # с: rename, пачка картинок от синхронизации — одно событие
+WATCH_QUEUE = 32            # событий на подписчика; отстающий теряет старые, последнее — полное
+_IN_MODIFY, _IN_ATTRIB, _IN_CLOSE_WRITE = 0x2, 0x4, 0x8
+_IN_MOVED_FROM, _IN_MOVED_TO, _IN_CREATE, _IN_DELETE = 0x40, 0x80, 0x100, 0x200
+_IN_DELETE_SELF, _IN_MOVE_SELF, _IN_Q_OVERFLOW, _IN_IGNORED, _IN_ISDIR = 0x400, 0x800, 0x4000, 0x8000, 0x40000000
+_IN_MASK = (_IN_CLOSE_WRITE | _IN_ATTRIB | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_CREATE
+            | _IN_DELETE | _IN_DELETE_SELF | _IN_MOVE_SELF)
+_IN_EVENT = struct.Struct("iIII")   # wd, mask, cookie, len (+ имя, дополненное нулями)
+_WATCH_LOCK = threading.Lock()
+
+def subscribe() -> "queue.Queue[Dict[str, Any]]":
+    q: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=WATCH_QUEUE)
+    with _WATCH_LOCK:
+        current_deck().watch["subs"].append(q)
+    return q
+
+def unsubscribe(q: "queue.Queue[Dict[str, Any]]") -> None:
+    subs = current_deck().watch["subs"]
+    with _WATCH_LOCK:
+        if q in subs:
+            subs.remove(q)
+
+def publish(event: Dict[str, Any]) -> None:
+    count("cards_watch_events_total", kind=event["type"])
+    with _WATCH_LOCK:
+        subs = list(current_deck().watch["subs"])
+    for q in subs:
+        while True:
+            try:
+                q.put_nowait(event)
+                break
+            except queue.Full:
+                try:
+                    q.get_nowait()
+                except queue.Empty:
+                    pass
+
+def deck_event(doc: Dict[str, Any], changed: Optional[List[str]] = None) -> Dict[str, Any]:
+    """Событие "deck": хэш файла, версии и размеры всех разделов (по именам блоков)
+    и список изменившихся. Вкладка сверяет версии со своими, поэтому пропущенные
+    события и переподключения ничего не теряют."""
+    versions = section_versions(doc)
+    counts = {key: len(doc["arrays"][key]) for key in ARRAY_KEYS}
+    counts["BUNKERS"] = len(doc["bunkers"])
+    counts["CATACLYSMS"] = len(doc["cats"])
+    return {"type": "deck", "hash": doc["hash"], "versions": versions, "counts": counts,
+            "changed": list(versions) if changed is None else changed}
+
+def _deck_key() -> Any:
+    if STORAGE == "shards":
+        return shards_key()
+    try:
+        st = current_deck().path.stat()
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+def _image_signature() -> Dict[str, Tuple[int, int]]:
+    out: Dict[str, Tuple[int, int]] = {}
+    images = current_deck().images
+    for rel in _image_files():
+        try:
+            st = (images / rel).stat()
+        except FileNotFoundError:
+            continue
+        out[rel] = (st.st_size, st.st_mtime_ns)
+    return out
+
+def check_deck() -> Optional[Dict[str, Any]]:
+    """Перечитывает cards.js, если он изменился, и рассылает разделы, чьи версии сдвинулись."""
+    watch = current_deck().watch
+    key = _deck_key()
+    if key is None or key == watch["key"]:
+        return None
+    invalidate_document()
+    doc = load_document()
+    watch["key"] = _deck_key()   # сборка из шардов могла переписать cards.js
+    if doc["hash"] == watch["hash"]:
+        return None   # touch или запись того же содержимого
+    versions = section_versions(doc)
+    changed = [name for name, v in versions.items() if watch["versions"].get(name) != v]
+    watch["hash"], watch["versions"] = doc["hash"], versions
+    event = deck_event(doc, changed)
+    publish(event)
+    return event
+
+def check_images() -> Optional[Dict[str, Any]]:
+    """Новые, изменённые и удалённые картинки: варианты пересчитываются, вкладкам
+    уходит список путей."""
+    watch = current_deck().watch
+    sig = _image_signature()
+    old = watch["images"]
+    changed = sorted(rel for rel in set(sig) | set(old) if sig.get(rel) != old.get(rel))
+    watch["images"] = sig
+    if not changed:
+        return None
+    process_images(changed)
+    event = {"type": "images", "paths": [IMAGE_URL_PREFIX + rel for rel in changed]}
+    publish(event)
+    return event
+
+def _checked(fn: Callable[[], Any]) -> None:
+    # поток слежения не должен умирать из-за одного неудачного чтения
+    try:
+        fn()
+    except Exception as e:
+        print(f"[WARN] Слежение за файлами: {e}")
+
+def _inotify() -> Any:
+    """libc с inotify_init1 или None (не Linux, нет прав, отключено CARDS_WATCH_POLL_ONLY=1)."""
+    if not sys.platform.startswith("linux") or os.environ.get("CARDS_WATCH_POLL_ONLY") == "1":
+        return None
+    import ctypes
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        libc.inotify_init1, libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+def _read_inotify(fd: int) -> Iterator[Tuple[int, int, str]]:
+    while True:
+        try:
+            buf = os.read(fd, 64 * 1024)
+        except BlockingIOError:
+            return
+        pos = 0
+        while pos < len(buf):
+            wd, mask, _, size = _IN_EVENT.unpack_from(buf, pos)
+            pos += _IN_EVENT.size
+            name = os.fsdecode(buf[pos:pos + size].rstrip(b"\0"))
+            pos += size
+            yield wd, mask, name
+
+def _watch_inotify(libc: Any) -> None:
+    import ctypes
+    deck_state = current_deck()
+    fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    if fd < 0:
+        raise OSError(ctypes.get_errno(), "inotify_init1")
+    data_wd = libc.inotify_add_watch(fd, os.fsencode(deck_state.path.parent), _IN_MASK)
+    if data_wd < 0:
+        os.close(fd)
+        raise OSError(ctypes.get_errno(), f"inotify_add_watch {deck_state.path.parent}")
+    # шарды правятся и руками (git), cards.js тогда пересобирается при чтении
+    shard_wd = (libc.inotify_add_watch(fd, os.fsencode(deck_state.shard_dir), _IN_MASK)
+                if STORAGE == "shards" else -1)
+    image_wds: Dict[int, Path] = {}
+
+    def watch_images(root: Path) -> None:
+        for d in [root, *(p for p in root.rglob("*") if p.is_dir())]:
+            wd = libc.inotify_add_watch(fd, os.fsencode(d), _IN_MASK)
+            if wd >= 0:
+                image_wds[wd] = d
+
+    if deck_state.images.is_dir():
+        watch_images(deck_state.images)
+    # правки между start_watcher() и inotify_add_watch не дали бы событий
+    _checked(check_deck)
+    _checked(check_images)
+    try:
+        while True:
+            ready, _, _ = select.select([fd], [], [], WATCH_POLL)
+            if not ready:
+                if not image_wds and deck_state.images.is_dir():   # каталог создала синхронизация
+                    watch_images(deck_state.images)
+                    _checked(check_images)
+                continue
+            time.sleep(WATCH_DEBOUNCE)
+            deck = images = False
+            for wd, mask, name in _read_inotify(fd):
+                if mask & _IN_Q_OVERFLOW:
+                    deck = images = True
+                elif wd == data_wd:
+                    deck = deck or name == deck_state.path.name
+                elif wd == shard_wd:
+                    deck = deck or (name.endswith(".js") and not name.startswith("."))
+                elif wd in image_wds:
+                    images = True
+                    if mask & _IN_ISDIR and mask & (_IN_CREATE | _IN_MOVED_TO):
+                        watch_images(image_wds[wd] / name)
+                    if mask & _IN_IGNORED:   # каталог удалён
+                        image_wds.pop(wd, None)
+            if deck:
+                _checked(check_deck)
+            if images:
+                _checked(check_images)
+    finally:
+        os.close(fd)
+
+def _watch_poll() -> None:
+    while True:
+        time.sleep(WATCH_POLL)
+        _checked(check_deck)
+        _checked(check_images)
+
+def _watch_loop() -> None:
+    libc = _inotify()
+    if libc is not None:
+        try:
+            _watch_inotify(libc)
+        except OSError as e:   # лимит max_user_watches, нет прав, экзотическая ФС
+            print(f"[WARN] inotify недоступен ({e}), слежение опросом раз в {WATCH_POLL:g} с")
+    current_deck().watch["mode"] = "poll"
+    _watch_poll()
+
+def start_watcher() -> Optional[str]:
+    """Запускает поток слежения (один на колоду) и возвращает режим: inotify или poll.
+    Запускается первым подписчиком, а не при импорте — CLI и тесты за него не платят."""
+    if not WATCH_ENABLED:
+        return None
+    watch = current_deck().watch
+    with _WATCH_LOCK:
+        if watch["thread"] is not None:
+            return watch["mode"]
+        # исходное состояние — чтобы первое событие несло только настоящие изменения
+        watch["key"] = _deck_key()
+        if watch["key"] is not None:
+            doc = load_document()
+            watch["hash"], watch["versions"] = doc["hash"], section_versions(doc)
+        watch["images"] = _image_signature()
+        watch["mode"] = "inotify" if _inotify() is not None else "poll"
+        watch["thread"] = threading.Thread(target=in_deck(_watch_loop), name="cards-watch", daemon=True)
+        watch["thread"].start()
+        return watch["mode"]
+
+# ---------- Несколько колод ----------
+# Рабочее пространство — несколько именованных колод в одном процессе. data/decks.json:
+#   {"default": "main", "image_store": "image-store",
+#    "decks": {"main": {}, "season": {"branch": "season"}, "test": {"repo": "me/fork", "path": "test/cards.js"}}}
+# repo/branch по умолчанию — GITHUB_REPO/GITHUB_BRANCH; path — decks/<имя>/cards.js,
+# images — decks/<имя>/cataclysms; пути относительно папки decks.json. Каждая колода —
+# свой DeckState (файлы, блокировка, задачи, слежение); приложение редактора одно и
+# монтируется на /d/<имя> через deck_app(), который привязывает запросы к колоде.
+# Картинки всех колод идут через одно хранилище image_store. Из консоли: --deck <имя>
+# перед командой.
+DECKS_PATH = Path(os.environ.get("CARDS_DECKS") or (BASE_DIR / "data" / "decks.json")).resolve()
+_DECK_NAME_RE = re.compile(r"[A-Za-z0-9_-]+")
+_DECK_STATES: Dict[str, DeckState] = {}
+_DECKS_LOCK = threading.Lock()
+
+class Deck(NamedTuple):
+    name: str
+    repo: str
+    branch: str
+    path: Path
+    images: Path
+
+def load_workspace(path: Path = DECKS_PATH) -> Dict[str, Any]:
+    """decks.json -> {"path", "decks": {имя: Deck}, "default", "image_store"}; ошибка формата — ValueError."""
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+    except OSError as e:
+        raise ValueError(f"не удалось прочитать {path}: {e}") from e
+    if not isinstance(data, dict) or not isinstance(data.get("decks") or {}, dict):
+        raise ValueError(f"{path}: ожидается объект вида {{\"decks\": {{имя: {{...}}}}}}")
+    root = path.parent
+    decks: Dict[str, Deck] = {}
+    for name, conf in (data.get("decks") or {}).items():
+        if not _DECK_NAME_RE.fullmatch(name):
+            raise ValueError(f"{path}: недопустимое имя колоды {name!r} (латиница, цифры, _ и -)")
+        conf = conf or {}
+        if not isinstance(conf, dict):
+            raise ValueError(f"{path}: колода {name!r} должна быть объектом (repo, branch, path, images), "
+                             f"а не {type(conf).__name__}")
+        decks[name] = Deck(name, conf.get("repo") or GITHUB_REPO, conf.get("branch") or GITHUB_BRANCH,
+                           (root / (conf.get("path") or f"decks/{name}/cards.js")).resolve(),
+                           (root / (conf.get("images") or f"decks/{name}/cataclysms")).resolve())
+    if not decks:
+        raise ValueError(f"{path}: нет ни одной колоды")
+    seen: Dict[Path, str] = {}
+    for deck in decks.values():
+        # у колоды рядом с cards.js лежат история, снапшот и блокировка — общий файл их бы смешал
+        for p in (deck.path, deck.images):
+            if p in seen:
+                raise ValueError(f"{path}: колоды {seen[p]} и {deck.name} используют один путь {p}")
+            seen[p] = deck.name
+    default = data.get("default") or next(iter(decks))
+    if default not in decks:
+        raise ValueError(f"{path}: колоды по умолчанию {default!r} нет в decks")
+    return {"path": path, "decks": decks, "default": default,
+            "image_store": (root / (data.get("image_store") or "image-store")).resolve()}
+
+def load_deck(name: str, workspace: Optional[Dict[str, Any]] = None) -> DeckState:
+    """Состояние колоды name (создаётся один раз на процесс)."""
+    with _DECKS_LOCK:
+        state = _DECK_STATES.get(name)
+        if state is not None:
+            return state
+        ws = workspace or load_workspace()
+        deck = ws["decks"].get(name)
+        if deck is None:
+            raise ValueError(f"колоды {name!r} нет в {ws['path']} (есть: {', '.join(ws['decks'])})")
+        state = _DECK_STATES[name] = DeckState(name, deck.path, deck.images, deck.repo, deck.branch,
+                                               ws["image_store"])
+        return state
+
+# ---------- Пакетный режим (CLI) ----------
+# Правки без браузера: поток операций из JSONL/CSV применяется к модели, разобранной
+# один раз, и записывается одной атомарной записью. Если хоть одна операция не
+# применилась, файл не меняется.
+#
+# Операция: {"op": "add" | "remove" | "replace" | "upsert", "section": ..., ...}
+#   списки (HOBBIES, ...) — value; remove: value или index; replace: index или old + value;
+#       upsert: добавить value, если его ещё нет
+#   bunkers, cataclysms — поля записи; запись ищется по index или ключу (description
+#       у бункера, id у катаклизма; old — прежнее значение ключа, если он меняется);
+#       replace заменяет запись целиком, upsert сливает поля или добавляет новую
+# В CSV те же колонки (op, section, value, old, index, поля записи), items — через '|'.
+BATCH_OPS = ("add", "remove", "replace", "upsert")
+BATCH_SECTIONS: Dict[str, str] = {"bunkers": "BUNKERS", "cataclysms": "CATACLYSMS"}
+BATCH_KEYS: Dict[str, str] = {"bunkers": "description", "cataclysms": "id"}
+BATCH_LIST_SEP = "|"
+_OP_FIELDS = {"op", "section", "value", "old", "index"}
+CLI_COMMANDS = ("apply", "sync", "export", "import", "--deck", "-h", "--help")
+
+class BatchError(ValueError):
+    """Операцию пакета нельзя применить; сообщение начинается с 'файл:строка'."""
+
+def _jsonl_operations(name: str, lines: Any) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    for n, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        try:
+            op = json.loads(line)
+        except ValueError as e:
+            raise BatchError(f"{name}:{n}: неверный JSON ({e})") from None
+        if not isinstance(op, dict):
+            raise BatchError(f"{name}:{n}: ожидается JSON-объект")
+        yield f"{name}:{n}", op
+
+def read_operations(path: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Операции из файла по одной: (место в файле, операция). Формат — по расширению
+    (.csv или JSONL), '-' — JSONL из stdin."""
+    if path == "-":
+        yield from _jsonl_operations("<stdin>", sys.stdin)
+        return
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        if path.lower().endswith(".csv"):
+            yield from _csv_operations(path, f)
+        else:
+            yield from _jsonl_operations(path, f)
+
+def _csv_operations(name: str, lines: Any) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    reader = csv.DictReader(lines)
+    for row in reader:
+        # пустые ячейки — "поле не задано"
+        yield f"{name}:{reader.line_num}", {k.strip(): v for k, v in row.items() if k and v}
+
+def _batch_index(op: Dict[str, Any], items: List[Any]) -> int:
+    try:
+        index = int(op["index"])
+    except (TypeError, ValueError):
+        raise ValueError(f"index должен быть целым числом: {op['index']!r}") from None
+    if not 0 <= index < len(items):
+        raise ValueError(f"нет элемента с индексом {index} (всего {len(items)})")
+    return index
+
+def _batch_record(section: str, op: Dict[str, Any], base: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Запись раздела из полей операции (строки из CSV приводятся к типам схемы)."""
+    schema = OBJECT_SCHEMAS[BATCH_SECTIONS[section]]
+    item = dict(base) if base else {f.name: _EMPTY[f.kind]() for f in schema}
+    for f in schema:
+        if f.name not in op:
+            continue
+        value = op[f.name]
+        if f.kind == "list":
+            if isinstance(value, str):
+                value = value.split(BATCH_LIST_SEP)
+            if not isinstance(value, list):
+                raise ValueError(f"поле {f.name}: ожидается список строк")
+            item[f.name] = [str(x).strip() for x in value if str(x).strip()]
+        elif f.kind == "int":
+            try:
+                item[f.name] = int(value)
+            except (TypeError, ValueError):
+                raise ValueError(f"поле {f.name}: ожидается целое число, получено {value!r}") from None
+        else:
+            item[f.name] = str(value)
+    normalized = normalize_bunkers([item]) if section == "bunkers" else normalize_cataclysms([item])
+    if not normalized:
+        raise ValueError("пустая запись")
+    return normalized[0]
+
+def _find_record(section: str, op: Dict[str, Any], items: List[Dict[str, Any]]) -> Optional[int]:
+    if "index" in op:
+        return _batch_index(op, items)
+    key = BATCH_KEYS[section]
+    wanted = str(op.get("old", op.get(key, ""))).replace("\r\n", "\n").strip()
+    if not wanted:
+        raise ValueError(f"нужен index или {key}")
+    for i, item in enumerate(items):
+        if str(item[key]).strip() == wanted:
+            return i
+    return None
+
+def apply_operation(model: Dict[str, List[Any]], op: Dict[str, Any]) -> None:
+    """Применяет одну операцию к модели {раздел: список}; ValueError — если нельзя."""
+    kind, section = op.get("op"), op.get("section")
+    if kind not in BATCH_OPS:
+        raise ValueError(f"неизвестная операция {kind!r} (допустимо: {', '.join(BATCH_OPS)})")
+    if section not in model:
+        raise ValueError(f"неизвестный раздел {section!r}")
+    items = model[section]
+    if section in ARRAY_KEYS:
+        unknown = set(op) - _OP_FIELDS
+        if unknown:
+            raise ValueError(f"лишние поля для списка: {', '.join(sorted(unknown))}")
+        value = str(op.get("value") or "").strip()
+        if kind == "remove":
+            if "index" in op:
+                del items[_batch_index(op, items)]
+                return
+            kept = [x for x in items if x.strip() != value]
+            if not value or len(kept) == len(items):
+                raise ValueError(f"в {section} нет элемента {value!r}")
+            items[:] = kept
+            return
+        if not value:
+            raise ValueError("нужна непустая строка value")
+        if kind == "add":
+            items.append(value)
+        elif kind == "upsert":
+            if all(x.strip() != value for x in items):
+                items.append(value)
+        elif "index" in op:
+            items[_batch_index(op, items)] = value
+        else:
+            old = str(op.get("old") or "").strip()
+            hits = [i for i, x in enumerate(items) if old and x.strip() == old]
+            if not hits:
+                raise ValueError(f"в {section} нет элемента {old!r} (нужен index или old)")
+            for i in hits:
+                items[i] = value
+        return
+
+    unknown = set(op) - _OP_FIELDS - {f.name for f in OBJECT_SCHEMAS[BATCH_SECTIONS[section]]}
+    if unknown:
+        raise ValueError(f"неизвестные поля: {', '.join(sorted(unknown))}")
+    if kind == "add":
+        items.append(_batch_record(section, op))
+        return
+    i = _find_record(section, op, items)
+    if i is None and kind != "upsert":
+        raise ValueError(f"запись не найдена в {section}")
+    if kind == "remove":
+        del items[i]
+    elif kind == "replace":
+        items[i] = _batch_record(section, op)
+    elif i is None:
+        items.append(_batch_record(section, op))
+    else:
+        items[i] = _batch_record(section, op, items[i])
+
+def _deck_model(doc: Dict[str, Any], sections: Optional[List[str]] = None) -> Dict[str, List[Any]]:
+    """Изменяемая копия модели: {раздел: список}; записи — в нормализованном виде."""
+    model: Dict[str, List[Any]] = {}
+    for name in sections or ARRAY_KEYS + list(BATCH_SECTIONS):
+        if name in ARRAY_KEYS:
+            model[name] = list(doc["arrays"][name])
+        elif name == "bunkers":
+            model[name] = normalize_bunkers(doc["bunkers"])
+        else:
+            model[name] = normalize_cataclysms(doc["cats"])
+    return model
+
+def _write_model(doc: Dict[str, Any], model: Dict[str, List[Any]], dry_run: bool,
+                 source: str) -> Tuple[List[str], bool, str]:
+    """Записывает изменившиеся разделы модели одной записью: (разделы, записано ли, текст)."""
+    # пустые разделы объектов здесь пишутся: в пакете удаление всех записей — намеренное
+    blocks = diff_blocks(doc, {key: model[key] for key in ARRAY_KEYS}, [], [])
+    if model["bunkers"] != normalize_bunkers(doc["bunkers"]):
+        blocks["BUNKERS"] = format_bunkers_block(model["bunkers"])
+    if model["cataclysms"] != normalize_cataclysms(doc["cats"]):
+        blocks["CATACLYSMS"] = format_cataclysms_block(model["cataclysms"])
+    if dry_run:
+        text = ensure_abilities_preserved(doc["text"], splice_blocks(doc["text"], blocks))
+    else:
+        text = save_blocks(doc, blocks, source)
+    return sorted(blocks), not dry_run and text != doc["text"], text
+
+@timed("batch")
+def apply_batch(paths: List[str], dry_run: bool = False) -> Dict[str, Any]:
+    """Применяет операции из файлов к cards.js: один разбор, одна запись (или ни одной)."""
+    started = time.perf_counter()
+    with deck_lock():
+        doc = load_document()
+        model = _deck_model(doc)
+        applied: Dict[str, int] = {}
+        for path in paths:
+            for where, op in read_operations(path):
+                try:
+                    apply_operation(model, op)
+                except ValueError as e:
+                    raise BatchError(f"{where}: {e}") from None
+                applied[op["op"]] = applied.get(op["op"], 0) + 1
+        changed, written, text = _write_model(doc, model, dry_run, "batch")
+    return {"operations": applied, "changed": changed, "written": written,
+            "dry_run": dry_run, "bytes": len(text.encode("utf-8")),
+            "seconds": time.perf_counter() - started}
+
+def format_batch_report(report: Dict[str, Any]) -> str:
+    ops = ", ".join(f"{k} {v}" for k, v in sorted(report["operations"].items())) or "нет"
+    changed = ", ".join(report["changed"]) or "нет"
+    if report["dry_run"]:
+        result = "пробный запуск, файл не изменён"
+    elif report["written"]:
+        result = f"записано {report['bytes'] / 1024:.0f} КБ"
+    else:
+        result = "изменений нет, файл не тронут"
+    return f"Операций: {ops}; изменены разделы: {changed}; {result} за {report['seconds']:.2f} с"
+
+def cli_main(argv: List[str]) -> int:
+    ap = argparse.ArgumentParser(prog=Path(__file__).name,
+                                 description="Редактор cards.js без веб-интерфейса. Без команды — запуск сервера, serve — рабочий режим.")
+    ap.add_argument("--deck", help=f"колода рабочего пространства {DECKS_PATH.name} (по умолчанию — CARDS_PATH)")
+    sub = ap.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("apply", help="применить операции из JSONL/CSV одной записью")
+    p.add_argument("files", nargs="+", help="файлы операций: .jsonl или .csv, '-' — JSONL из stdin")
+    p.add_argument("--dry-run", action="store_true", help="проверить операции и показать изменения без записи")
+    p.add_argument("--json", action="store_true", help="отчёт в JSON")
+    p = sub.add_parser("sync", help="скачать cards.js и картинки из GitHub")
+    p.add_argument("--repo", help=f"owner/name (по умолчанию — источник колоды, {GITHUB_REPO})")
+    p.add_argument("--branch", help=f"ветка (по умолчанию — источник колоды, {GITHUB_BRANCH})")
+    p.add_argument("--prune", action="store_true", default=SYNC_PRUNE, help="удалить картинки, пропавшие из архива")
+    p.add_argument("--json", action="store_true", help="отчёт в JSON")
+    p = sub.add_parser("export", help="выгрузить колоду в JSONL/CSV")
+    p.add_argument("--format", choices=list(EXPORT_MIMETYPES), default="jsonl")
+    p.add_argument("--sections", help="разделы через запятую (по умолчанию все)")
+    p.add_argument("-o", "--out", help="файл (по умолчанию stdout)")
+    p = sub.add_parser("import", help="загрузить колоду из JSONL/CSV одной записью")
+    p.add_argument("file", help="файл .jsonl или .csv, '-' — JSONL из stdin")
+    p.add_argument("--mode", choices=IMPORT_MODES, default="merge")
+    p.add_argument("--no-dedupe", dest="dedupe", action="store_false", help="добавлять и повторы")
+    p.add_argument("--dry-run", action="store_true", help="проверить и показать изменения без записи")
+    p.add_argument("--json", action="store_true", help="отчёт в JSON")
+    args = ap.parse_args(argv)
+    deck = PRIMARY_DECK
+    if args.deck:
+        try:
+            deck = load_deck(args.deck)
+        except ValueError as e:
+            print(f"[ERROR] {e}", file=sys.stderr)
+            return 1
+    with use_deck(deck):
+        return _run_command(args)
+
+def _run_command(args: argparse.Namespace) -> int:
+    try:
+        if args.command == "export":
+            chunks = (export_jsonl if args.format == "jsonl" else export_csv)(
+                load_document(), deck_sections(args.sections))
+            with (open(args.out, "w", encoding="utf-8", newline="") if args.out else sys.stdout) as out:
+                for chunk in chunks:
+                    out.write(chunk)
+            return 0
+        if args.command == "apply":
+            report = apply_batch(args.files, args.dry_run)
+            text = format_batch_report(report)
+        elif args.command == "import":
+            fmt = "csv" if args.file.lower().endswith(".csv") else "jsonl"
+            with (sys.stdin if args.file == "-" else open(args.file, encoding="utf-8-sig", newline="")) as f:
+                report = import_deck(read_records(f, fmt, args.file), args.mode, args.dedupe, args.dry_run)
+            text = format_import_report(report)
+        else:
+            report = sync_from_github(args.repo, args.branch, args.prune)
+            text = format_sync_report(report)
+    except Exception as e:
+        print(f"[ERROR] {e}", file=sys.stderr)
+        return 1
+    print(json.dumps(report, ensure_ascii=False, default=str) if args.json else text)
+    return 0
+
+# ---------- Импорт и экспорт колоды ----------
+# Колода построчно. JSONL: {"section": "HOBBIES", "value": "..."} или
+# {"section": "bunkers", <поля записи>}; CSV — те же колонки, items через '|'.
+# Это формат операций apply без поля op. Экспорт отдаётся генератором кусками
+# по EXPORT_CHUNK; импорт читает поток построчно, и файл пишется один раз.
+# Присланные записи проверяются до блокировки колоды и до неё же держатся в памяти
+# (медленный клиент не должен держать блокировку), поэтому тело POST /import
+# ограничено IMPORT_MAX_BYTES — сверх него ответ 413.
+EXPORT_CHUNK = 64 * 1024
+IMPORT_MAX_BYTES = int(os.environ.get("CARDS_IMPORT_MAX_BYTES") or 32 * 1024 * 1024)
+EXPORT_COLUMNS: List[str] = ["section", "value"] + list(dict.fromkeys(
+    f.name for schema in OBJECT_SCHEMAS.values() for f in schema))
+EXPORT_MIMETYPES: Dict[str, str] = {"jsonl": "application/x-ndjson", "csv": "text/csv"}
+IMPORT_MODES = ("merge", "replace")
+
+def deck_sections(spec: Optional[str] = None) -> List[str]:
+    """Разделы из списка через запятую (пусто — все); ValueError на неизвестный раздел."""
+    names = ARRAY_KEYS + list(BATCH_SECTIONS)
+    picked = [s.strip() for s in (spec or "").split(",") if s.strip()]
+    unknown = [s for s in picked if s not in names]
+    if unknown:
+        raise ValueError(f"неизвестные разделы: {', '.join(unknown)}")
+    return picked or names
+
+def export_records(doc: Dict[str, Any], sections: List[str]) -> Iterator[Dict[str, Any]]:
+    model = _deck_model(doc, sections)
+    for name in sections:
+        if name in ARRAY_KEYS:
+            for value in model[name]:
+                yield {"section": name, "value": value}
+        else:
+            for item in model[name]:
+                yield {"section": name, **item}
+
+def _chunks(parts: Iterable[str]) -> Iterator[str]:
+    buf: List[str] = []
+    size = 0
+    for part in parts:
+        buf.append(part)
+        size += len(part)
+        if size >= EXPORT_CHUNK:
+            yield "".join(buf)
+            buf, size = [], 0
+    if buf:
+        yield "".join(buf)
+
+def export_jsonl(doc: Dict[str, Any], sections: List[str]) -> Iterator[str]:
+    return _chunks(json.dumps(r, ensure_ascii=False) + "\n" for r in export_records(doc, sections))
+
+def export_csv(doc: Dict[str, Any], sections: List[str]) -> Iterator[str]:
+    def rows() -> Iterator[str]:
+        out = io.StringIO()
+        writer = csv.DictWriter(out, EXPORT_COLUMNS, lineterminator="\n")
+        writer.writeheader()
+        for r in export_records(doc, sections):
+            if "items" in r:
+                r["items"] = BATCH_LIST_SEP.join(r["items"])
+            writer.writerow(r)
+            yield out.getvalue()
+            out.seek(0)
+            out.truncate()
+    return _chunks(rows())
+
+def read_records(stream: Any, fmt: str, name: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """Записи импорта из текстового потока: fmt — "jsonl" или "csv"."""
+    return _csv_operations(name, stream) if fmt == "csv" else _jsonl_operations(name, stream)
+
+def _record_key(section: str, item: Any) -> str:
+    """Ключ дедупликации: текст элемента списка или ключевое поле записи."""
+    if section in ARRAY_KEYS:
+        return item
+    key = str(item[BATCH_KEYS[section]]).strip()
+    return key or json.dumps(item, ensure_ascii=False, sort_keys=True)
+
+def _import_item(section: str, rec: Dict[str, Any]) -> Any:
+    if section in ARRAY_KEYS:
+        extra = set(rec) - {"section", "value"}
+        if extra:
+            raise ValueError(f"лишние поля для списка: {', '.join(sorted(extra))}")
+        value = str(rec.get("value") or "").strip()
+        if not value:
+            raise ValueError("нужна непустая строка value")
+        return value
+    fields = {f.name for f in OBJECT_SCHEMAS[BATCH_SECTIONS[section]]}
+    extra = set(rec) - fields - {"section"}
+    if extra:
+        raise ValueError(f"неизвестные поля: {', '.join(sorted(extra))}")
+    return _batch_record(section, rec)
+
+@timed("import")
+def import_deck(records: Iterable[Tuple[str, Dict[str, Any]]], mode: str = "merge",
+                dedupe: bool = True, dry_run: bool = False,
+                check: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    """Импорт записей в cards.js одной записью файла.
+    merge — новые записи добавляются в конец раздела; replace — каждый раздел, который
+    встретился в импорте, заменяется целиком (остальные не трогаются). dedupe — повторы
+    (тот же текст у списков, тот же ключ у записей) не добавляются; при merge в запись
+    с уже существующим ключом вливаются присланные поля. check(doc) вызывается под
+    блокировкой перед изменением (проверка версии). Все записи разбираются в память
+    до блокировки: объём импорта ограничивает вызывающий (IMPORT_MAX_BYTES для HTTP)."""
+    if mode not in IMPORT_MODES:
+        raise ValueError(f"неизвестный режим {mode!r} (допустимо: {', '.join(IMPORT_MODES)})")
+    started = time.perf_counter()
+    sections = set(ARRAY_KEYS) | set(BATCH_SECTIONS)
+    incoming: Dict[str, List[Tuple[Any, Dict[str, Any]]]] = {}   # (запись, исходные поля)
+    for where, rec in records:
+        section = rec.get("section")
+        if section not in sections:
+            raise BatchError(f"{where}: неизвестный раздел {section!r}")
+        try:
+            incoming.setdefault(section, []).append((_import_item(section, rec), rec))
+        except ValueError as e:
+            raise BatchError(f"{where}: {e}") from None
+
+    # файл читается и пишется под блокировкой; разбор присланного — до неё
+    with deck_lock():
+        doc = load_document()
+        if check:
+            check(doc)
+        model = _deck_model(doc)
+        stats: Dict[str, Dict[str, int]] = {}
+        for section, items in incoming.items():
+            st = {"received": len(items), "added": 0, "updated": 0, "skipped": 0, "removed": 0}
+            if mode == "replace":
+                if dedupe:
+                    unique: Dict[str, Any] = {}
+                    for item, _ in items:
+                        unique.setdefault(_record_key(section, item), item)
+                    replaced = list(unique.values())
+                else:
+                    replaced = [item for item, _ in items]
+                st.update(removed=len(model[section]), added=len(replaced), skipped=st["received"] - len(replaced))
+                model[section] = replaced
+            else:
+                current = model[section]
+                positions: Dict[str, int] = {}
+                if dedupe:
+                    for i, item in enumerate(current):
+                        positions.setdefault(_record_key(section, item), i)
+                for item, rec in items:
+                    key = _record_key(section, item) if dedupe else ""
+                    if dedupe and key in positions:
+                        i = positions[key]
+                        merged = item if section in ARRAY_KEYS else _batch_record(section, rec, current[i])
+                        if merged == current[i]:
+                            st["skipped"] += 1
+                        else:
+                            current[i] = merged
+                            st["updated"] += 1
+                        continue
+                    if dedupe:
+                        positions[key] = len(current)
+                    current.append(item)
+                    st["added"] += 1
+            stats[section] = st
+        changed, written, text = _write_model(doc, model, dry_run, f"import {mode}")
+    return {"mode": mode, "dedupe": dedupe, "sections": stats, "changed": changed, "written": written,
+            "dry_run": dry_run, "hash": text_hash(text), "bytes": len(text.encode("utf-8")),
+            "seconds": time.perf_counter() - started}
+
+def format_import_report(report: Dict[str, Any]) -> str:
+    parts = [f"{name}: +{st['added']} ~{st['updated']} ={st['skipped']}" + (f" -{st['removed']}" if st["removed"] else "")
+             for name, st in report["sections"].items()]
+    result = ("пробный запуск, файл не изменён" if report["dry_run"] else
+              f"записано {report['bytes'] / 1024:.0f} КБ" if report["written"] else "изменений нет, файл не тронут")
+    return f"Импорт ({report['mode']}): {'; '.join(parts) or 'пусто'}; {result} за {report['seconds']:.2f} с"
+
+# Команды CLI выполняются здесь, до импорта Flask/Jinja ниже.
+if __name__ == "__main__" and len(sys.argv) > 1 and sys.argv[1] in CLI_COMMANDS:
+    sys.exit(cli_main(sys.argv[1:]))
+
+# ---------- Flask ----------
+import pstats
+import cProfile
+from flask import (Flask, Response, request, redirect, url_for, render_template, flash, jsonify, g, send_file,
+                   session, stream_with_context)
+from jinja2 import Template
+from werkzeug.exceptions import RequestEntityTooLarge
+
+try:
+    import brotli
+except ImportError:  # без brotli ответы сжимаются только gzip
+    brotli = None
+
+app = Flask(__name__)
+app.secret_key = os.environ.get("CARDS_SECRET_KEY") or "cards-editor-secret"
+
+class _DeckBody:
+    """Тело ответа, которое отдаётся в контексте колоды: потоковые ответы (выгрузка,
+    /events) читают current_deck() уже после возврата из приложения."""
+    def __init__(self, ctx: contextvars.Context, body: Iterable[bytes]):
+        self._ctx, self._body, self._it = ctx, body, iter(body)
+
+    def __iter__(self) -> "_DeckBody":
+        return self
+
+    def __next__(self) -> bytes:
+        return self._ctx.run(next, self._it)
+
+    def close(self) -> None:
+        close = getattr(self._body, "close", None)
+        if close is not None:
+            self._ctx.run(close)
+
+def deck_app(deck: DeckState) -> Callable[..., Any]:
+    """WSGI-приложение редактора для колоды deck (см. «Несколько колод»): запрос и
+    отдача ответа идут в своём контексте с current_deck() = deck, вызывающий его не видит."""
+    def wsgi(environ: Dict[str, Any], start_response: Callable[..., Any]) -> Any:
+        ctx = contextvars.copy_context()
+        ctx.run(_CURRENT_DECK.set, deck)
+        return _DeckBody(ctx, ctx.run(app, environ, start_response))
+    return wsgi
+
+PAGE_SIZE = 50
+
+@lru_cache(maxsize=None)
+def _template(source: str) -> Template:
+    """Шаблон компилируется один раз на процесс, а не на каждый запрос."""
+    return app.jinja_env.from_string(source)
+
+@timed("render")
+def render(source: str, **context: Any) -> str:
+    return render_template(_template(source), **context)
+
+@app.template_filter("datetime")
+def _format_time(ts: float) -> str:
+    return time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(ts))
+
+@app.context_processor
+def _deck_context() -> Dict[str, Any]:
+    """Имя колоды и корень рабочего пространства для шапки (см. «Несколько колод»)."""
+    name = current_deck().name
+    if not name:
+        return {"deck": ""}
+    return {"deck": name, "workspace_root": request.script_root.rsplit(f"/d/{name}", 1)[0]}
+
+# ---------- Сжатие и условные GET ----------
+# Ответы GET получают сильный ETag: страницы — от хэша cards.js и всего, что ещё
+# попадает в HTML, /api и выгрузка — от хэша cards.js, остальное — от тела.
+# Совпавший If-None-Match — 304 без тела (страница при этом даже не рендерится).
+# Тело сжимается br/gzip по Accept-Encoding; сжатые варианты лежат в LRU-кэше по
+# (адрес, ETag, кодировка), так что повторная отдача неизменённой колоды не стоит
+# ни рендера, ни сжатия. У сжатого варианта свой ETag: "<тег>-gzip" / "<тег>-br".
+COMPRESS_MIN_BYTES = 1024
+COMPRESS_LEVEL = 6          # gzip
+BROTLI_QUALITY = 5          # 11 в разы медленнее при выигрыше в несколько процентов
+COMPRESS_CACHE_BYTES = int(os.environ.get("CARDS_COMPRESS_CACHE_BYTES") or 32 * 1024 * 1024)
+COMPRESS_TYPES = ("text/html", "text/plain", "text/csv", "application/json", "application/x-ndjson")
+COMPRESS_STATS: Dict[str, int] = {"hits": 0, "misses": 0, "evictions": 0}
+_COMPRESSED: "OrderedDict[Tuple[str, str, str], bytes]" = OrderedDict()
+_COMPRESS_LOCK = threading.Lock()
+_ETAG_ENC_RE = re.compile(r"-(?:gzip|br)\Z")
+
+@lru_cache(maxsize=None)
+def _build_hash(path: Path, repo: str, branch: str) -> str:
+    """Исходник редактора и конфиг колоды: после обновления страницы получают новый ETag."""
+    h = hashlib.sha1(Path(__file__).read_bytes())
+    h.update(f"{path}|{repo}|{branch}|{PAGE_SIZE}".encode("utf-8"))
+    return h.hexdigest()
+
+def page_tag(doc: Dict[str, Any], *parts: Any) -> str:
+    """ETag страницы: хэш cards.js + всё остальное, от чего зависит её HTML."""
+    deck = current_deck()
+    h = hashlib.sha1(f"{_build_hash(deck.path, deck.repo, deck.branch)}|{doc['hash']}".encode("utf-8"))
+    for part in parts:
+        h.update(json.dumps(part, ensure_ascii=False, sort_keys=True).encode("utf-8"))
+    return h.hexdigest()
+
+def _encoding() -> str:
+    accept = request.accept_encodings
+    gzip_q = accept["gzip"]
+    if brotli is not None and accept["br"] and accept["br"] >= gzip_q:
+        return "br"
+    return "gzip" if gzip_q else "identity"
+
+def _compress(data: bytes, enc: str) -> bytes:
+    if enc == "br":
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    comp = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 31)   # 31 — gzip-обёртка, mtime 0
+    return comp.compress(data) + comp.flush()
+
+def _compress_stream(chunks: Iterable[bytes], enc: str) -> Iterator[bytes]:
+    """Потоковое сжатие: каждый кусок сбрасывается сразу, клиент не ждёт конца."""
+    if enc == "br":
+        comp = brotli.Compressor(quality=BROTLI_QUALITY)
+        for chunk in chunks:
+            out = comp.process(chunk) + comp.flush()
+            if out:
+                yield out
+        yield comp.finish()
+        return
+    comp = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        out = comp.compress(chunk) + comp.flush(zlib.Z_SYNC_FLUSH)
+        if out:
+            yield out
+    yield comp.flush()
+
+@timed("compress")
+def compressed_body(key: Tuple[str, str, str], data: Callable[[], bytes]) -> bytes:
+    """Сжатое тело из кэша; при промахе data() сжимается и запоминается."""
+    with _COMPRESS_LOCK:
+        body = _COMPRESSED.get(key)
+        if body is not None:
+            COMPRESS_STATS["hits"] += 1
+            _COMPRESSED.move_to_end(key)
+            return body
+        COMPRESS_STATS["misses"] += 1
+    raw = data()
+    body = raw if key[2] == "identity" else _compress(raw, key[2])
+    with _COMPRESS_LOCK:
+        _COMPRESSED[key] = body
+        total = sum(len(b) for b in _COMPRESSED.values())
+        while len(_COMPRESSED) > 1 and total > COMPRESS_CACHE_BYTES:
+            _, old = _COMPRESSED.popitem(last=False)
+            total -= len(old)
+            COMPRESS_STATS["evictions"] += 1
+    return body
+
+def compress_cache_stats() -> Dict[str, Any]:
+    with _COMPRESS_LOCK:
+        return dict(COMPRESS_STATS, entries=len(_COMPRESSED), bytes=sum(len(b) for b in _COMPRESSED.values()),
+                    budget=COMPRESS_CACHE_BYTES, brotli=brotli is not None)
+
+def etag_matches(etags: Any, tag: str) -> bool:
+    """Есть ли tag в If-Match/If-None-Match с точностью до суффикса кодировки."""
+    return etags.star_tag or any(_ETAG_ENC_RE.sub("", t) == tag for t in etags)
+
+def _not_modified(tag: str) -> Response:
+    count("cards_not_modified_total", endpoint=request.endpoint or "none")
+    resp = Response(status=304)
+    resp.set_etag(tag)
+    resp.vary.add("Accept-Encoding")
+    resp.cache_control.no_cache = True
+    return resp
+
+def cached_page(tag: str, build: Callable[[], str]) -> Response:
+    """HTML-страница с ETag tag: 304, готовое тело из кэша или рендер build()."""
+    if "_flashes" in session:   # одноразовое сообщение — такой HTML не переиспользуется
+        return Response(build(), mimetype="text/html")
+    enc = _encoding()
+    full_tag = tag if enc == "identity" else f"{tag}-{enc}"
+    if etag_matches(request.if_none_match, tag):
+        return _not_modified(full_tag)
+    resp = Response(compressed_body((request.script_root + request.full_path, tag, enc), lambda: build().encode("utf-8")),
+                    mimetype="text/html")
+    if enc != "identity":
+        resp.headers["Content-Encoding"] = enc
+    resp.set_etag(full_tag)
+    resp.vary.add("Accept-Encoding")
+    resp.cache_control.no_cache = True
+    return resp
+
+@app.after_request
+def _compress_response(response):
+    """ETag, 304 и сжатие для остальных GET; уже сжатое и картинки не трогаются."""
+    if (request.method not in ("GET", "HEAD") or response.status_code != 200
+            or response.mimetype not in COMPRESS_TYPES or "Content-Encoding" in response.headers):
+        return response
+    tag, weak = response.get_etag()
+    if tag is None and not response.is_streamed:
+        response.add_etag()   # sha1 тела
+        tag, weak = response.get_etag()
+    if tag is None or weak:
+        return response
+    if etag_matches(request.if_none_match, tag):
+        enc = _encoding()
+        return _not_modified(tag if enc == "identity" else f"{tag}-{enc}")
+    response.vary.add("Accept-Encoding")
+    if not response.cache_control.max_age:
+        response.cache_control.no_cache = True
+    enc = _encoding()
+    if enc == "identity":
+        return response
+    if response.is_streamed:
+        response.response = _compress_stream(response.iter_encoded(), enc)
+        response.headers.pop("Content-Length", None)
+    else:
+        data = response.get_data()
+        if len(data) < COMPRESS_MIN_BYTES:
+            return response
+        response.set_data(compressed_body((request.script_root + request.full_path, tag, enc), lambda: data))
+    response.headers["Content-Encoding"] = enc
+    response.set_etag(f"{tag}-{enc}")
+    return response
+
+@app.route("/", endpoint="index", methods=["GET", "POST"])
+def index():
+    if request.method == "POST":
+        with deck_lock():
+            return _index_post()
+    # лёгкая оболочка: только счётчики, элементы разделы подгружают через /api
+    doc = load_document()
+    counts = {key: len(doc["arrays"][key]) for key in ARRAY_KEYS}
+    counts["bunkers"] = len(doc["bunkers"])
+    counts["cataclysms"] = len(doc["cats"])
+    images = image_urls()
+    sync_job = request.args.get("job", "")
+    return cached_page(page_tag(doc, images, sync_job), lambda: render(
+        SHELL_TPL, counts=counts, page_size=PAGE_SIZE, style=STYLE, versions=section_versions(doc),
+        sync_js=SYNC_JS, watch_js=WATCH_JS, sync_job=sync_job, images=images,
+        array_keys=ARRAY_KEYS, labels=LABELS, file_path=str(current_deck().path),
+        GITHUB_REPO=current_deck().repo, GITHUB_BRANCH=current_deck().branch))
+
+@app.route("/full", methods=["GET"])
+def full_editor():
+    """Старая форма со всей колодой на одной странице."""
+    doc = load_document()
+    images = image_urls()
+    return cached_page(page_tag(doc, images), lambda: render(
+        TPL, arrays=doc["arrays"], bunkers=doc["bunkers"], cats=doc["cats"],
+        versions=section_versions(doc), images=images, style=STYLE, watch_js=WATCH_JS, array_keys=ARRAY_KEYS, labels=LABELS, file_path=str(current_deck().path),
+        GITHUB_REPO=current_deck().repo, GITHUB_BRANCH=current_deck().branch))
+
+def _index_post():
+    doc = load_document()
+    original_text = doc["text"]
+    text = original_text
+
+    # простые списки
+    arrays = {key: request.form.getlist(f"{key}_item") for key in ARRAY_KEYS}
+
+    # бункеры
+    idxs = request.form.getlist("bunk_idx")
+    bunkers: List[Dict[str, Any]] = []
+    for i in idxs:
+        desc = request.form.get(f"bunk_desc_{i}", "") or ""
+        size = request.form.get(f"bunk_size_{i}", "0") or "0"
+        stay = request.form.get(f"bunk_stay_{i}", "") or ""
+        food = request.form.get(f"bunk_food_{i}", "") or ""
+        places = request.form.get(f"bunk_places_{i}", "0") or "0"
+        items = [s.strip() for s in request.form.getlist(f"bunk_item_{i}") if s.strip()]
+        bunkers.append({
+            "description": desc,
+            "items": items,
+            "sizeM2": int(size) if str(size).isdigit() else 0,
+            "stayText": stay,
+            "foodText": food,
+            "places": int(places) if str(places).isdigit() else 0,
+        })
+
+    # катаклизмы
+    ids = request.form.getlist("cat_id")
+    titles = request.form.getlist("cat_title")
+    descs = request.form.getlist("cat_description")
+    images = request.form.getlist("cat_image")
+    cats: List[Dict[str, str]] = []
+    maxlen = max(len(ids), len(titles), len(descs), len(images)) if any([ids, titles, descs, images]) else 0
+    for i in range(maxlen):
+        cats.append({
+            "id": (ids[i] if i < len(ids) else "").strip(),
+            "title": (titles[i] if i < len(titles) else "").strip(),
+            "description": (descs[i] if i < len(descs) else ""),
+            "image": (images[i] if i < len(images) else "").strip(),
+        })
+
+    # в файл попадают только изменившиеся блоки
+    try:
+        base = json.loads(request.form.get("base_versions") or "{}")
+    except ValueError:
+        base = {}
+    sections, conflicts = reconcile_changes(doc, diff_sections(doc, arrays, bunkers, cats),
+                                            base if isinstance(base, dict) else {})
+    if conflicts:
+        count("cards_stale_rejected_total")
+        flash("Не сохранено: после открытия формы изменились разделы "
+              f"{', '.join(conflicts)} (другое окно, воркер или синхронизация). Обновите страницу и повторите правку.")
+        return redirect(url_for("full_editor"))
+    text = save_blocks(doc, {name: edit_block(doc["text"], name, items) for name, items in sections.items()})
+    if text == original_text:
+        flash("Изменений нет — файл не перезаписан")
+    else:
+        flash("Изменения сохранены ✅")
+    return redirect(url_for("full_editor"))
+
+# ---------- Доп. роуты ----------
+# Профилирование одного запроса: заголовок X-Cards-Profile: 1 или ?_profile=1
+# (CARDS_PROFILE=1 — каждый запрос). Сводка cProfile печатается в stderr и
+# доступна по ссылке из заголовка ответа X-Cards-Profile.
+PROFILE_ALL = os.environ.get("CARDS_PROFILE", "") == "1"
+PROFILE_HEADER = "X-Cards-Profile"
+PROFILE_KEEP = 20
+PROFILE_LINES = 40
+PROFILES: "OrderedDict[str, str]" = OrderedDict()
+_PROFILE_LOCK = threading.Lock()   # cProfile снимается с одного запроса за раз
+
+@app.before_request
+def _start_request():
+    g.cards_t0 = time.perf_counter()
+    if PROFILE_ALL or request.headers.get(PROFILE_HEADER) or request.args.get("_profile"):
+        if _PROFILE_LOCK.acquire(blocking=False):
+            g.cards_profiler = cProfile.Profile()
+            g.cards_profiler.enable()
+
+def _stop_profiler() -> Optional[cProfile.Profile]:
+    prof = g.pop("cards_profiler", None)
+    if prof is not None:
+        prof.disable()
+        _PROFILE_LOCK.release()
+    return prof
+
+@app.after_request
+def _finish_request(response):
+    prof = _stop_profiler()
+    if prof is not None:
+        out = io.StringIO()
+        pstats.Stats(prof, stream=out).sort_stats("cumulative").print_stats(PROFILE_LINES)
+        summary = f"{request.method} {request.full_path} -> {response.status_code}\n{out.getvalue()}"
+        print(f"[PROFILE] {summary}", file=sys.stderr)
+        profile_id = uuid.uuid4().hex[:12]
+        with _PROFILE_LOCK:
+            PROFILES[profile_id] = summary
+            while len(PROFILES) > PROFILE_KEEP:
+                PROFILES.popitem(last=False)
+        count("cards_profiles_total")
+        response.headers[PROFILE_HEADER] = url_for("profile_action", profile_id=profile_id)
+    t0 = g.pop("cards_t0", None)
+    if t0 is not None:
+        elapsed = time.perf_counter() - t0
+        endpoint = request.endpoint or "none"
+        observe("cards_request_seconds", elapsed, endpoint=endpoint)
+        count("cards_requests_total", endpoint=endpoint, status=str(response.status_code))
+        response.headers["Server-Timing"] = f"app;dur={elapsed * 1000:.1f}"
+    return response
+
+@app.teardown_request
+def _teardown_profiler(exc):
+    # если запрос упал до after_request, профилировщик всё равно нужно снять
+    _stop_profiler()
+
+@app.route("/metrics", methods=["GET"])
+def metrics_action():
+    return render_metrics(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+@app.route("/metrics/profiles/<profile_id>", methods=["GET"])
+def profile_action(profile_id: str):
+    with _PROFILE_LOCK:
+        summary = PROFILES.get(profile_id)
+    if summary is None:
+        return jsonify({"error": "Нет такого профиля"}), 404
+    return summary, 200, {"Content-Type": "text/plain; charset=utf-8"}
+
+@app.before_request
+def _ensure_cards_file():
+    """Если cards.js ещё нет, не держим воркер на скачивании: запускаем фоновую
+    синхронизацию и показываем страницу ожидания."""
+    if (request.endpoint in (None, "static", "sync_action", "sync_status", "cache_stats_action",
+                             "metrics_action", "profile_action")
+            or request.endpoint.startswith("history_") or current_deck().path.exists()):
+        return None
+    job = start_sync_job(current_deck().repo, current_deck().branch)
+    if request.path.startswith("/api/"):
+        return jsonify({"error": "cards.js ещё скачивается", "job": job}), 503, {"Retry-After": "2"}
+    return (render(WAIT_TPL, job=job, style=STYLE, sync_js=SYNC_JS, file_path=str(current_deck().path)),
+            503, {"Retry-After": "2"})
+
+@app.route("/sync", methods=["POST"])
+def sync_action():
+    repo = request.form.get("repo") or current_deck().repo
+    branch = request.form.get("branch") or current_deck().branch
+    prune = bool(request.form.get("prune")) or SYNC_PRUNE
+    job = start_sync_job(repo, branch, prune)
+    if request.accept_mimetypes.best == "application/json":
+        return jsonify(job), 202, {"Location": url_for("sync_status", job_id=job["id"])}
+    flash(f"Синхронизация {job['key']} запущена в фоне…")
+    return redirect(url_for("index", job=job["id"]))
+
+@app.route("/sync/<job_id>", methods=["GET"])
+def sync_status(job_id: str):
+    job = sync_job_status(job_id)
+    if job is None:
+        return jsonify({"error": "Нет такой задачи"}), 404
+    return jsonify(job)
+
+@app.route("/reload", methods=["GET"])
+def reload_action():
+    flash("Перезагрузка интерфейса выполнена 🔄")
+    return redirect(url_for("index"))
+
+# Поток /events держит соединение (и поток сервера) на вкладку; комментарий раз
+# в EVENTS_KEEPALIVE не даёт прокси закрыть его и выявляет ушедших клиентов.
+EVENTS_KEEPALIVE = 15.0     # с
+EVENTS_RETRY_MS = 3000      # через сколько браузер переподключается
+
+def _sse(event: Dict[str, Any]) -> str:
+    return f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+@app.route("/events", methods=["GET"])
+def events_action():
+    """Server-Sent Events: сначала текущие версии разделов, затем изменения cards.js
+    и картинок на диске (событие deck — по блокам, images — по путям)."""
+    mode = start_watcher()
+    if mode is None:
+        return jsonify({"error": "Слежение за файлами выключено (CARDS_WATCH=0)"}), 404
+    sub = subscribe()
+    doc = load_document()
+
+    def stream() -> Iterator[str]:
+        try:
+            yield f"retry: {EVENTS_RETRY_MS}\n" + _sse(dict(deck_event(doc, []), mode=mode))
+            while True:
+                try:
+                    event = sub.get(timeout=EVENTS_KEEPALIVE)
+                except queue.Empty:
+                    yield ": ping\n\n"
+                    continue
+                if event["type"] == "images":
+                    urls = image_urls()
+                    event = dict(event, images={p: urls.get(p) for p in event["paths"]})
+                yield _sse(event)
+        finally:
+            unsubscribe(sub)
+
+    resp = Response(stream_with_context(stream()), mimetype="text/event-stream")
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["X-Accel-Buffering"] = "no"   # nginx: не буферизовать поток
+    return resp
+
+@app.route("/cache", methods=["GET"])
+def cache_stats_action():
+    return jsonify(dict(doc_cache_stats(), compressed=compress_cache_stats(), image_store=image_store_stats(),
+                        model=model_footprint(load_document())))
 
-# --- GitHub источники по умолчанию ---
-GITHUB_REPO = os.environ.get('CARDS_GITHUB_REPO', 'jester19686/YGsere')
-GITHUB_BRANCH = os.environ.get('CARDS_GITHUB_BRANCH', 'main')
-IMAGES_DIR = (BASE_DIR / 'client' / 'public' / 'cataclysms')
+def _wants_json() -> bool:
+    return request.args.get("format") == "json" or request.accept_mimetypes.best == "application/json"
 
-# ---------- GitHub Sync ----------
-def _download_repo_zip(repo: str, branch: str) -> bytes:
-    url = f"https://codeload.github.com/{repo}/zip/refs/heads/{branch}"
-    with urllib.request.urlopen(url) as resp:
-        return resp.read()
+@app.route("/history", methods=["GET"])
+def history_list():
+    """Версии cards.js, новые первыми. ?offset=, ?limit=."""
+    offset = max(0, request.args.get("offset", 0, type=int))
+    limit = max(1, min(request.args.get("limit", PAGE_SIZE, type=int), API_MAX_LIMIT))
+    # страница читается с конца файла; номера версий идут подряд с 1, так что всего — номер последней
+    newest = list(islice(_versions_from_end(), offset + limit))
+    total = newest[0]["id"] if newest else 0
+    page = [{k: v[k] for k in ("id", "time", "hash", "size", "source")} for v in newest[offset:]]
+    if _wants_json():
+        return jsonify({"total": total, "offset": offset, "limit": limit, "versions": page})
+    return render(HISTORY_TPL, versions=page, total=total, offset=offset,
+                  limit=limit, style=STYLE, file_path=str(current_deck().path))
 
-def _extract_and_copy(zip_bytes: bytes) -> int:
-    """Копирует data/cards.js и client/public/cataclysms/* из архива репо в локальные папки."""
-    changed = 0
-    zf = zipfile.ZipFile(io.BytesIO(zip_bytes))
-    # Имя корневой папки в архиве, например YGsere-main/
-    root = zf.namelist()[0].split('/')[0]
+@app.route("/history/<int:version_id>", methods=["GET"])
+def history_text(version_id: int):
+    v = history_version(version_id)
+    if v is None:
+        return jsonify({"error": "Нет такой версии"}), 404
+    return version_text(v), 200, {"Content-Type": "text/javascript; charset=utf-8",
+                                  "Cache-Control": "public, max-age=31536000, immutable"}
 
-    # 1) cards.js
-    cards_member = f"{root}/data/cards.js"
-    if cards_member in zf.namelist():
-        data = zf.read(cards_member)
-        FILE_PATH.parent.mkdir(parents=True, exist_ok=True)
-        old = FILE_PATH.read_bytes() if FILE_PATH.exists() else b""
-        if old != data:
-            FILE_PATH.write_bytes(data)
-            changed += 1
+@app.route("/history/diff", methods=["GET"])
+def history_diff():
+    """?a=&b= — номера версий; по умолчанию b — последняя, a — предыдущая."""
+    last = _last_version()
+    if last is None:
+        return jsonify({"error": "История пуста"}), 404
+    b = request.args.get("b", last["id"], type=int)
+    a = request.args.get("a", b - 1, type=int)
+    va, vb = history_version(a), history_version(b)
+    if va is None or vb is None:
+        return jsonify({"error": "Нет такой версии"}), 404
+    return jsonify({"a": a, "b": b, "blocks": diff_versions(va, vb)})
 
-    # 2) изображения катаклизмов
-    IMAGES_DIR.mkdir(parents=True, exist_ok=True)
-    prefix = f"{root}/client/public/cataclysms/"
-    for name in zf.namelist():
-        if name.startswith(prefix) and not name.endswith('/'):
-            rel = name[len(prefix):]
-            if not rel:
-                continue
-            dst = IMAGES_DIR / rel
-            data = zf.read(name)
-            if not dst.exists() or dst.read_bytes() != data:
-                dst.parent.mkdir(parents=True, exist_ok=True)
-                dst.write_bytes(data)
-                changed += 1
-    return changed
+@app.route("/history/<int:version_id>/restore", methods=["POST"])
+def history_restore(version_id: int):
+    v = history_version(version_id)
+    if v is None:
+        return jsonify({"error": "Нет такой версии"}), 404
+    with deck_lock():
+        text = version_text(v)
+        path = current_deck().path
+        current = path.read_text(encoding="utf-8") if path.exists() else None
+        if text != current:
+            save_text(text, f"restore {version_id}")
+    if _wants_json():
+        return jsonify({"restored": version_id, "changed": text != current, "hash": v["hash"]})
+    flash(f"Восстановлена версия {version_id}" if text != current else "Эта версия уже на диске")
+    return redirect(url_for("history_list"))
 
-def sync_from_github(repo: str = GITHUB_REPO, branch: str = GITHUB_BRANCH) -> int:
-    blob = _download_repo_zip(repo, branch)
-    return _extract_and_copy(blob)
+_HEX40_RE = re.compile(r"[0-9a-f]{40}")
 
-# ---------- Общие утилиты ----------
-def load_text() -> str:
-    # Автоподкачка, если файла нет
-    if not FILE_PATH.exists():
-        try:
-            changed = sync_from_github(GITHUB_REPO, GITHUB_BRANCH)
-            print(f"[INFO] Автоскачивание из GitHub: обновлено файлов {changed}")
-        except Exception as e:
-            raise FileNotFoundError(f"Не найден {FILE_PATH}, и не удалось скачать: {e}")
-    return FILE_PATH.read_text(encoding="utf-8")
+@app.route("/images", methods=["GET"])
+def images_report():
+    """Отчёт по картинкам катаклизмов: отсутствующие, лишние, слишком большие."""
+    return jsonify(image_report(load_document()))
 
-def save_text(text: str) -> None:
-    FILE_PATH.parent.mkdir(parents=True, exist_ok=True)
-    FILE_PATH.write_text(text, encoding="utf-8")
+@app.route("/images/<digest>/<variant>.webp", methods=["GET"])
+def image_variant(digest: str, variant: str):
+    # адрес содержит хэш исходника — ответ не меняется никогда
+    path = _variant_path(digest, variant)
+    if not _HEX40_RE.fullmatch(digest) or variant not in IMAGE_VARIANTS or not path.exists():
+        return jsonify({"error": "Нет такого варианта"}), 404
+    resp = send_file(path, mimetype="image/webp", max_age=31536000, etag=f"{digest}-{variant}", conditional=True)
+    resp.cache_control.public = True
+    resp.cache_control.immutable = True
+    return resp
 
-def find_block(text: str, key: str) -> Optional[Tuple[int, int, str]]:
-    """Возвращает (start, end, inner) для 'const KEY = [ inner ];'"""
-    m = re.search(rf"(const\s+{re.escape(key)}\s*=\s*\[)(.*?)(\]\s*;)", text, flags=re.DOTALL | re.UNICODE)
-    if not m:
-        return None
-    return (m.start(1), m.end(3), m.group(2))
+@app.route("/search", methods=["GET"])
+def search_action():
+    """?q= — слова запроса (префиксы, без учёта регистра и ё), ?section= — через запятую, ?limit=."""
+    sections = [s for s in (request.args.get("section") or "").split(",") if s] or None
+    limit = max(1, min(request.args.get("limit", SEARCH_LIMIT, type=int), SEARCH_MAX_LIMIT))
+    t0 = time.perf_counter()
+    res = search_deck(load_document(), request.args.get("q") or "", sections, limit)
+    res["ms"] = (time.perf_counter() - t0) * 1000
+    return jsonify(res)
 
-def extract_verbatim(text: str, key: str) -> Optional[str]:
-    m = re.search(rf"const\s+{re.escape(key)}\s*=\s*\[(.*?)\]\s*;", text, flags=re.DOTALL | re.UNICODE)
-    return m.group(0) if m else None
+@app.route("/duplicates", methods=["GET"])
+def duplicates_action():
+    """Отчёт о похожих записях. ?threshold= (0..1), ?limit=."""
+    threshold = min(1.0, max(0.0, request.args.get("threshold", DUP_THRESHOLD, type=float)))
+    limit = max(1, min(request.args.get("limit", SEARCH_MAX_LIMIT, type=int), 10 * SEARCH_MAX_LIMIT))
+    t0 = time.perf_counter()
+    res = dict(near_duplicates(load_document(), threshold, limit))
+    res["ms"] = (time.perf_counter() - t0) * 1000
+    return jsonify(res)
 
-def parse_array(text: str, key: str) -> List[str]:
-    blk = find_block(text, key)
-    if not blk:
-        return []
-    return re.findall(r"'([^']*)'", blk[2])
+@app.route("/simulate", methods=["GET"])
+def simulate_action():
+    want_json = _wants_json()
+    try:
+        rooms = min(int(request.args.get("rooms") or SIM_ROOMS), SIM_WEB_MAX_ROOMS)
+        players = parse_players(request.args.get("players") or "") if request.args.get("players") else SIM_PLAYERS
+        seed = int(request.args["seed"]) if request.args.get("seed") else None
+    except ValueError as e:
+        return jsonify({"error": f"Неверные параметры: {e}"}), 400
+    try:
+        report = simulate_deck(load_document()["text"], rooms, players, seed)
+    except RuntimeError as e:
+        if want_json:
+            return jsonify({"error": str(e)}), 503
+        flash(str(e))
+        return redirect(url_for("index"))
+    if want_json:
+        return jsonify(report)
+    return render(SIM_TPL, report=report, style=STYLE, file_path=str(current_deck().path),
+                  players_spec=request.args.get("players") or f"{SIM_PLAYERS[0]}-{SIM_PLAYERS[-1]}")
 
-def replace_array(text: str, key: str, items: List[str]) -> str:
-    inner = ",\n  ".join(f"'{s.strip()}'" for s in items if s.strip())
-    new_block = f"const {key} = [\n  {inner}\n];"
-    blk = find_block(text, key)
-    if blk:
-        s, e, _ = blk
-        return text[:s] + new_block + text[e:]
-    return re.sub(r"module\.exports\s*=\s*\{", new_block + "\n\nmodule.exports = {", text, count=1)
-
-# ---------- Хелперы для массивов объектов ----------
-def _find_array_span(text: str, const_name: str) -> Optional[Tuple[int, int]]:
-    m = re.search(rf"const\s+{re.escape(const_name)}\s*=\s*\[", text)
-    if not m:
-        return None
-    i = m.end()
-    depth = 1
-    while i < len(text) and depth > 0:
-        ch = text[i]
-        if ch == '[':
-            depth += 1
-        elif ch == ']':
-            depth -= 1
-        i += 1
-    if depth != 0:
-        return None
-    return (m.end(), i-1)
+# ---------- JSON API ----------
+# Поштучное редактирование: /api/<раздел>[/<индекс>], где раздел — один из ARRAY_KEYS,
+# "bunkers" или "cataclysms". ETag — хэш содержимого cards.js; запись с If-Match,
+# не совпадающим с текущим ETag, отклоняется с 412. Поля и типы объектов — по OBJECT_SCHEMAS.
+API_MAX_LIMIT = 500
 
-def _split_top_level_objects(block: str) -> List[str]:
-    objs: List[str] = []
-    depth = 0
-    start = None
-    i = 0
-    while i < len(block):
-        ch = block[i]
-        if ch == '{':
-            if depth == 0:
-                start = i
-            depth += 1
-        elif ch == '}':
-            depth -= 1
-            if depth == 0 and start is not None:
-                objs.append(block[start:i+1])
-                start = None
-        i += 1
-    return objs
+class ApiError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
 
-# ---------- CATAclySMS ----------
-def parse_cataclysms(text: str) -> List[Dict[str, str]]:
-    span = _find_array_span(text, "CATAclySMS")
-    if not span:
-        return []
-    block = text[span[0]:span[1]]
-    raw_objs = _split_top_level_objects(block)
-    items: List[Dict[str, str]] = []
-    for raw in raw_objs:
-        def get(patterns: List[str]) -> str:
-            for pat in patterns:
-                m = re.search(pat, raw, flags=re.DOTALL | re.UNICODE)
-                if m:
-                    return m.group(1)
-            return ""
-        items.append({
-            "id":   get([r"id:\s*'([^']*)'"]),
-            "title":get([r"title:\s*'([^']*)'"]),
-            "description": get([r"description:\s*'([\s\S]*?)'", r"text:\s*'([\s\S]*?)'"]),
-            "image":get([r"image:\s*'([^']*)'"]),
-        })
-    return items
+@app.errorhandler(ApiError)
+def _api_error(e: ApiError):
+    return jsonify({"error": str(e)}), e.status
 
-def replace_cataclysms(text: str, items: List[Dict[str, str]], original_text: str) -> str:
-    normalized: List[Dict[str, str]] = []
-    for o in items:
-        idv = (o.get("id","") or "").strip()
-        ttl = (o.get("title","") or "").strip()
-        dsc = (o.get("description","") or "")
-        img = (o.get("image","") or "").strip()
-        if img and not img.startswith("/") and not img.startswith("http"):
-            img = f"/cataclysms/{img}"
-        if any((idv, ttl, dsc.strip(), img)):
-            normalized.append({"id": idv, "title": ttl, "description": dsc, "image": img})
-    if not normalized:
-        return text
+@app.errorhandler(DeckLockTimeout)
+def _lock_timeout(e: DeckLockTimeout):
+    return jsonify({"error": str(e)}), 503, {"Retry-After": "5"}
 
-    def fmt(o: Dict[str,str]) -> str:
-        desc = (o.get("description","") or "").replace("\\","\\\\").replace("'","\\'").replace("\r\n","\n").replace("\n","\\n")
-        img = (o.get("image","") or "")
-        return (
-            "{\n"
-            f"    id: '{o.get('id','')}',\n"
-            f"    title: '{o.get('title','Катаклизм')}',\n"
-            f"    description:\n"
-            f"      '{desc}',\n"
-            f"    image: '{img}',\n"
-            "  }"
-        )
-    inner = ",\n  ".join(fmt(o) for o in normalized)
-    new_block = f"const CATAclySMS = [\n  {inner},\n];"
-    pattern = r"const\s+CATAclySMS\s*=\s*\[(.*?)\]\s*;"
-    if re.search(pattern, text, flags=re.DOTALL | re.UNICODE):
-        return re.sub(pattern, new_block, text, flags=re.DOTALL | re.UNICODE)
-    return re.sub(r"module\.exports\s*=\s*\{", new_block + "\n\nmodule.exports = {", text, count=1)
+def _api_section(doc: Dict[str, Any], section: str) -> List[Any]:
+    if section in ARRAY_KEYS:
+        return list(doc["arrays"].get(section, []))
+    if section == "bunkers":
+        return normalize_bunkers(doc["bunkers"])
+    if section == "cataclysms":
+        return normalize_cataclysms(doc["cats"])
+    raise ApiError(404, f"Неизвестный раздел: {section}")
 
-# ---------- BUNKERS ----------
-def parse_bunkers(text: str) -> List[Dict[str, Any]]:
-    span = _find_array_span(text, "BUNKERS")
-    if not span:
-        return []
-    block = text[span[0]:span[1]]
-    raw_objs = _split_top_level_objects(block)
-    res: List[Dict[str, Any]] = []
-    for raw in raw_objs:
-        def gets(pats: List[str]) -> str:
-            for p in pats:
-                m = re.search(p, raw, flags=re.DOTALL | re.UNICODE)
-                if m:
-                    return m.group(1)
-            return ""
-        def getn(p: str) -> int:
-            m = re.search(p, raw, flags=re.DOTALL | re.UNICODE)
-            return int(m.group(1)) if m else 0
-        items_block = re.search(r"items:\s*\[(.*?)\]", raw, flags=re.DOTALL | re.UNICODE)
-        items = re.findall(r"'([^']*)'", items_block.group(1)) if items_block else []
-        res.append({
-            "description": gets([r"description:\s*'([\s\S]*?)'"]),
-            "items": items,
-            "sizeM2": getn(r"sizeM2:\s*(\d+)"),
-            "stayText": gets([r"stayText:\s*'([\s\S]*?)'"]),
-            "foodText": gets([r"foodText:\s*'([\s\S]*?)'"]),
-            "places": getn(r"places:\s*(\d+)"),
-        })
-    return res
+def _api_normalize(section: str, items: List[Any]) -> List[Any]:
+    if section in ARRAY_KEYS:
+        return [s.strip() for s in items if s.strip()]
+    if section == "bunkers":
+        return normalize_bunkers(items)
+    return normalize_cataclysms(items)
 
-def replace_bunkers(text: str, bunkers: List[Dict[str, Any]]) -> str:
-    valid = []
-    for b in bunkers:
-        if any([
-            (b.get("description") or "").strip(),
-            b.get("items"),
-            int(b.get("sizeM2") or 0) > 0,
-            (b.get("stayText") or "").strip(),
-            (b.get("foodText") or "").strip(),
-            int(b.get("places") or 0) > 0,
-        ]):
-            valid.append(b)
-    if not valid:
-        return text
+def _api_item(section: str, payload: Any, base: Optional[Dict[str, Any]] = None) -> Any:
+    """Проверяет тело запроса. Для PATCH объектов base — текущая запись, поля сливаются."""
+    if section in ARRAY_KEYS:
+        value = payload.get("value") if isinstance(payload, dict) else payload
+        if not isinstance(value, str) or not value.strip():
+            raise ApiError(400, "Ожидается непустая строка в поле 'value'")
+        return value.strip()
+    if not isinstance(payload, dict):
+        raise ApiError(400, "Ожидается JSON-объект")
+    fields = {f.name: f.kind for f in OBJECT_SCHEMAS[BATCH_SECTIONS[section]]}
+    item = dict(base) if base else {f: _EMPTY[kind]() for f, kind in fields.items()}
+    for f, value in payload.items():
+        if f not in fields:
+            raise ApiError(400, f"Неизвестное поле: {f}")
+        kind = fields[f]
+        if kind == "int" and not isinstance(value, bool) and isinstance(value, int):
+            item[f] = value
+        elif kind == "list" and isinstance(value, list) and all(isinstance(x, str) for x in value):
+            item[f] = [x.strip() for x in value if x.strip()]
+        elif kind == "str" and isinstance(value, str):
+            item[f] = value
+        else:
+            raise ApiError(400, f"Неверный тип поля {f}: ожидается {kind}")
+    normalized = normalize_bunkers([item]) if section == "bunkers" else normalize_cataclysms([item])
+    if not normalized:
+        raise ApiError(400, "Пустая запись")
+    return normalized[0]
 
-    def esc(s: str) -> str:
-        return (s or "").replace("\\","\\\\").replace("'","\\'").replace("\r\n","\n").replace("\n","\\n")
+def _api_response(payload: Any, etag: str, status: int = 200):
+    resp = jsonify(payload)
+    resp.status_code = status
+    resp.set_etag(etag)
+    return resp
 
-    def fmt_items(lst: List[str]) -> str:
-        inner = ", ".join(f"'{esc(x)}'" for x in lst if str(x).strip())
-        return f"[{inner}]"
+def _api_check_etag(doc: Dict[str, Any]) -> None:
+    if request.headers.get("If-Match") is None:
+        return
+    if not etag_matches(request.if_match, doc["hash"]):
+        raise ApiError(412, "Файл изменился с момента чтения (If-Match не совпадает с ETag)")
 
-    def fmt_obj(b: Dict[str, Any]) -> str:
-        return (
-            "{\n"
-            f"    description:\n"
-            f"      '{esc(str(b.get('description','')))}',\n"
-            f"    items: {fmt_items(list(b.get('items', [])))},\n"
-            f"    sizeM2: {int(b.get('sizeM2') or 0)},\n"
-            f"    stayText: '{esc(str(b.get('stayText','')))}',\n"
-            f"    foodText: '{esc(str(b.get('foodText','')))}',\n"
-            f"    places: {int(b.get('places') or 0)},\n"
-            "  }"
-        )
-    inner = ",\n  ".join(fmt_obj(b) for b in valid)
-    new_block = f"const BUNKERS = [\n  {inner},\n];"
-    pattern = r"const\s+BUNKERS\s*=\s*\[(.*?)\]\s*;"
-    if re.search(pattern, text, flags=re.DOTALL | re.UNICODE):
-        return re.sub(pattern, new_block, text, flags=re.DOTALL | re.UNICODE)
-    return re.sub(r"module\.exports\s*=\s*\{", new_block + "\n\nmodule.exports = {", text, count=1)
+def _api_write(doc: Dict[str, Any], section: str, items: List[Any]) -> str:
+    """Записывает раздел, меняя в блоке только затронутые элементы. Если раздел
+    не изменился, файл не трогается и возвращается текущий ETag."""
+    items = _api_normalize(section, items)
+    if items == _api_normalize(section, _api_section(doc, section)):
+        return doc["hash"]
+    name = section if section in ARRAY_KEYS else BATCH_SECTIONS[section]
+    return text_hash(save_blocks(doc, {name: edit_block(doc["text"], name, items)}))
 
-# ---------- ABILITIES сохранение ----------
-def ensure_abilities_preserved(original_text: str, new_text: str) -> str:
-    if extract_verbatim(new_text, "ABILITIES"):
-        return new_text
-    orig = extract_verbatim(original_text, "ABILITIES")
-    if orig:
-        return re.sub(r"module\.exports\s*=\s*\{", orig + "\n\nmodule.exports = {", new_text, count=1)
-    fallback = "const ABILITIES = [\n  // редактор не изменяет этот блок\n];"
-    return re.sub(r"module\.exports\s*=\s*\{", fallback + "\n\nmodule.exports = {", new_text, count=1)
+def _api_index(items: List[Any], index: int) -> int:
+    if not 0 <= index < len(items):
+        raise ApiError(404, f"Нет элемента с индексом {index}")
+    return index
 
-# ---------- Flask ----------
-@app.route("/", endpoint="index", methods=["GET", "POST"])
-def index():
-    original_text = load_text()
-    text = original_text
+def _api_matches(item: Any, q: str) -> bool:
+    if isinstance(item, str):
+        return q in item.casefold()
+    for v in item.values():
+        if isinstance(v, str) and q in v.casefold():
+            return True
+        if isinstance(v, list) and any(q in str(x).casefold() for x in v):
+            return True
+    return False
 
-    if request.method == "POST":
-        # простые списки
-        for key in ARRAY_KEYS:
-            items = [s.strip() for s in request.form.getlist(f"{key}_item") if s.strip()]
-            text = replace_array(text, key, items)
-
-        # бункеры
-        idxs = request.form.getlist("bunk_idx")
-        bunkers: List[Dict[str, Any]] = []
-        for i in idxs:
-            desc = request.form.get(f"bunk_desc_{i}", "") or ""
-            size = request.form.get(f"bunk_size_{i}", "0") or "0"
-            stay = request.form.get(f"bunk_stay_{i}", "") or ""
-            food = request.form.get(f"bunk_food_{i}", "") or ""
-            places = request.form.get(f"bunk_places_{i}", "0") or "0"
-            items = [s.strip() for s in request.form.getlist(f"bunk_item_{i}") if s.strip()]
-            bunkers.append({
-                "description": desc,
-                "items": items,
-                "sizeM2": int(size) if str(size).isdigit() else 0,
-                "stayText": stay,
-                "foodText": food,
-                "places": int(places) if str(places).isdigit() else 0,
-            })
-        text = replace_bunkers(text, bunkers)
-
-        # катаклизмы
-        ids = request.form.getlist("cat_id")
-        titles = request.form.getlist("cat_title")
-        descs = request.form.getlist("cat_description")
-        images = request.form.getlist("cat_image")
-        cats: List[Dict[str, str]] = []
-        maxlen = max(len(ids), len(titles), len(descs), len(images)) if any([ids, titles, descs, images]) else 0
-        for i in range(maxlen):
-            cats.append({
-                "id": (ids[i] if i < len(ids) else "").strip(),
-                "title": (titles[i] if i < len(titles) else "").strip(),
-                "description": (descs[i] if i < len(descs) else ""),
-                "image": (images[i] if i < len(images) else "").strip(),
-            })
-        text = replace_cataclysms(text, cats, original_text)
+@app.route("/api/<section>", methods=["GET"])
+def api_list(section: str):
+    """Список раздела. Необязательные ?q= (поиск без учёта регистра), ?offset=, ?limit=."""
+    doc = load_document()
+    items = _api_section(doc, section)
+    q = (request.args.get("q") or "").strip().casefold()
+    indexes = [i for i, it in enumerate(items) if _api_matches(it, q)] if q else range(len(items))
+    offset = max(0, request.args.get("offset", 0, type=int))
+    limit = request.args.get("limit", type=int)
+    limit = len(indexes) if limit is None else max(1, min(limit, API_MAX_LIMIT))
+    page = list(indexes[offset:offset + limit])
+    payload = {"section": section, "total": len(indexes), "offset": offset, "limit": limit,
+               "indexes": page, "items": [items[i] for i in page]}
+    return _api_response(payload, doc["hash"]).make_conditional(request)
 
-        text = ensure_abilities_preserved(original_text, text)
-        save_text(text)
-        flash("Изменения сохранены ✅")
-        return redirect(url_for("index"))
+@app.route("/api/<section>/<int:index>", methods=["GET"])
+def api_get(section: str, index: int):
+    doc = load_document()
+    items = _api_section(doc, section)
+    item = items[_api_index(items, index)]
+    return _api_response({"index": index, "item": item}, doc["hash"]).make_conditional(request)
 
-    arrays = {key: parse_array(text, key) for key in ARRAY_KEYS}
-    bunkers = parse_bunkers(text)
-    cats = parse_cataclysms(text)
+@app.route("/api/<section>", methods=["POST"])
+def api_create(section: str):
+    payload = request.get_json(silent=True)
+    with deck_lock():
+        doc = load_document()
+        _api_check_etag(doc)
+        items = _api_section(doc, section)
+        item = _api_item(section, payload)
+        pos = payload.get("index", len(items)) if isinstance(payload, dict) and section in ARRAY_KEYS else len(items)
+        if not isinstance(pos, int) or isinstance(pos, bool) or not 0 <= pos <= len(items):
+            raise ApiError(400, "Неверный 'index'")
+        items.insert(pos, item)
+        etag = _api_write(doc, section, items)
+    return _api_response({"index": pos, "item": item}, etag, 201)
 
-    return render_template_string(TPL, arrays=arrays, bunkers=bunkers, cats=cats,
-                                  array_keys=ARRAY_KEYS, labels=LABELS, file_path=str(FILE_PATH),
-                                  GITHUB_REPO=GITHUB_REPO, GITHUB_BRANCH=GITHUB_BRANCH)
+@app.route("/api/<section>/<int:index>", methods=["PATCH", "PUT"])
+def api_update(section: str, index: int):
+    payload = request.get_json(silent=True)
+    with deck_lock():
+        doc = load_document()
+        _api_check_etag(doc)
+        items = _api_section(doc, section)
+        _api_index(items, index)
+        base = items[index] if section not in ARRAY_KEYS and request.method == "PATCH" else None
+        items[index] = _api_item(section, payload, base)
+        etag = _api_write(doc, section, items)
+    return _api_response({"index": index, "item": items[index]}, etag)
 
-# ---------- Доп. роуты ----------
-@app.route("/sync", methods=["POST"])
-def sync_action():
-    repo = request.form.get("repo") or GITHUB_REPO
-    branch = request.form.get("branch") or GITHUB_BRANCH
+@app.route("/api/<section>/<int:index>", methods=["DELETE"])
+def api_delete(section: str, index: int):
+    with deck_lock():
+        doc = load_document()
+        _api_check_etag(doc)
+        items = _api_section(doc, section)
+        item = items.pop(_api_index(items, index))
+        etag = _api_write(doc, section, items)
+    return _api_response({"index": index, "item": item}, etag)
+
+# --- выгрузка и загрузка колоды целиком ---
+@app.route("/export.<any(jsonl, csv):fmt>", methods=["GET"])
+def export_action(fmt: str):
+    """Колода потоком в JSONL или CSV. ?sections= — разделы через запятую."""
     try:
-        changed = sync_from_github(repo, branch)
-        flash(f"Синхронизация завершена ✅ Обновлено файлов: {changed}")
-    except Exception as e:
-        flash(str(e))
-    return redirect(url_for("index"))
+        sections = deck_sections(request.args.get("sections"))
+    except ValueError as e:
+        raise ApiError(400, str(e))
+    doc = load_document()
+    chunks = export_jsonl(doc, sections) if fmt == "jsonl" else export_csv(doc, sections)
+    resp = Response(chunks, mimetype=EXPORT_MIMETYPES[fmt])
+    resp.headers["Content-Disposition"] = f'attachment; filename="cards.{fmt}"'
+    # без make_conditional: он считает Content-Length и ради этого собирает весь поток
+    # в память; 304 по If-None-Match отдаёт _compress_response
+    resp.set_etag(doc["hash"])
+    return resp
 
-@app.route("/reload", methods=["GET"])
-def reload_action():
-    flash("Перезагрузка интерфейса выполнена 🔄")
-    return redirect(url_for("index"))
+@app.route("/import.<any(jsonl, csv):fmt>", methods=["POST"])
+def import_action(fmt: str):
+    """Записи в формате /export из тела запроса (или из файла формы 'file').
+    ?mode=merge|replace, ?dedupe=0 — без дедупликации, ?dry_run=1 — без записи.
+    If-Match — как в JSON API."""
+    mode = request.args.get("mode", "merge")
+    if mode not in IMPORT_MODES:
+        raise ApiError(400, f"Неизвестный режим: {mode}")
+    dedupe = request.args.get("dedupe", "1") != "0"
+    dry_run = request.args.get("dry_run") == "1"
+    request.max_content_length = IMPORT_MAX_BYTES   # до первого чтения тела
+    # request.form не трогаем: иначе тело в x-www-form-urlencoded (curl --data-binary) будет съедено
+    try:
+        upload = request.files.get("file") if request.mimetype == "multipart/form-data" else None
+        stream = io.TextIOWrapper(upload.stream if upload else request.stream, encoding="utf-8-sig", newline="")
+        report = import_deck(read_records(stream, fmt, f"import.{fmt}"), mode, dedupe, dry_run,
+                             check=_api_check_etag)
+    except RequestEntityTooLarge:
+        raise ApiError(413, f"Импорт больше {IMPORT_MAX_BYTES // 1024} КБ — загрузите его частями "
+                            f"или командой import ({Path(__file__).name} import)")
+    except (ValueError, csv.Error) as e:   # BatchError и UnicodeDecodeError — тоже ValueError
+        raise ApiError(400, str(e))
+    etag = load_document()["hash"]   # при dry_run файл прежний
+    return _api_response(report, etag)
 
 # ---------- Шаблон ----------
-TPL = r"""
-<!doctype html>
-<html lang="ru">
-<head>
-  <meta charset="utf-8"/>
-  <title>Редактор cards.js</title>
-  <meta name="viewport" content="width=device-width, initial-scale=1"/>
-  <style>
+STYLE = r"""
     body{font-family:system-ui,-apple-system,Segoe UI,Roboto,Arial,sans-serif;margin:0;background:#0b0f14;color:#e6edf3}
     header{padding:16px 20px;background:#111826;position:sticky;top:0;border-bottom:1px solid #1f2937}
     h1{margin:0;font-size:18px}
@@ -416,30 +4526,564 @@ TPL = r"""
     .num{display:flex;align-items:center;justify-content:center;background:#111827;border:1px solid #273144;border-radius:8px;height:38px}
     .add{background:#1f2937;border:1px dashed #374151;border-radius:10px;padding:8px;text-align:center;cursor:pointer}
     .subrow{display:grid;grid-template-columns:42px 1fr;gap:8px;align-items:center;margin-top:6px}
+    .section > summary{cursor:pointer;display:flex;align-items:center;justify-content:space-between;list-style:none}
+    .section .search{margin:10px 0}
+    .pager{display:flex;gap:8px;align-items:center;justify-content:flex-end;margin-top:8px}
+    .pager button, .del{background:#1f2937;border:1px solid #374151;color:#e6edf3;border-radius:8px;padding:6px 10px;cursor:pointer}
+    .flash.error{background:#4c0519;border-color:#881337;color:#ffe4e6}
+    .thumb{display:block;max-width:100%;margin-top:6px;border-radius:8px}
+    .img-warn{color:#fca5a5;margin-top:4px}
+"""
+
+# Опрос /sync/<id>: ход синхронизации выводится в #flash, по завершении страница перезагружается
+SYNC_JS = r"""
+function watchSync(id){
+  if (!id) return;
+  const box = document.getElementById('flash');
+  const kb = n => Math.round((n || 0) / 1024);
+  const tick = async () => {
+    const r = await fetch(BASE + '/sync/' + id);
+    if (!r.ok) return;
+    const j = await r.json();
+    box.style.display = '';
+    if (j.state === 'failed'){ box.className = 'flash error'; box.textContent = 'Ошибка синхронизации: ' + j.error; return; }
+    if (j.state === 'done'){
+      box.textContent = 'Синхронизация завершена ✅ ' + j.message;
+      if (j.result && j.result.changed) setTimeout(() => { location.href = location.pathname; }, 800);
+      return;
+    }
+    box.textContent = j.state === 'queued' ? 'Синхронизация ' + j.key + ' в очереди…'
+      : 'Синхронизация ' + j.key + ': скачано ' + kb(j.bytes) + (j.total_bytes ? ' из ' + kb(j.total_bytes) : '') +
+        ' КБ, файлов ' + j.files_done + (j.files_total ? ' из ' + j.files_total : '') + ', записано ' + j.files_written;
+    setTimeout(tick, 1000);
+  };
+  tick();
+}
+"""
+
+# Подписка на /events: onDeck(изменившиеся блоки, событие) вызывается, когда версии
+# разделов на сервере разошлись с известными странице; возвращает блоки, которые
+# страница обновила (остальные будут предложены снова со следующим событием).
+WATCH_JS = r"""
+function watchDeck(versions, onDeck, onImages){
+  if (!window.EventSource) return;
+  const known = Object.assign({}, versions);
+  const es = new EventSource(BASE + '/events');
+  es.addEventListener('deck', async e => {
+    const ev = JSON.parse(e.data);
+    const changed = Object.keys(ev.versions).filter(k => known[k] !== ev.versions[k]);
+    const done = await onDeck(changed, ev);
+    (done || []).forEach(k => { known[k] = ev.versions[k]; });
+  });
+  if (onImages) es.addEventListener('images', e => onImages(JSON.parse(e.data)));
+}
+"""
+
+WAIT_TPL = r"""
+<!doctype html>
+<html lang="ru">
+<head>
+  <meta charset="utf-8"/>
+  <title>Редактор cards.js — загрузка</title>
+  <meta name="viewport" content="width=device-width, initial-scale=1"/>
+  <style>{{ style|safe }}</style>
+</head>
+<body>
+<header><h1>Редактор cards.js <span class="muted">({{file_path}})</span></h1></header>
+<main>
+  <div class="flash" id="flash">Файл не найден — скачиваем {{ job.key }}…</div>
+  <a class="btn secondary" href="{{ url_for('reload_action') }}">↻ Перезагрузка</a>
+</main>
+<script>
+const BASE = {{ request.script_root|tojson }};   // префикс приложения (/d/<колода> в рабочем пространстве)
+{{ sync_js|safe }}
+watchSync({{ job.id|tojson }});
+</script>
+</body>
+</html>
+"""
+
+HISTORY_TPL = r"""
+<!doctype html>
+<html lang="ru">
+<head>
+  <meta charset="utf-8"/>
+  <title>История — cards.js</title>
+  <meta name="viewport" content="width=device-width, initial-scale=1"/>
+  <style>{{ style|safe }}</style>
+</head>
+<body>
+<header>
+  <h1>История правок <span class="muted">({{file_path}})</span></h1>
+  <div style="margin-top:8px;display:flex;gap:8px">
+    <a class="btn secondary" href="{{ url_for('index') }}">← Редактор</a>
+    <a class="btn secondary" href="{{ url_for('history_list', format='json') }}">JSON</a>
+  </div>
+</header>
+<main>
+  {% with msgs = get_flashed_messages() %}{% if msgs %}<div class="flash">{{ msgs[-1] }}</div>{% endif %}{% endwith %}
+  <div class="card">
+    {% for v in versions %}
+    <div class="row" style="grid-template-columns:60px 170px 1fr 110px 230px;margin-bottom:6px">
+      <div class="num">{{ v.id }}</div>
+      <span class="muted">{{ v.time|datetime }}</span>
+      <span>{{ v.source }} <span class="muted">{{ v.hash[:10] }}</span></span>
+      <span class="muted">{{ (v.size / 1024)|round(1) }} КБ</span>
+      <form method="post" action="{{ url_for('history_restore', version_id=v.id) }}" style="display:flex;gap:6px">
+        <a class="btn secondary" href="{{ url_for('history_diff', b=v.id) }}">diff</a>
+        <a class="btn secondary" href="{{ url_for('history_text', version_id=v.id) }}">файл</a>
+        <button class="btn" type="submit" onclick="return confirm('Восстановить версию {{ v.id }}?')">↺</button>
+      </form>
+    </div>
+    {% else %}
+    <div class="muted">История пуста — версии появятся после первого сохранения.</div>
+    {% endfor %}
+    <div class="pager">
+      <span class="muted">{{ offset + 1 }}–{{ offset + versions|length }} из {{ total }}</span>
+      {% if offset > 0 %}<a class="btn secondary" href="{{ url_for('history_list', offset=[offset - limit, 0]|max) }}">←</a>{% endif %}
+      {% if offset + limit < total %}<a class="btn secondary" href="{{ url_for('history_list', offset=offset + limit) }}">→</a>{% endif %}
+    </div>
+  </div>
+</main>
+</body>
+</html>
+"""
+
+SIM_TPL = r"""
+<!doctype html>
+<html lang="ru">
+<head>
+  <meta charset="utf-8"/>
+  <title>Баланс колоды — cards.js</title>
+  <meta name="viewport" content="width=device-width, initial-scale=1"/>
+  <style>{{ style|safe }}
+    table{border-collapse:collapse;width:100%;font-size:13px}
+    th,td{border-bottom:1px solid #1f2937;padding:4px 6px;text-align:right}
+    th:first-child,td:first-child{text-align:left}
+    .warn{color:#fca5a5}
   </style>
 </head>
 <body>
 <header>
-  <h1>Редактор cards.js <span class="muted">({{file_path}})</span></h1>
-  <form method="post" action="/sync" style="margin-top:8px;display:flex;gap:8px;align-items:center">
+  <h1>Баланс колоды <span class="muted">({{file_path}})</span></h1>
+  <form method="get" style="margin-top:8px;display:flex;gap:8px;align-items:center">
+    <label class="muted">комнат <input type="number" name="rooms" value="{{ report.rooms }}" style="width:130px"/></label>
+    <label class="muted">игроков <input type="text" name="players" value="{{ players_spec }}" style="width:110px"/></label>
+    <label class="muted">seed <input type="number" name="seed" value="{{ report.seed if report.seed is not none else '' }}" style="width:90px"/></label>
+    <button class="btn" type="submit">Пересчитать</button>
+    <a class="btn secondary" href="{{ url_for('index') }}">← Редактор</a>
+    <a class="btn secondary" href="{{ url_for('simulate_action', format='json', rooms=report.rooms, players=players_spec, seed=report.seed) }}">JSON</a>
+  </form>
+  <div class="muted" style="margin-top:6px">{{ report.rooms }} комнат на каждый размер, {{ '%.2f'|format(report.seconds) }} с</div>
+</header>
+<main>
+  <div class="card">
+    <h3>Совпадения карт в комнате</h3>
+    <div class="muted">Доля комнат, где у двух игроков одинаковая карта; в скобках — при тех же картах без повторов в списке.</div>
+    <table>
+      <tr><th>Список</th><th>карт</th>{% for n in report.players %}<th>{{ n }}</th>{% endfor %}</tr>
+      {% for key, c in report.categories.items() %}
+      <tr>
+        <td>{{ key }}{% if c.repeated %} <span class="warn" title="{{ c.repeated|join(' | ') }}">повторов: {{ c.repeated|length }}</span>{% endif %}</td>
+        <td>{{ c.distinct }}/{{ c.size }}</td>
+        {% for n in report.players %}{% set r = c.by_players[n] %}
+        <td>{{ '%.1f'|format(r.collision_rate * 100) }}% <span class="muted">({{ '%.1f'|format(r.ideal_rate * 100) }})</span></td>
+        {% endfor %}
+      </tr>
+      {% endfor %}
+      {% if report.abilities %}
+      <tr>
+        <td>ABILITIES (2 на руку)</td><td>{{ report.abilities.distinct }}/{{ report.abilities.size }}</td>
+        {% for n in report.players %}<td>{{ '%.1f'|format(report.abilities.by_players[n].collision_rate * 100) }}%</td>{% endfor %}
+      </tr>
+      {% endif %}
+    </table>
+  </div>
+  {% if report.abilities %}{% set a = report.abilities %}
+  <div class="card">
+    <h3>Пары способностей</h3>
+    <div class="muted">{{ a.hands }} рук, {{ a.pairs }} возможных пар; ожидаемая доля пары {{ '%.3f'|format(a.pair_share_expected * 100) }}%,
+      фактически от {{ '%.3f'|format(a.pair_share_min * 100) }}% до {{ '%.3f'|format(a.pair_share_max * 100) }}%.
+      {% if a.same_pair_rate %}<span class="warn">Одинаковая способность дважды: {{ '%.3f'|format(a.same_pair_rate * 100) }}% рук</span>{% endif %}</div>
+    <div class="grid">
+      {% for title, rows in (("Чаще всего", a.top), ("Реже всего", a.bottom)) %}
+      <table>
+        <tr><th>{{ title }}</th><th>доля</th></tr>
+        {% for p in rows %}<tr><td>{{ p.a }}<br/>+ {{ p.b }}</td><td>{{ '%.3f'|format(p.share * 100) }}%</td></tr>{% endfor %}
+      </table>
+      {% endfor %}
+    </div>
+  </div>
+  {% endif %}
+  {% set bk = report.bunkers %}
+  <div class="card">
+    <h3>Места в бункере</h3>
+    <div class="muted">Бункеров: {{ bk.count }}; мест → бункеров:
+      {% for p, c in bk.places_hist.items() %}<span class="pill">{{ p }} → {{ c }}</span>{% endfor %}</div>
+    <table>
+      <tr><th>Игроков</th>{% for n in report.players %}<th>{{ n }}</th>{% endfor %}</tr>
+      <tr><td>мест хватает всем</td>{% for n in report.players %}<td>{{ '%.0f'|format(bk.by_players[n].covered_rate * 100) }}%</td>{% endfor %}</tr>
+      <tr><td>выживает в среднем</td>{% for n in report.players %}<td>{{ '%.0f'|format(bk.by_players[n].survivors_share * 100) }}%</td>{% endfor %}</tr>
+      <tr><td>мест назначает сервер</td>{% for n in report.players %}<td>{{ bk.by_players[n].server_places }}</td>{% endfor %}</tr>
+    </table>
+  </div>
+</main>
+</body>
+</html>
+"""
+
+DECKS_TPL = r"""
+<!doctype html>
+<html lang="ru">
+<head>
+  <meta charset="utf-8"/>
+  <title>Колоды — cards.js</title>
+  <meta name="viewport" content="width=device-width, initial-scale=1"/>
+  <style>{{ style|safe }}</style>
+</head>
+<body>
+<header>
+  <h1>Колоды <span class="muted">({{ workspace.path }})</span></h1>
+  <div class="muted" style="margin-top:6px">Картинки: {{ store.path }} — {{ store.blobs }} файлов,
+    {{ (store.bytes / 1048576)|round(1) }} МБ, общих для нескольких колод: {{ store.shared }}</div>
+</header>
+<main>
+  <div class="card">
+    {% for d in decks %}
+    <div class="row" style="grid-template-columns:160px 1fr 1fr 120px;margin-bottom:6px">
+      <a class="btn{% if d.name != workspace.default %} secondary{% endif %}" href="{{ d.url }}">{{ d.name }}</a>
+      <span>{{ d.repo }}@{{ d.branch }}</span>
+      <span class="muted">{{ d.path }}</span>
+      <span class="muted">{% if d.exists %}{{ (d.size / 1024)|round(1) }} КБ{% else %}не скачана{% endif %}</span>
+    </div>
+    {% endfor %}
+  </div>
+</main>
+</body>
+</html>
+"""
+
+SHELL_TPL = r"""
+<!doctype html>
+<html lang="ru">
+<head>
+  <meta charset="utf-8"/>
+  <title>Редактор cards.js</title>
+  <meta name="viewport" content="width=device-width, initial-scale=1"/>
+  <style>{{ style|safe }}</style>
+</head>
+<body>
+<header>
+  <h1>Редактор cards.js{% if deck %} — <a href="{{ workspace_root }}/decks">{{ deck }}</a>{% endif %} <span class="muted">({{file_path}})</span></h1>
+  <form method="post" action="{{ url_for('sync_action') }}" style="margin-top:8px;display:flex;gap:8px;align-items:center">
+    <input type="text" name="repo" placeholder="owner/repo" value="{{GITHUB_REPO}}" style="width:220px;background:#0b1220;color:#e6edf3;border:1px solid #273144;border-radius:8px;padding:6px"/>
+    <input type="text" name="branch" placeholder="branch" value="{{GITHUB_BRANCH}}" style="width:120px;background:#0b1220;color:#e6edf3;border:1px solid #273144;border-radius:8px;padding:6px"/>
+    <label class="muted"><input type="checkbox" name="prune" value="1"/> удалить пропавшие картинки</label>
+    <button class="btn" type="submit">⬇️ Скачать данные из GitHub</button>
+    <a class="btn secondary" href="{{ url_for('reload_action') }}">↻ Перезагрузка</a>
+    <a class="btn secondary" href="{{ url_for('full_editor') }}">Полная форма</a>
+    <a class="btn secondary" href="{{ url_for('simulate_action') }}">Баланс колоды</a>
+    <a class="btn secondary" href="{{ url_for('history_list') }}">История</a>
+    <a class="btn secondary" href="{{ url_for('export_action', fmt='jsonl') }}">Экспорт JSONL</a>
+    <a class="btn secondary" href="{{ url_for('export_action', fmt='csv') }}">CSV</a>
+  </form>
+  <div class="muted" style="margin-top:6px">По умолчанию: {{GITHUB_REPO}}@{{GITHUB_BRANCH}} → cards.js и /client/public/cataclysms</div>
+</header>
+<main>
+  {% with msgs = get_flashed_messages() %}
+    <div class="flash" id="flash" {% if not msgs %}style="display:none"{% endif %}>{{ msgs[-1] if msgs }}</div>
+  {% endwith %}
+
+  <div class="card">
+    <input type="text" class="search" id="gsearch" placeholder="Поиск по всей колоде (начало слова)..."/>
+    <div id="gresults"></div>
+    <a class="muted" href="{{ url_for('duplicates_action') }}">Похожие записи (JSON)</a>
+  </div>
+
+  <div class="card">
+    <h3>Категории</h3>
+    <div class="grid">
+      {% for key in array_keys %}
+        <details class="card section" data-section="{{key}}" data-kind="array">
+          <summary><strong>{{ labels.get(key, key) }}</strong><span class="muted" data-count>{{ counts[key] }} шт.</span></summary>
+          <div class="body"></div>
+        </details>
+      {% endfor %}
+    </div>
+  </div>
+
+  <details class="card section" data-section="bunkers" data-kind="bunker">
+    <summary><strong>Бункеры (BUNKERS)</strong><span class="muted" data-count>{{ counts['bunkers'] }} шт.</span></summary>
+    <div class="body"></div>
+  </details>
+
+  <details class="card section" data-section="cataclysms" data-kind="cataclysm">
+    <summary><strong>Катаклизмы (CATACLYSMS)</strong><span class="muted" data-count>{{ counts['cataclysms'] }} шт.</span></summary>
+    <div class="body"></div>
+    <p class="muted">Совет: изображения храните в /client/public/cataclysms и указывайте путь вида <span class="pill">/cataclysms/file.jpg</span>.
+      <a href="{{ url_for('images_report') }}">Отчёт по картинкам</a></p>
+  </details>
+</main>
+
+<script>
+const BASE = {{ request.script_root|tojson }};   // префикс приложения (/d/<колода> в рабочем пространстве)
+const PAGE = {{ page_size }};
+const IMAGES = {{ images|tojson }};
+let ETAG = null;
+const state = {};
+
+function esc(s){
+  return String(s ?? '').replace(/[&<>"']/g, c => ({'&':'&amp;','<':'&lt;','>':'&gt;','"':'&quot;',"'":'&#39;'}[c]));
+}
+function notify(msg, error){
+  const f = document.getElementById('flash');
+  f.textContent = msg;
+  f.className = error ? 'flash error' : 'flash';
+  f.style.display = '';
+}
+async function api(method, url, body){
+  const opts = {method, headers: {}};
+  if (body !== undefined){ opts.headers['Content-Type'] = 'application/json'; opts.body = JSON.stringify(body); }
+  if (method !== 'GET' && ETAG) opts.headers['If-Match'] = ETAG;
+  const r = await fetch(url, opts);
+  const et = r.headers.get('ETag');
+  if (et) ETAG = et;
+  const data = await r.json().catch(() => ({}));
+  if (!r.ok){ const e = new Error(data.error || r.statusText); e.status = r.status; throw e; }
+  return data;
+}
+
+function rowHtml(kind, i, it){
+  const num = '<div class="num">'+(i+1)+'</div>';
+  const del = '<button type="button" class="del" data-del title="Удалить">✕</button>';
+  if (kind === 'array'){
+    return '<div class="row" data-index="'+i+'" style="grid-template-columns:42px 1fr 42px;margin-bottom:6px">'+num+
+      '<input type="text" data-field="value" value="'+esc(it)+'"/>'+del+'</div>';
+  }
+  if (kind === 'bunker'){
+    return '<div class="card" data-index="'+i+'"><div class="row" style="grid-template-columns:42px 1fr 110px 160px 160px 90px 42px">'+num+
+      '<textarea data-field="description" placeholder="Описание..." style="min-height:100px">'+esc(it.description)+'</textarea>'+
+      '<input type="number" data-field="sizeM2" value="'+esc(it.sizeM2)+'" placeholder="м²"/>'+
+      '<input type="text" data-field="stayText" value="'+esc(it.stayText)+'" placeholder="Время пребывания"/>'+
+      '<input type="text" data-field="foodText" value="'+esc(it.foodText)+'" placeholder="Запас еды"/>'+
+      '<input type="number" data-field="places" value="'+esc(it.places)+'" placeholder="Мест"/>'+del+'</div>'+
+      '<div class="muted" style="margin:6px 0 4px">Предметы (по одному в строке):</div>'+
+      '<textarea data-field="items" style="min-height:70px">'+esc((it.items || []).join('\n'))+'</textarea></div>';
+  }
+  return '<div class="row" data-index="'+i+'" style="grid-template-columns:42px 140px 180px 1fr 220px 42px;margin-bottom:8px;align-items:start">'+num+
+    '<input type="text" data-field="id" value="'+esc(it.id)+'"/>'+
+    '<input type="text" data-field="title" value="'+esc(it.title)+'"/>'+
+    '<textarea data-field="description" style="min-height:120px">'+esc(it.description)+'</textarea>'+
+    '<div><input type="text" data-field="image" value="'+esc(it.image)+'"/>'+imageHtml(it.image)+'</div>'+del+'</div>';
+}
+
+function imageHtml(path){
+  const im = IMAGES[path];
+  if (!im) return path && path.startsWith('/cataclysms/') ? '<div class="muted img-warn">нет файла</div>' : '';
+  return (im.thumb ? '<img class="thumb" loading="lazy" src="'+esc(im.thumb)+'" alt=""/>' : '')+
+    (im.big ? '<div class="muted img-warn">'+(im.bytes / 1048576).toFixed(1)+' МБ — слишком большая</div>' : '');
+}
+
+function collect(kind, row){
+  const get = f => { const el = row.querySelector('[data-field="'+f+'"]'); return el ? el.value : ''; };
+  if (kind === 'array') return {value: get('value')};
+  if (kind === 'bunker') return {
+    description: get('description'), stayText: get('stayText'), foodText: get('foodText'),
+    sizeM2: parseInt(get('sizeM2'), 10) || 0, places: parseInt(get('places'), 10) || 0,
+    items: get('items').split('\n').map(s => s.trim()).filter(Boolean),
+  };
+  return {id: get('id'), title: get('title'), description: get('description'), image: get('image')};
+}
+
+function failed(sec, e){
+  if (e.status === 412){
+    notify('Файл изменился в другом окне — раздел перезагружен', true);
+    load(sec);
+  } else {
+    notify(e.message, true);
+  }
+}
+
+async function load(sec){
+  const name = sec.dataset.section;
+  const st = state[name];
+  try {
+    const data = await api('GET', BASE+'/api/'+name+'?offset='+st.offset+'&limit='+PAGE+'&q='+encodeURIComponent(st.q));
+    const kind = sec.dataset.kind;
+    sec.querySelector('.items').innerHTML = data.items.map((it, k) => rowHtml(kind, data.indexes[k], it)).join('') ||
+      '<div class="muted">Ничего не найдено</div>';
+    const pages = Math.max(1, Math.ceil(data.total / PAGE));
+    const page = Math.floor(st.offset / PAGE) + 1;
+    sec.querySelector('.pageinfo').textContent = 'стр. '+page+' из '+pages+' · найдено '+data.total;
+    sec.querySelector('[data-prev]').disabled = st.offset <= 0;
+    sec.querySelector('[data-next]').disabled = st.offset + PAGE >= data.total;
+    if (!st.q) sec.querySelector('[data-count]').textContent = data.total+' шт.';
+    st.total = data.total;
+  } catch (e) {
+    notify(e.message, true);
+  }
+}
+
+function openSection(sec, offset){
+  const name = sec.dataset.section, kind = sec.dataset.kind;
+  if (state[name]){
+    if (offset !== undefined){
+      state[name].offset = offset; state[name].q = '';
+      sec.querySelector('.search').value = '';
+      load(sec);
+    }
+    return;
+  }
+  state[name] = {offset: offset || 0, q: '', total: 0};
+  const body = sec.querySelector('.body');
+  body.innerHTML =
+    '<input type="text" class="search" placeholder="Поиск..."/>'+
+    '<div class="items"></div>'+
+    '<div class="pager"><span class="muted pageinfo"></span>'+
+    '<button type="button" data-prev>←</button><button type="button" data-next>→</button></div>'+
+    (kind === 'array'
+      ? '<div class="row" style="grid-template-columns:1fr 160px;margin-top:8px"><input type="text" data-new placeholder="Новый элемент..."/><div class="add" data-add>+ Добавить</div></div>'
+      : '<div class="add" data-add style="margin-top:8px">+ Добавить</div>');
+  let timer = null;
+  body.querySelector('.search').addEventListener('input', e => {
+    clearTimeout(timer);
+    timer = setTimeout(() => { state[name].q = e.target.value.trim(); state[name].offset = 0; load(sec); }, 250);
+  });
+  body.querySelector('[data-prev]').addEventListener('click', () => { state[name].offset = Math.max(0, state[name].offset - PAGE); load(sec); });
+  body.querySelector('[data-next]').addEventListener('click', () => { state[name].offset += PAGE; load(sec); });
+  body.querySelector('.items').addEventListener('change', async e => {
+    const row = e.target.closest('[data-index]');
+    if (!row) return;
+    try {
+      await api('PATCH', BASE+'/api/'+name+'/'+row.dataset.index, collect(kind, row));
+      notify('Сохранено ✅');
+    } catch (err) { failed(sec, err); }
+  });
+  body.querySelector('.items').addEventListener('click', async e => {
+    if (!e.target.matches('[data-del]')) return;
+    const row = e.target.closest('[data-index]');
+    if (!confirm('Удалить элемент?')) return;
+    try {
+      await api('DELETE', BASE+'/api/'+name+'/'+row.dataset.index);
+      notify('Удалено ✅');
+      load(sec);
+    } catch (err) { failed(sec, err); }
+  });
+  body.querySelector('[data-add]').addEventListener('click', async () => {
+    let payload;
+    if (kind === 'array'){
+      const inp = body.querySelector('[data-new]');
+      if (!inp.value.trim()) return;
+      payload = {value: inp.value};
+      inp.value = '';
+    } else {
+      payload = kind === 'bunker' ? {description: 'Новый бункер', places: 1} : {id: 'new-id', title: 'Катаклизм'};
+    }
+    try {
+      const res = await api('POST', BASE+'/api/'+name, payload);
+      state[name].q = '';
+      body.querySelector('.search').value = '';
+      state[name].offset = Math.floor(res.index / PAGE) * PAGE;
+      notify('Добавлено ✅');
+      load(sec);
+    } catch (err) { failed(sec, err); }
+  });
+  load(sec);
+}
+
+document.querySelectorAll('details.section').forEach(sec => {
+  sec.addEventListener('toggle', () => { if (sec.open) openSection(sec); });
+});
+
+let gtimer = null;
+document.getElementById('gsearch').addEventListener('input', e => {
+  clearTimeout(gtimer);
+  gtimer = setTimeout(async () => {
+    const out = document.getElementById('gresults');
+    const q = e.target.value.trim();
+    if (!q){ out.innerHTML = ''; return; }
+    try {
+      const r = await fetch(BASE+'/search?limit=20&q='+encodeURIComponent(q)).then(r => r.json());
+      out.innerHTML = r.results.map(x =>
+        '<div class="row" style="grid-template-columns:160px 1fr;cursor:pointer" data-jump="'+esc(x.section)+'" data-at="'+x.index+'">'+
+        '<span class="pill">'+esc(x.section)+' #'+(x.index+1)+(x.item !== null ? ' · '+(x.item+1) : '')+'</span>'+
+        '<span>'+esc(x.text.slice(0, 160))+'</span></div>').join('') +
+        '<div class="muted">найдено '+r.total+'</div>';
+    } catch (err) { notify(err.message, true); }
+  }, 250);
+});
+document.getElementById('gresults').addEventListener('click', e => {
+  const row = e.target.closest('[data-jump]');
+  if (!row) return;
+  const sec = document.querySelector('details.section[data-section="'+row.dataset.jump+'"]');
+  openSection(sec, Math.floor(parseInt(row.dataset.at, 10) / PAGE) * PAGE);
+  sec.open = true;
+  sec.scrollIntoView({behavior: 'smooth'});
+});
+{{ sync_js|safe }}
+watchSync({{ sync_job|tojson }});
+{{ watch_js|safe }}
+// изменения на диске: счётчики обновляются везде, открытые разделы перечитываются,
+// кроме того, где сейчас фокус — его правка уйдёт со старым ETag и получит 412
+const BLOCK_SECTIONS = {BUNKERS: 'bunkers', CATACLYSMS: 'cataclysms'};
+const sectionOf = block => document.querySelector('details.section[data-section="'+(BLOCK_SECTIONS[block] || block)+'"]');
+watchDeck({{ versions|tojson }}, (changed, ev) => {
+  for (const [block, n] of Object.entries(ev.counts)){
+    const sec = sectionOf(block);
+    if (sec && !(state[sec.dataset.section] || {}).q) sec.querySelector('[data-count]').textContent = n+' шт.';
+  }
+  if (!changed.length) return [];
+  const busy = changed.filter(block => { const sec = sectionOf(block); return sec && sec.contains(document.activeElement); });
+  changed.forEach(block => {
+    const sec = sectionOf(block);
+    if (sec && state[sec.dataset.section] && !busy.includes(block)) load(sec);
+  });
+  if (!busy.length) ETAG = '"'+ev.hash+'"';
+  notify('cards.js изменён на диске: '+changed.join(', ')+(busy.length ? ' (раздел с открытой правкой обновится после неё)' : ''));
+  return changed.filter(block => !busy.includes(block));
+}, ev => {
+  Object.assign(IMAGES, ev.images);
+  const sec = sectionOf('CATACLYSMS');
+  if (sec && state.cataclysms && !sec.contains(document.activeElement)) load(sec);
+});
+</script>
+</body>
+</html>
+"""
+
+TPL = r"""
+<!doctype html>
+<html lang="ru">
+<head>
+  <meta charset="utf-8"/>
+  <title>Редактор cards.js</title>
+  <meta name="viewport" content="width=device-width, initial-scale=1"/>
+  <style>{{ style|safe }}</style>
+</head>
+<body>
+<header>
+  <h1>Редактор cards.js{% if deck %} — <a href="{{ workspace_root }}/decks">{{ deck }}</a>{% endif %} <span class="muted">({{file_path}})</span></h1>
+  <form method="post" action="{{ url_for('sync_action') }}" style="margin-top:8px;display:flex;gap:8px;align-items:center">
     <input type="text" name="repo" placeholder="owner/repo" value="{{GITHUB_REPO}}" style="width:220px;background:#0b1220;color:#e6edf3;border:1px solid #273144;border-radius:8px;padding:6px"/>
     <input type="text" name="branch" placeholder="branch" value="{{GITHUB_BRANCH}}" style="width:120px;background:#0b1220;color:#e6edf3;border:1px solid #273144;border-radius:8px;padding:6px"/>
+    <label class="muted"><input type="checkbox" name="prune" value="1"/> удалить пропавшие картинки</label>
     <button class="btn" type="submit">⬇️ Скачать данные из GitHub</button>
-    <a class="btn secondary" href="/reload">↻ Перезагрузка</a>
+    <a class="btn secondary" href="{{ url_for('reload_action') }}">↻ Перезагрузка</a>
   </form>
   <div class="muted" style="margin-top:6px">По умолчанию: {{GITHUB_REPO}}@{{GITHUB_BRANCH}} → cards.js и /client/public/cataclysms</div>
 </header>
 <main>
   {% with msgs = get_flashed_messages() %}
-    {% if msgs %}<div class="flash">{{ msgs[-1] }}</div>{% endif %}
+    <div class="flash" id="flash" {% if not msgs %}style="display:none"{% endif %}>{{ msgs[-1] if msgs }}</div>
   {% endwith %}
 
-  <form method="post" id="form">
+  <form method="post" id="form" action="{{ url_for('index') }}">
+    <input type="hidden" name="base_versions" value='{{ versions|tojson }}'/>
     <div class="card">
       <h3>Категории</h3>
       <div class="grid">
         {% for key in array_keys %}
-          <div class="card">
+          <div class="card" data-block="{{key}}">
             <div style="display:flex;align-items:center;justify-content:space-between">
               <strong>{{ labels.get(key, key) }}</strong>
               <span class="muted" id="{{key}}_count">{{ arrays[key]|length }} шт.</span>
@@ -465,7 +5109,7 @@ TPL = r"""
     </div>
 
     <!-- ======= БУНКЕРЫ ======= -->
-    <div class="card">
+    <div class="card" data-block="BUNKERS">
       <h3>Бункеры (BUNKERS)</h3>
       <div id="bunkers">
         {% for b in bunkers %}
@@ -523,8 +5167,8 @@ TPL = r"""
     </div>
 
     <!-- ======= КАТАКЛИЗМЫ ======= -->
-    <div class="card">
-      <h3>Катаклизмы (CATAclySMS)</h3>
+    <div class="card" data-block="CATACLYSMS">
+      <h3>Катаклизмы (CATACLYSMS)</h3>
       <div class="row muted" style="grid-template-columns:80px 180px 1fr 260px;font-weight:600;margin-bottom:6px">
         <div>#</div><div>ID</div><div>Заголовок</div><div>Описание</div><div>URL картинки</div>
       </div>
@@ -535,7 +5179,14 @@ TPL = r"""
           <input type="text" name="cat_id" value="{{c.id}}"/>
           <input type="text" name="cat_title" value="{{c.title}}"/>
           <textarea name="cat_description" style="min-height:120px">{{c.description}}</textarea>
-          <input type="text" name="cat_image" value="{{c.image}}"/>
+          <div>
+            <input type="text" name="cat_image" value="{{c.image}}"/>
+            {% set im = images.get(c.image) %}
+            {% if im %}
+              {% if im.thumb %}<img class="thumb" loading="lazy" src="{{ im.thumb }}" alt=""/>{% endif %}
+              {% if im.big %}<div class="muted img-warn">{{ '%.1f'|format(im.bytes / 1048576) }} МБ — слишком большая</div>{% endif %}
+            {% elif c.image.startswith('/cataclysms/') %}<div class="muted img-warn">нет файла</div>{% endif %}
+          </div>
         </div>
         {% endfor %}
         <div class="row" style="grid-template-columns:42px 140px 180px 1fr 260px;margin-bottom:8px;align-items:start">
@@ -558,6 +5209,7 @@ TPL = r"""
 </main>
 
 <script>
+const BASE = {{ request.script_root|tojson }};   // префикс приложения (/d/<колода> в рабочем пространстве)
 function addItem(key){
   const list = document.getElementById(key+'_list');
   const idx = list.querySelectorAll('input[name="'+key+'_item"]').length + 1;
@@ -617,10 +5269,140 @@ function addBunker(){
   `;
   container.appendChild(el);
 }
+{{ watch_js|safe }}
+// Изменённые на диске разделы подменяются свежими из /full вместе с их версией в base_versions.
+// Раздел, который уже правят в этой форме, не трогаем: сохранение его отклонит как конфликт.
+const form = document.getElementById('form');
+const dirty = new Set();
+form.addEventListener('input', e => { const b = e.target.closest('[data-block]'); if (b) dirty.add(b.dataset.block); });
+async function refreshBlocks(blocks){
+  blocks = blocks.filter(b => !dirty.has(b));
+  if (!blocks.length) return [];
+  const fresh = new DOMParser().parseFromString(await fetch(location.pathname).then(r => r.text()), 'text/html');
+  const input = form.querySelector('input[name="base_versions"]');
+  const base = JSON.parse(input.value);
+  const freshBase = JSON.parse(fresh.querySelector('input[name="base_versions"]').value);
+  const done = blocks.filter(b => {
+    const el = fresh.querySelector('[data-block="'+b+'"]'), cur = form.querySelector('[data-block="'+b+'"]');
+    if (!el || !cur || dirty.has(b)) return false;
+    cur.replaceWith(document.adoptNode(el));
+    base[b] = freshBase[b];
+    return true;
+  });
+  input.value = JSON.stringify(base);
+  return done;
+}
+watchDeck({{ versions|tojson }}, async changed => {
+  if (!changed.length) return [];
+  const done = await refreshBlocks(changed);
+  const stale = changed.filter(b => !done.includes(b));
+  const box = document.getElementById('flash');
+  box.style.display = '';
+  box.className = stale.length ? 'flash error' : 'flash';
+  box.textContent = 'cards.js изменён на диске: '+changed.join(', ')+
+    (stale.length ? '. Разделы '+stale.join(', ')+' уже правятся здесь — сохранить их не получится, скопируйте правку и обновите страницу' : ' — разделы обновлены');
+  return done;
+}, () => refreshBlocks(['CATACLYSMS']));
 </script>
 </body>
 </html>
 """
+# ---------- Рабочий запуск ----------
+# app.run(debug=True) — только для локальной правки. serve запускает редактор
+# без debug: gunicorn (процессы + потоки), waitress (потоки) или, если их нет,
+# встроенный сервер werkzeug в многопоточном режиме. Между процессами запись
+# cards.js согласуют deck_lock() и проверка версий формы.
+SERVE_SERVERS = ("auto", "gunicorn", "waitress", "werkzeug")
+
+def create_workspace(path: Optional[str] = None) -> Flask:
+    """Приложение рабочего пространства (см. «Несколько колод»): /d/<имя>/ — редактор
+    колоды, /decks — список колод, / — переход к колоде по умолчанию.
+    gunicorn: 'cards_editor_no_abilities:create_workspace()' (файл — из CARDS_DECKS)."""
+    from werkzeug.middleware.dispatcher import DispatcherMiddleware
+
+    ws = load_workspace(Path(path).resolve() if path else DECKS_PATH)
+    mounts = {f"/d/{name}": deck_app(load_deck(name, ws)) for name in ws["decks"]}
+    root = Flask(f"{__name__}.workspace")
+
+    @root.route("/", methods=["GET"])
+    def workspace_index():
+        return redirect(f"{request.script_root}/d/{ws['default']}/")
+
+    @root.route("/decks", methods=["GET"])
+    def workspace_decks():
+        decks = []
+        for deck in ws["decks"].values():
+            try:
+                size: Optional[int] = deck.path.stat().st_size
+            except OSError:
+                size = None
+            decks.append(dict(deck._asdict(), path=str(deck.path), images=str(deck.images),
+                              exists=size is not None, size=size or 0,
+                              url=f"{request.script_root}/d/{deck.name}/"))
+        store = image_store_stats(ws["image_store"])
+        if _wants_json():
+            return jsonify(default=ws["default"], decks=decks, image_store=store)
+        return render_template(_template(DECKS_TPL), workspace=ws, decks=decks, store=store, style=STYLE)
+
+    root.wsgi_app = DispatcherMiddleware(root.wsgi_app, mounts)
+    return root
+
+def _serve_gunicorn(target: Any, host: str, port: int, workers: int, threads: int) -> None:
+    from gunicorn.app.base import BaseApplication
+
+    class EditorApplication(BaseApplication):
+        def load_config(self) -> None:
+            for name, value in {"bind": f"{host}:{port}", "workers": workers, "threads": threads,
+                                "worker_class": "gthread" if threads > 1 else "sync"}.items():
+                self.cfg.set(name, value)
+
+        def load(self) -> Any:
+            return target
+
+    EditorApplication().run()
+
+def serve_main(argv: List[str]) -> int:
+    ap = argparse.ArgumentParser(prog=f"{Path(__file__).name} serve",
+                                 description="Рабочий запуск редактора (без debug, несколько воркеров/потоков)")
+    ap.add_argument("--host", default=os.environ.get("CARDS_HOST") or "127.0.0.1")
+    ap.add_argument("--port", type=int, default=int(os.environ.get("CARDS_PORT") or 5000))
+    ap.add_argument("--workers", type=int, default=int(os.environ.get("CARDS_WORKERS") or 2), help="процессов (gunicorn)")
+    ap.add_argument("--threads", type=int, default=int(os.environ.get("CARDS_THREADS") or 4), help="потоков на процесс")
+    ap.add_argument("--server", choices=SERVE_SERVERS, default=os.environ.get("CARDS_SERVER") or "auto")
+    ap.add_argument("--decks", default=os.environ.get("CARDS_DECKS"),
+                    help="decks.json рабочего пространства: несколько колод на /d/<имя>/")
+    args = ap.parse_args(argv)
+    target = create_workspace(args.decks) if args.decks else app
+
+    server = args.server
+    if server == "auto":
+        server = "werkzeug"
+        for name in ("gunicorn", "waitress"):
+            if name == "gunicorn" and fcntl is None:
+                continue   # gunicorn не работает в Windows
+            try:
+                __import__(name)
+            except ImportError:
+                continue
+            server = name
+            break
+    source = f"Колоды: {args.decks}" if args.decks else f"Файл для редактирования: {PRIMARY_DECK.path}"
+    print(f"{source}; сервер: {server}, http://{args.host}:{args.port}/")
+    if server == "gunicorn":
+        _serve_gunicorn(target, args.host, args.port, max(1, args.workers), max(1, args.threads))
+        return 0
+    if args.workers > 1:
+        print(f"[INFO] {server}: один процесс, --workers не используется (несколько процессов — через gunicorn)")
+    if server == "waitress":
+        from waitress import serve
+        serve(target, host=args.host, port=args.port, threads=max(1, args.workers * args.threads))
+    else:
+        from werkzeug.serving import run_simple
+        run_simple(args.host, args.port, target, threaded=True)
+    return 0
+
 if __name__ == "__main__":
-    print(f"Файл для редактирования: {FILE_PATH}")
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":
+        sys.exit(serve_main(sys.argv[2:]))
+    print(f"Файл для редактирования: {PRIMARY_DECK.path}")
     app.run(debug=True)
@@ -0,0 +1,36 @@
+"""Общие фикстуры тестов редактора cards.js: модуль импортируется один раз, каждый
+тест работает со своей копией data/cards.js через отдельную колоду (DeckState)."""
+import os
+import shutil
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+CARDS_JS = ROOT / "data" / "cards.js"
+
+# до импорта редактора: фоновое слежение за файлами в тестах не нужно
+os.environ.setdefault("CARDS_WATCH", "0")
+sys.path.insert(0, str(ROOT))
+
+import cards_editor_no_abilities as ed  # noqa: E402
+from werkzeug.test import Client  # noqa: E402
+
+
+@pytest.fixture
+def deck(tmp_path: Path):
+    """Колода над копией data/cards.js (история, снапшоты и блокировка — рядом, в tmp).
+    Функции редактора внутри теста видят её как текущую."""
+    path = tmp_path / "data" / "cards.js"
+    path.parent.mkdir()
+    shutil.copyfile(CARDS_JS, path)
+    state = ed.DeckState("test", path, tmp_path / "cataclysms", ed.GITHUB_REPO, ed.GITHUB_BRANCH)
+    with ed.use_deck(state):
+        yield state
+
+
+@pytest.fixture
+def client(deck):
+    """HTTP-клиент приложения, смонтированного на колоду deck."""
+    return Client(ed.deck_app(deck), ed.app.response_class)
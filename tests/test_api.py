@@ -0,0 +1,91 @@
+import pytest
+
+from conftest import ed
+
+
+def _file_id(path):
+    # атомарная запись подменяет файл, поэтому меняется и inode
+    st = path.stat()
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+
+def test_crud_on_list_section(deck, client):
+    total = client.get("/api/HOBBIES?limit=1").json["total"]
+    r = client.post("/api/HOBBIES", json={"value": "  Новое хобби  ", "index": 0})
+    assert r.status_code == 201 and r.json == {"index": 0, "item": "Новое хобби"}
+    assert client.get("/api/HOBBIES/0").json["item"] == "Новое хобби"
+    assert client.put("/api/HOBBIES/0", json={"value": "Другое"}).json["item"] == "Другое"
+    assert client.get("/api/HOBBIES?q=ДРУГ").json["indexes"] == [0]
+    assert client.delete("/api/HOBBIES/0").json["item"] == "Другое"
+    assert client.get("/api/HOBBIES?limit=1").json["total"] == total
+
+
+def test_crud_on_object_sections(deck, client):
+    r = client.post("/api/cataclysms", json={"id": "flood", "title": "Потоп", "description": "Вода"})
+    assert r.status_code == 201
+    index = r.json["index"]
+    r = client.patch(f"/api/cataclysms/{index}", json={"title": "Великий потоп"})
+    assert r.json["item"]["title"] == "Великий потоп" and r.json["item"]["description"] == "Вода"
+    # PUT заменяет запись целиком: неуказанные поля — пустые
+    assert client.put(f"/api/cataclysms/{index}", json={"title": "Потоп"}).json["item"]["description"] == ""
+    cats = ed.load_document()["cats"]
+    assert cats[index]["title"] == "Потоп"
+    bunker = client.patch("/api/bunkers/0", json={"items": [" Рация ", ""]}).json["item"]
+    assert bunker["items"] == ["Рация"]
+
+
+@pytest.mark.parametrize("url, status", [("/api/NOPE", 404), ("/api/HOBBIES/100000", 404),
+                                         ("/api/bunkers/100000", 404)])
+def test_unknown_section_or_index(client, url, status):
+    r = client.get(url)
+    assert r.status_code == status and "error" in r.json
+
+
+@pytest.mark.parametrize("body", [{"value": ""}, {"value": 5}, {"value": "x", "index": True},
+                                  {"value": "x", "index": -1}, {"value": "x", "index": "0"}, ["x"]])
+def test_create_rejects_bad_payload(deck, client, body):
+    before = deck.path.read_bytes()
+    assert client.post("/api/HOBBIES", json=body).status_code == 400
+    assert deck.path.read_bytes() == before
+
+
+@pytest.mark.parametrize("body", [{"places": "3"}, {"places": 2.5}, {"places": True}, {"places": None},
+                                  {"places": [1]}, {"title": 5}, {"nope": 1}])
+def test_object_fields_are_type_checked(client, body):
+    section = "cataclysms" if "title" in body else "bunkers"
+    r = client.patch(f"/api/{section}/0", json=body)
+    assert r.status_code == 400 and next(iter(body)) in r.json["error"]
+
+
+def test_noop_put_does_not_write(deck, client):
+    before = _file_id(deck.path)
+    etag = client.get("/api/HOBBIES?limit=1").headers["ETag"]
+    hobby = client.get("/api/HOBBIES/0").json["item"]
+    bunker = client.get("/api/bunkers/0").json["item"]
+    r = client.put("/api/HOBBIES/0", json={"value": hobby})
+    assert r.status_code == 200 and r.headers["ETag"] == etag
+    assert client.put("/api/bunkers/0", json=bunker).status_code == 200
+    assert client.patch("/api/cataclysms/0", json={}).status_code == 200
+    assert _file_id(deck.path) == before
+
+
+def test_edit_keeps_untouched_entries_byte_identical(deck, client):
+    text = deck.path.read_text(encoding="utf-8")
+    client.patch("/api/bunkers/1", json={"places": 99})
+    new = deck.path.read_text(encoding="utf-8")
+    changed = [(a, b) for a, b in zip(text.splitlines(), new.splitlines()) if a != b]
+    assert len(changed) == 1 and "99" in changed[0][1]
+
+
+def test_stale_if_match_returns_412(deck, client):
+    etag = client.get("/api/HOBBIES?limit=1").headers["ETag"]
+    assert client.post("/api/HOBBIES", json={"value": "Первое"}, headers={"If-Match": etag}).status_code == 201
+    before = deck.path.read_bytes()
+    for method, url, body in [("post", "/api/HOBBIES", {"value": "Второе"}),
+                              ("patch", "/api/bunkers/0", {"places": 9}),
+                              ("delete", "/api/cataclysms/0", None)]:
+        r = getattr(client, method)(url, json=body, headers={"If-Match": etag})
+        assert r.status_code == 412, url
+    assert deck.path.read_bytes() == before
+    fresh = client.get("/api/HOBBIES?limit=1").headers["ETag"]
+    assert client.post("/api/HOBBIES", json={"value": "Второе"}, headers={"If-Match": fresh}).status_code == 201
@@ -0,0 +1,43 @@
+from conftest import CARDS_JS, ed
+
+
+def _file_id(path):
+    # атомарная запись подменяет файл, поэтому меняется и inode
+    st = path.stat()
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+
+def _model(text):
+    return ed._deck_model(ed.parse_document(text))
+
+
+def test_edit_block_touches_only_changed_item():
+    text = CARDS_JS.read_text(encoding="utf-8")
+    items = _model(text)["HOBBIES"]
+    items[1] = "Новое хобби"
+    new = ed.splice_blocks(text, {"HOBBIES": ed.edit_block(text, "HOBBIES", items)})
+    assert _model(new)["HOBBIES"] == items
+    changed = [(a, b) for a, b in zip(text.splitlines(), new.splitlines()) if a != b]
+    assert len(changed) == 1 and "Новое хобби" in changed[0][1]
+
+
+def test_save_rewrites_only_changed_blocks(deck):
+    doc = ed.load_document()
+    spans = ed.index_text(doc["text"]).spans
+    items = list(doc["arrays"]["HOBBIES"]) + ["Хобби в конце"]
+    text = ed.save_blocks(doc, {"HOBBIES": ed.edit_block(doc["text"], "HOBBIES", items)})
+    assert deck.path.read_text(encoding="utf-8") == text
+    new_spans = ed.index_text(text).spans
+    for name, sp in spans.items():
+        if name != "HOBBIES":
+            assert text[new_spans[name].start:new_spans[name].end] == doc["text"][sp.start:sp.end], name
+    assert ed.load_document()["arrays"]["HOBBIES"] == items
+
+
+def test_noop_save_does_not_write(deck):
+    before = _file_id(deck.path)
+    doc = ed.load_document()
+    assert ed.save_blocks(doc, {}) == doc["text"]
+    same = {"HOBBIES": ed.edit_block(doc["text"], "HOBBIES", list(doc["arrays"]["HOBBIES"]))}
+    assert ed.save_blocks(doc, same) == doc["text"]
+    assert _file_id(deck.path) == before
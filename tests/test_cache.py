@@ -0,0 +1,37 @@
+import os
+
+from conftest import ed
+
+
+def test_unchanged_file_is_served_from_cache(deck, monkeypatch):
+    doc = ed.load_document()
+    monkeypatch.setattr(ed, "load_text", lambda *a, **kw: (_ for _ in ()).throw(AssertionError("перечитан")))
+    assert ed.load_document() is doc
+
+
+def test_external_edit_is_picked_up(deck):
+    doc = ed.load_document()
+    text = deck.path.read_text(encoding="utf-8").replace("const HOBBIES = [", "const HOBBIES = [\n  'Снаружи',", 1)
+    deck.path.write_text(text, encoding="utf-8")
+    st = deck.path.stat()
+    os.utime(deck.path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    fresh = ed.load_document()
+    assert fresh is not doc and fresh["arrays"]["HOBBIES"][0] == "Снаружи"
+
+
+def test_same_content_shares_one_model(deck):
+    doc = ed.load_document()
+    assert ed.cached_document(deck.path.read_text(encoding="utf-8")) is doc
+    ed.invalidate_document()
+    assert ed.load_document() is doc   # файл перечитан, но модель по хэшу та же
+
+
+def test_cache_stays_within_budget(deck, monkeypatch):
+    monkeypatch.setattr(ed, "_DOC_CACHE", ed.OrderedDict())
+    text = deck.path.read_text(encoding="utf-8")
+    first = ed.cached_document(text)
+    monkeypatch.setattr(ed, "DOC_CACHE_BUDGET", first["size"] + 1)
+    second = ed.cached_document(text + "\n// другая версия\n")
+    # вытесняется самая старая модель; последняя остаётся, даже если одна больше бюджета
+    assert list(ed._DOC_CACHE) == [second["hash"]]
+    assert ed.doc_cache_stats()["evictions"] >= 1
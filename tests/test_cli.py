@@ -0,0 +1,81 @@
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from conftest import ROOT, ed
+
+SCRIPT = ROOT / "cards_editor_no_abilities.py"
+
+
+def _ops(tmp_path, *ops, name="ops.jsonl"):
+    path = tmp_path / name
+    path.write_text("".join(json.dumps(op, ensure_ascii=False) + "\n" for op in ops), encoding="utf-8")
+    return str(path)
+
+
+def test_apply_batch_in_one_write(deck, tmp_path):
+    doc = ed.load_document()
+    hobbies = list(doc["arrays"]["HOBBIES"])
+    bunker = doc["bunkers"][0]["description"]
+    path = _ops(tmp_path, {"op": "add", "section": "HOBBIES", "value": "Новое"},
+                {"op": "replace", "section": "HOBBIES", "old": hobbies[0], "value": "Заменённое"},
+                {"op": "remove", "section": "HOBBIES", "index": 1},
+                {"op": "upsert", "section": "HOBBIES", "value": "Новое"},
+                {"op": "upsert", "section": "bunkers", "description": bunker, "places": 7},
+                {"op": "add", "section": "cataclysms", "id": "meteor2", "title": "Второй метеорит"})
+    csv_path = tmp_path / "more.csv"
+    csv_path.write_text("op,section,id,title\nreplace,cataclysms,meteor2,Третий метеорит\n", encoding="utf-8")
+    report = ed.apply_batch([path, str(csv_path)])
+    assert report["operations"] == {"add": 2, "replace": 2, "remove": 1, "upsert": 2}
+    assert report["changed"] == ["BUNKERS", "CATACLYSMS", "HOBBIES"] and report["written"]
+    doc = ed.load_document()
+    assert list(doc["arrays"]["HOBBIES"]) == ["Заменённое"] + hobbies[2:] + ["Новое"]
+    assert doc["bunkers"][0]["places"] == 7 and doc["cats"][-1]["title"] == "Третий метеорит"
+    assert [v["source"] for v in ed._versions_from_end()][:1] == ["batch"]
+
+
+@pytest.mark.parametrize("op, message", [
+    ({"op": "drop", "section": "HOBBIES"}, "неизвестная операция"),
+    ({"op": "add", "section": "NOPE", "value": "x"}, "неизвестный раздел"),
+    ({"op": "remove", "section": "HOBBIES", "value": "нет такого"}, "нет элемента"),
+    ({"op": "replace", "section": "HOBBIES", "index": 100000, "value": "x"}, "индексом 100000"),
+    ({"op": "add", "section": "bunkers", "places": "много"}, "places"),
+    ({"op": "remove", "section": "cataclysms", "id": "нет"}, "не найдена"),
+])
+def test_bad_operation_aborts_batch(deck, tmp_path, op, message):
+    before = deck.path.read_bytes()
+    path = _ops(tmp_path, {"op": "add", "section": "HOBBIES", "value": "Хорошее"}, op)
+    with pytest.raises(ed.BatchError, match=f"ops.jsonl:2: .*{message}"):
+        ed.apply_batch([path])
+    assert deck.path.read_bytes() == before
+
+
+def test_dry_run_does_not_write(deck, tmp_path):
+    before = deck.path.read_bytes()
+    report = ed.apply_batch([_ops(tmp_path, {"op": "add", "section": "HOBBIES", "value": "Пробное"})], dry_run=True)
+    assert report["changed"] == ["HOBBIES"] and not report["written"]
+    assert deck.path.read_bytes() == before
+    assert "пробный запуск" in ed.format_batch_report(report)
+
+
+def test_cli_runs_without_flask(deck, tmp_path):
+    # команда выполняется до импорта Flask: скрипт запускается как __main__
+    code = ("import runpy, sys\n"
+            "sys.argv = sys.argv[1:]\n"
+            "try:\n"
+            "    runpy.run_path(sys.argv[0], run_name='__main__')\n"
+            "except SystemExit as e:\n"
+            "    print('exit', e.code, 'flask' in sys.modules)\n")
+    env = dict(os.environ, CARDS_PATH=str(deck.path), CARDS_WATCH="0")
+    path = _ops(tmp_path, {"op": "add", "section": "HOBBIES", "value": "Из консоли"})
+    out = subprocess.run([sys.executable, "-c", code, str(SCRIPT), "apply", path, "--json"],
+                         env=env, capture_output=True, text=True, timeout=60)
+    report, status = out.stdout.strip().splitlines()
+    assert status == "exit 0 False" and json.loads(report)["changed"] == ["HOBBIES"]
+    assert "Из консоли" in ed.load_document()["arrays"]["HOBBIES"]
+    out = subprocess.run([sys.executable, "-c", code, str(SCRIPT), "apply", str(tmp_path / "нет.jsonl")],
+                         env=env, capture_output=True, text=True, timeout=60)
+    assert out.stdout.strip() == "exit 1 False" and "[ERROR]" in out.stderr
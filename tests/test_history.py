@@ -0,0 +1,87 @@
+from conftest import ed
+
+
+def _add_hobbies(client, n):
+    for i in range(n):
+        assert client.post("/api/HOBBIES", json={"value": f"Хобби {i}"}).status_code == 201
+
+
+def _all_versions():
+    return list(ed._versions_from_end())[::-1]
+
+
+def test_saves_are_recorded_and_restorable(deck, client):
+    original = deck.path.read_text(encoding="utf-8")
+    _add_hobbies(client, 3)
+    versions = _all_versions()
+    # первая версия — файл, каким он был до первой записи редактора
+    assert [(v["id"], v["source"]) for v in versions] == [(1, "external"), (2, "save"), (3, "save"), (4, "save")]
+    assert ed.version_text(versions[0]) == original
+    assert ed.version_text(versions[-1]) == deck.path.read_text(encoding="utf-8")
+    assert "Хобби 0" in ed.version_text(versions[1]) and "Хобби 1" not in ed.version_text(versions[1])
+    r = client.post("/history/2/restore", headers={"Accept": "application/json"})
+    assert r.status_code == 200 and r.json["changed"]
+    assert "Хобби 0" in deck.path.read_text(encoding="utf-8")
+    assert "Хобби 1" not in deck.path.read_text(encoding="utf-8")
+    assert _all_versions()[-1]["source"] == "restore 2"
+    assert ed.history_version(5) and ed.history_version(99) is None and ed.history_version(0) is None
+
+
+def test_blocks_are_stored_once(deck, client):
+    _add_hobbies(client, 20)
+    objects = [p for p in (deck.history_dir / "objects").rglob("*") if p.is_file()]
+    stored = sum(p.stat().st_size for p in objects)
+    # 20 версий файла занимают меньше двух его копий: неизменённые блоки общие, правки — дельты
+    assert stored < 2 * deck.path.stat().st_size
+
+
+def test_external_edit_is_recorded_before_overwrite(deck, client):
+    _add_hobbies(client, 1)
+    with open(deck.path, "a", encoding="utf-8") as f:
+        f.write("\n// правка мимо редактора\n")
+    _add_hobbies(client, 1)
+    assert [v["source"] for v in _all_versions()] == ["external", "save", "external", "save"]
+
+
+def test_unchanged_save_records_nothing_and_skips_reread(deck, client, monkeypatch):
+    _add_hobbies(client, 1)
+    doc = ed.load_document()
+    reads = []
+    real = type(deck.path).read_text
+
+    def read_text(path, *args, **kwargs):
+        reads.append(path)
+        return real(path, *args, **kwargs)
+
+    monkeypatch.setattr(type(deck.path), "read_text", read_text)
+    items = list(doc["arrays"]["HOBBIES"]) + ["Ещё"]
+    ed.save_blocks(doc, {"HOBBIES": ed.edit_block(doc["text"], "HOBBIES", items)})
+    assert deck.path not in reads
+    assert [v["source"] for v in _all_versions()] == ["external", "save", "save"]
+
+
+def test_list_pages_from_the_tail(deck, client):
+    _add_hobbies(client, 6)
+    r = client.get("/history?format=json&limit=3")
+    assert r.json["total"] == 7 and [v["id"] for v in r.json["versions"]] == [7, 6, 5]
+    r = client.get("/history?format=json&limit=3&offset=6")
+    assert [v["id"] for v in r.json["versions"]] == [1]
+    assert client.get("/history?format=json&offset=50").json["versions"] == []
+    assert client.get("/history").status_code == 200
+
+
+def test_versions_from_end_across_chunks(deck, client):
+    _add_hobbies(client, 11)
+    assert list(ed._versions_from_end(chunk=37)) == list(ed._versions_from_end())
+    assert [v["id"] for v in ed._versions_from_end(chunk=37)] == list(range(12, 0, -1))
+
+
+def test_diff_between_versions(deck, client):
+    _add_hobbies(client, 2)
+    r = client.get("/history/diff")
+    assert (r.json["a"], r.json["b"]) == (2, 3)
+    assert [(b["block"], b["status"]) for b in r.json["blocks"]] == [("HOBBIES", "changed")]
+    assert "+" in r.json["blocks"][0]["diff"] and "Хобби 1" in r.json["blocks"][0]["diff"]
+    assert client.get("/history/diff?a=1&b=9").status_code == 404
+    text = client.get("/history/2")
+    assert text.status_code == 200 and "Хобби 0" in text.get_data(as_text=True)
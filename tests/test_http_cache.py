@@ -0,0 +1,58 @@
+import gzip
+
+from conftest import ed
+
+GZIP = {"Accept-Encoding": "gzip"}
+
+
+def test_page_is_conditional_and_compressed(deck, client, monkeypatch):
+    plain = client.get("/")
+    tag = plain.headers["ETag"].strip('"')
+    assert plain.status_code == 200 and "Accept-Encoding" in plain.headers["Vary"]
+    assert "no-cache" in plain.headers["Cache-Control"]
+    zipped = client.get("/", headers=GZIP)
+    assert zipped.headers["Content-Encoding"] == "gzip" and zipped.headers["ETag"] == f'"{tag}-gzip"'
+    assert gzip.decompress(zipped.get_data()) == plain.get_data()
+    # 304 не рендерит страницу; сжатый вариант того же тега — из кэша
+    monkeypatch.setattr(ed, "render", lambda *a, **kw: (_ for _ in ()).throw(AssertionError("рендер")))
+    for etag in (f'"{tag}"', f'"{tag}-gzip"'):
+        r = client.get("/", headers={**GZIP, "If-None-Match": etag})
+        assert r.status_code == 304 and r.get_data() == b"" and r.headers["ETag"] == f'"{tag}-gzip"'
+    assert client.get("/", headers=GZIP).get_data() == zipped.get_data()
+    monkeypatch.undo()
+    assert client.post("/api/HOBBIES", json={"value": "Новое"}).status_code == 201
+    r = client.get("/", headers={"If-None-Match": f'"{tag}"'})
+    assert r.status_code == 200 and r.headers["ETag"] != plain.headers["ETag"]
+
+
+def test_api_etag_is_deck_hash(deck, client):
+    r = client.get("/api/HOBBIES?limit=500")
+    digest = ed.load_document()["hash"]
+    assert r.headers["ETag"] == f'"{digest}"'
+    assert client.get("/api/HOBBIES?limit=500", headers={"If-None-Match": f'"{digest}"'}).status_code == 304
+    zipped = client.get("/api/HOBBIES?limit=500", headers=GZIP)
+    assert zipped.headers["Content-Encoding"] == "gzip" and gzip.decompress(zipped.get_data()) == r.get_data()
+    # короткий ответ не сжимается
+    small = client.get("/api/HOBBIES/0", headers=GZIP)
+    assert "Content-Encoding" not in small.headers and len(small.get_data()) < ed.COMPRESS_MIN_BYTES
+
+
+def test_streamed_export_is_compressed_on_the_fly(deck, client, monkeypatch):
+    monkeypatch.setattr(ed, "EXPORT_CHUNK", 1024)
+    plain = client.get("/export.jsonl").get_data()
+    r = client.get("/export.jsonl", headers=GZIP, buffered=False)
+    try:
+        chunks = list(r.response)
+    finally:
+        r.close()
+    assert r.headers["Content-Encoding"] == "gzip" and "Content-Length" not in r.headers
+    assert len(chunks) > 2 and gzip.decompress(b"".join(chunks)) == plain
+
+
+def test_other_responses_get_body_etag(client):
+    # без своего тега ответ получает sha1 тела
+    first = client.get("/history?format=json")
+    assert first.headers["ETag"]
+    assert client.get("/history?format=json", headers={"If-None-Match": first.headers["ETag"]}).status_code == 304
+    assert client.post("/api/HOBBIES", json={"value": "Новое"}).status_code == 201
+    assert client.get("/history?format=json", headers={"If-None-Match": first.headers["ETag"]}).status_code == 200
@@ -0,0 +1,57 @@
+import pytest
+
+from conftest import ed
+
+Image = pytest.importorskip("PIL.Image")
+
+
+def _picture(path, size, mode="RGB"):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    Image.new(mode, size, "red").save(path)
+    return path
+
+
+def test_variants_are_built_once(deck, monkeypatch):
+    _picture(deck.images / "wide.png", (3000, 1000))
+    _picture(deck.images / "sub" / "small.gif", (100, 50), "P")
+    index = ed.process_images(workers=2)
+    wide = index["wide.png"]
+    assert (wide["width"], wide["height"]) == (3000, 1000)
+    assert wide["variants"]["thumb"]["width"] == 240 and wide["variants"]["large"]["width"] == 1280
+    assert index["sub/small.gif"]["variants"]["large"]["width"] == 100   # не увеличивается
+    assert ed._variant_path(wide["sha1"], "thumb").read_bytes()[8:12] == b"WEBP"
+    # исходники не менялись — ни чтения, ни декодирования
+    monkeypatch.setattr(ed.Image, "open", lambda *a, **kw: pytest.fail("картинка открыта заново"))
+    assert ed.process_images() == index
+
+
+def test_changed_and_removed_images(deck):
+    path = _picture(deck.images / "a.png", (500, 500))
+    old = ed.process_images()["a.png"]["sha1"]
+    (deck.images / "broken.jpg").write_bytes(b"not an image")
+    _picture(path, (600, 300))
+    index = ed.process_images()
+    assert index["a.png"]["sha1"] != old and index["a.png"]["width"] == 600
+    assert "error" in index["broken.jpg"] and not index["broken.jpg"]["variants"]
+    # каталог вариантов прежнего содержимого убирается полным проходом
+    assert not ed._variant_path(old, "thumb").parent.exists()
+    path.unlink()
+    assert "a.png" not in ed.process_images()
+
+
+def test_image_report_and_variant_urls(deck, client, monkeypatch):
+    cats = ed.load_document()["cats"]
+    used = cats[0]["image"][len(ed.IMAGE_URL_PREFIX):]
+    _picture(deck.images / used, (2500, 100))
+    _picture(deck.images / "extra.png", (10, 10))
+    report = client.get("/images").json
+    assert [i["path"] for i in report["images"]] == sorted(ed.IMAGE_URL_PREFIX + n for n in (used, "extra.png"))
+    assert report["unreferenced"] == [ed.IMAGE_URL_PREFIX + "extra.png"]
+    assert report["oversized"] == [ed.IMAGE_URL_PREFIX + used]
+    assert len(report["missing"]) == len({c["image"] for c in cats if c["image"]}) - 1
+    entry = ed._load_image_index()[used]
+    r = client.get(f"/images/{entry['sha1']}/thumb.webp")
+    assert r.status_code == 200 and r.mimetype == "image/webp"
+    assert "immutable" in r.headers["Cache-Control"] and "max-age=31536000" in r.headers["Cache-Control"]
+    assert client.get(f"/images/{entry['sha1']}/huge.webp").status_code == 404
+    assert client.get("/images/../thumb.webp").status_code == 404
@@ -0,0 +1,116 @@
+import io
+import json
+
+import pytest
+
+from conftest import ed
+
+
+def _file_id(path):
+    # атомарная запись подменяет файл, поэтому меняется и inode
+    st = path.stat()
+    return st.st_ino, st.st_mtime_ns, st.st_size
+
+
+def _model(text):
+    return ed._deck_model(ed.parse_document(text))
+
+
+def _jsonl(*records):
+    return "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records)
+
+
+@pytest.mark.parametrize("fmt", ["jsonl", "csv"])
+def test_export_import_replace_restores_deck(deck, client, fmt):
+    original = deck.path.read_text(encoding="utf-8")
+    exported = client.get(f"/export.{fmt}").get_data()
+    client.post("/api/HOBBIES", json={"value": "Лишнее"})
+    client.delete("/api/bunkers/0")
+    client.patch("/api/cataclysms/0", json={"title": "Другое название"})
+    assert _model(deck.path.read_text(encoding="utf-8")) != _model(original)
+    r = client.post(f"/import.{fmt}?mode=replace&dedupe=0", data=exported)
+    assert r.status_code == 200 and r.json["written"]
+    assert _model(deck.path.read_text(encoding="utf-8")) == _model(original)
+
+
+def test_export_is_streamed_in_chunks(deck, client, monkeypatch):
+    monkeypatch.setattr(ed, "EXPORT_CHUNK", 256)
+    r = client.get("/export.jsonl?sections=HOBBIES,bunkers")
+    assert r.mimetype == "application/x-ndjson" and r.headers["ETag"]
+    assert len(list(ed.export_jsonl(ed.load_document(), ["HOBBIES"]))) > 1
+    sections = {json.loads(line)["section"] for line in r.get_data(as_text=True).splitlines()}
+    assert sections == {"HOBBIES", "bunkers"}
+    rows = r.get_data(as_text=True).splitlines()
+    assert len(rows) == len(ed.load_document()["arrays"]["HOBBIES"]) + len(ed.load_document()["bunkers"])
+    assert client.get("/export.csv?sections=NOPE").status_code == 400
+    csv_text = client.get("/export.csv?sections=bunkers").get_data(as_text=True)
+    assert csv_text.startswith(",".join(ed.EXPORT_COLUMNS)) and ed.BATCH_LIST_SEP in csv_text
+
+
+def test_export_is_not_buffered(deck, client, monkeypatch):
+    monkeypatch.setattr(ed, "EXPORT_CHUNK", 1024)
+    r = client.get("/export.jsonl", buffered=False)
+    try:
+        assert r.is_streamed and "Content-Length" not in r.headers
+        assert len(list(r.response)) > 2
+    finally:
+        r.close()
+    etag = r.headers["ETag"]
+    assert client.get("/export.jsonl", headers={"If-None-Match": etag}).status_code == 304
+
+
+def test_merge_dedupes_and_updates(deck, client):
+    hobbies = ed.load_document()["arrays"]["HOBBIES"]
+    cat = ed.load_document()["cats"][0]
+    body = _jsonl({"section": "HOBBIES", "value": hobbies[0]}, {"section": "HOBBIES", "value": "Новое"},
+                  {"section": "HOBBIES", "value": "Новое"},
+                  {"section": "cataclysms", "id": cat["id"], "title": "Обновлённый"})
+    r = client.post("/import.jsonl", data=body)
+    assert r.status_code == 200
+    assert r.json["sections"]["HOBBIES"] == {"received": 3, "added": 1, "updated": 0, "skipped": 2, "removed": 0}
+    assert r.json["sections"]["cataclysms"]["updated"] == 1
+    doc = ed.load_document()
+    assert list(doc["arrays"]["HOBBIES"]) == list(hobbies) + ["Новое"]
+    assert doc["cats"][0]["title"] == "Обновлённый" and doc["cats"][0]["description"] == cat["description"]
+
+
+def test_noop_and_dry_run_do_not_write(deck, client):
+    before = _file_id(deck.path)
+    doc = ed.load_document()
+    records = ((f"export:{i}", r) for i, r in enumerate(ed.export_records(doc, ed.deck_sections())))
+    report = ed.import_deck(records)
+    assert not report["written"] and not report["changed"]
+    r = client.post("/import.jsonl?dry_run=1", data=_jsonl({"section": "HOBBIES", "value": "Пробное"}))
+    assert r.json["changed"] and not r.json["written"] and r.json["dry_run"]
+    assert _file_id(deck.path) == before
+
+
+@pytest.mark.parametrize("body", ['{"section": "NOPE", "value": "x"}\n', '{"section": "HOBBIES"}\n',
+                                  '{"section": "HOBBIES", "value": "x", "extra": 1}\n', "not json\n",
+                                  '{"section": "bunkers", "places": "много"}\n'])
+def test_bad_record_rejects_whole_import(deck, client, body):
+    before = deck.path.read_bytes()
+    r = client.post("/import.jsonl", data=_jsonl({"section": "HOBBIES", "value": "Хорошее"}) + body)
+    assert r.status_code == 400 and "import.jsonl" in r.json["error"]
+    assert deck.path.read_bytes() == before
+
+
+def test_import_size_is_capped(deck, client, monkeypatch):
+    monkeypatch.setattr(ed, "IMPORT_MAX_BYTES", 1024)
+    before = deck.path.read_bytes()
+    body = _jsonl(*({"section": "HOBBIES", "value": f"Хобби {i}"} for i in range(100)))
+    r = client.post("/import.jsonl", data=body)
+    assert r.status_code == 413 and "1 КБ" in r.json["error"]
+    assert deck.path.read_bytes() == before
+    small = {"file": (io.BytesIO(_jsonl({"section": "HOBBIES", "value": "Из файла"}).encode()), "cards.jsonl")}
+    assert client.post("/import.jsonl", data=small).status_code == 200
+    assert "Из файла" in ed.load_document()["arrays"]["HOBBIES"]
+
+
+def test_stale_if_match_rejects_import(deck, client):
+    etag = client.get("/api/HOBBIES?limit=1").headers["ETag"]
+    client.post("/api/HOBBIES", json={"value": "Первое"})
+    before = deck.path.read_bytes()
+    r = client.post("/import.jsonl", data='{"section": "HOBBIES", "value": "Третье"}\n', headers={"If-Match": etag})
+    assert r.status_code == 412
+    assert deck.path.read_bytes() == before
@@ -0,0 +1,55 @@
+import re
+
+import pytest
+
+from conftest import ed
+
+
+@pytest.fixture
+def metrics(monkeypatch):
+    """Пустые счётчики и гистограммы на время теста."""
+    monkeypatch.setattr(ed, "_HISTOGRAMS", {})
+    monkeypatch.setattr(ed, "_COUNTERS", {})
+
+
+def _samples(text):
+    return dict(line.rsplit(" ", 1) for line in text.splitlines() if line and not line.startswith("#"))
+
+
+def test_histogram_buckets_are_cumulative(metrics):
+    for seconds in (0.0005, 0.02, 0.02, 40.0):
+        ed.observe("cards_stage_seconds", seconds, stage="parse")
+    samples = _samples(ed.render_metrics())
+    bucket = 'cards_stage_seconds_bucket{stage="parse",le="%s"}'
+    assert [samples[bucket % le] for le in ("0.001", "0.01", "0.05", "30", "+Inf")] == ["1", "1", "3", "3", "4"]
+    assert samples['cards_stage_seconds_count{stage="parse"}'] == "4"
+    assert float(samples['cards_stage_seconds_sum{stage="parse"}']) == pytest.approx(40.0405)
+
+
+def test_counters_and_label_escaping(metrics):
+    ed.count("cards_requests_total", endpoint='a"b\\c\nd', status="200")
+    ed.count("cards_bytes_read_total", 10)
+    ed.count("cards_bytes_read_total", 5)
+    text = ed.render_metrics()
+    assert 'cards_requests_total{endpoint="a\\"b\\\\c\\nd",status="200"} 1' in text
+    assert "cards_bytes_read_total 15" in text
+    assert text.count("# TYPE cards_bytes_read_total counter") == 1
+    assert "# HELP cards_doc_cache_hits_total" in text
+
+
+def test_requests_are_timed(metrics, client):
+    r = client.get("/api/HOBBIES?limit=1")
+    assert re.fullmatch(r"app;dur=\d+\.\d", r.headers["Server-Timing"])
+    text = client.get("/metrics").get_data(as_text=True)
+    assert 'cards_requests_total{endpoint="api_list",status="200"} 1' in text
+    assert 'cards_request_seconds_count{endpoint="api_list"} 1' in text
+    assert 'cards_stage_seconds_count{stage="load_text"} 1' in text   # модель из общего кэша, файл — свой
+
+
+def test_profile_of_one_request(client):
+    r = client.get("/api/HOBBIES?limit=1", headers={ed.PROFILE_HEADER: "1"})
+    link = r.headers[ed.PROFILE_HEADER]
+    summary = client.get(link)
+    assert summary.status_code == 200 and "/api/HOBBIES" in summary.get_data(as_text=True)
+    assert ed.PROFILE_HEADER not in client.get("/api/HOBBIES?limit=1").headers
+    assert client.get("/metrics/profiles/nope").status_code == 404
@@ -0,0 +1,40 @@
+import pytest
+
+from conftest import CARDS_JS, ed
+
+
+@pytest.mark.parametrize("items", [[], ["а"], ["", "бб", "", "ввв"], ["x", "y", "z"]])
+def test_string_list_behaves_like_list(items):
+    sl = ed.StringList(items)
+    assert len(sl) == len(items) and list(sl) == items and sl == items
+    for i in range(-len(items), len(items)):
+        assert sl[i] == items[i]
+    assert sl[1:] == items[1:] and sl[::-1] == items[::-1]
+
+
+@pytest.mark.parametrize("index", [3, 4, -4, -100])
+def test_string_list_index_out_of_range(index):
+    with pytest.raises(IndexError):
+        ed.StringList(["a", "b", "c"])[index]
+    with pytest.raises(IndexError):
+        ed.StringList([])[0]
+
+
+def test_records_read_like_dicts():
+    bunker = ed.Bunker({"description": "Бункер", "items": ["Аптечка"], "sizeM2": 10,
+                        "stayText": "1 год", "foodText": "2 года", "places": 3})
+    assert bunker["places"] == bunker.places == 3 and bunker.get("nope", 7) == 7
+    assert bunker["items"] == ("Аптечка",) and bunker.as_dict()["items"] == ["Аптечка"]
+    assert bunker == bunker.as_dict() and dict(bunker) == {k: bunker[k] for k in bunker}
+    with pytest.raises(KeyError):
+        bunker["nope"]
+
+
+def test_short_strings_are_interned():
+    text = CARDS_JS.read_text(encoding="utf-8")
+    a, b = ed.parse_document(text), ed.parse_document(text + "\n")
+    assert a["bunkers"][0]["stayText"] is b["bunkers"][0]["stayText"]
+    assert isinstance(a["arrays"]["HOBBIES"], ed.StringList)
+    footprint = ed.model_footprint(a)
+    assert footprint["bytes"] < footprint["plain_bytes"]
+    assert set(footprint["sections"]) == set(ed.ARRAY_KEYS) | {"bunkers", "cataclysms"}
@@ -0,0 +1,65 @@
+import pytest
+
+from conftest import CARDS_JS, ed
+
+
+def _model(text):
+    return ed._deck_model(ed.parse_document(text))
+
+
+def _block_name(section):
+    return ed.BATCH_SECTIONS.get(section, section)
+
+
+@pytest.mark.parametrize("section", ed.deck_sections())
+def test_formatted_block_parses_back(section):
+    text = CARDS_JS.read_text(encoding="utf-8")
+    items = _model(text)[section]
+    new = ed.splice_blocks(text, {_block_name(section): ed._full_block(_block_name(section), items)})
+    assert _model(new)[section] == items
+
+
+def test_objects_with_awkward_values_round_trip():
+    cats = [{"id": "a'b", "title": "Строка\nс переводом", "description": "Кавычки \" и ' и \\", "image": ""},
+            {"id": "x", "title": "", "description": "", "image": "/cataclysms/x.jpg"}]
+    bunkers = [{"description": "}, { — не конец объекта", "items": ["a, b", "[c]"], "sizeM2": 12,
+                "stayText": "", "foodText": "2 года", "places": 3}]
+    text = ed.format_objects_block("CATACLYSMS", cats) + "\n" + ed.format_objects_block("BUNKERS", bunkers)
+    assert ed.parse_objects(text, "CATACLYSMS") == cats
+    assert ed.parse_objects(text, "BUNKERS") == bunkers
+
+
+def test_hand_written_objects_follow_the_schema():
+    text = """const CATACLYSMS = [
+      // комментарий между объектами
+      { text: 'Синоним', description: 'Основное имя важнее', id: "one", extra: { nested: ['x'] } },
+      { id: 'two', 'title': 'Склеенный ' + "заголовок", text: 'Только синоним' },
+    ];
+    const BUNKERS = [{ places: '4', sizeM2: 1.5e2, items: ['a', /* ] */ 'b'] }, { places: 'много' }];"""
+    assert ed.parse_objects(text, "CATACLYSMS") == [
+        {"id": "one", "title": "", "description": "Основное имя важнее", "image": ""},
+        {"id": "two", "title": "Склеенный заголовок", "description": "Только синоним", "image": ""}]
+    first, second = ed.parse_objects(text, "BUNKERS")
+    assert (first["places"], first["sizeM2"], first["items"]) == (4, 150, ["a", "b"])
+    assert second["places"] == 0 and second["description"] == "" and second["items"] == []
+
+
+def test_legacy_cataclysm_name_is_read_and_renamed():
+    text = CARDS_JS.read_text(encoding="utf-8")
+    cats = ed.parse_cataclysms(text)
+    legacy = text.replace("const CATACLYSMS", "const CATAclySMS")
+    assert ed.parse_cataclysms(legacy) == cats
+    new = ed.splice_blocks(legacy, {"CATACLYSMS": ed.edit_block(legacy, "CATACLYSMS", cats)})
+    assert "CATAclySMS" not in new and ed.parse_cataclysms(new) == cats
+
+
+def test_duplicate_under_legacy_name_is_dropped():
+    text = CARDS_JS.read_text(encoding="utf-8")
+    cats = ed.parse_cataclysms(text)
+    # так файл выглядел после старого редактора: настоящий блок и дописанный рядом дубль
+    stale = "const CATAclySMS = [\n  { id: 'old', title: 'Старый', description: '', image: '' },\n];\n\n"
+    broken = text.replace("module.exports", stale + "module.exports")
+    assert ed.parse_cataclysms(broken) == cats
+    new = ed.splice_blocks(broken, {"CATACLYSMS": ed.edit_block(broken, "CATACLYSMS", cats)})
+    # блок пишется заново по схеме, дубль исчезает вместе с отступом после него
+    assert new == ed.splice_blocks(text, {"CATACLYSMS": ed.format_objects_block("CATACLYSMS", cats)})
@@ -0,0 +1,58 @@
+from conftest import ed
+
+TEXT = """const HOBBIES = ['Рыбалка на озере', 'Ёлочные игрушки', 'Вязание', 'Рыбалка на озере ночью'];
+const BACKPACK = ['Аптечка', 'Аптечка первой помощи', 'Фонарик'];
+const BUNKERS = [
+  { description: 'Бункер у озера', sizeM2: 10, stayText: '', foodText: '', places: 2, items: ['Удочка', 'Ёлка'] },
+];
+const CATACLYSMS = [
+  { id: 'flood', title: 'Потоп', description: 'Вода поднялась выше озера', image: '' },
+];
+module.exports = { HOBBIES, BACKPACK, BUNKERS, CATACLYSMS };
+"""
+
+
+def _hits(res):
+    return [(r["section"], r["index"], r["item"]) for r in res["results"]]
+
+
+def test_prefix_search_across_sections(deck):
+    doc = ed.cached_document(TEXT)
+    res = ed.search_deck(doc, "ОЗЕР")
+    assert _hits(res) == [("HOBBIES", 0, None), ("HOBBIES", 3, None), ("bunkers", 0, None), ("cataclysms", 0, None)]
+    # все слова запроса, ё = е, предметы бункера — отдельные записи
+    assert _hits(ed.search_deck(doc, "рыб ночь")) == [("HOBBIES", 3, None)]
+    assert _hits(ed.search_deck(doc, "ёл")) == [("HOBBIES", 1, None), ("bunkers", 0, 1)]
+    assert _hits(ed.search_deck(doc, "озер", sections=["bunkers", "cataclysms"])) == [("bunkers", 0, None),
+                                                                                     ("cataclysms", 0, None)]
+    assert ed.search_deck(doc, "flood")["results"][0]["text"].startswith("Потоп flood")
+    assert ed.search_deck(doc, "  ,")["total"] == 0 and ed.search_deck(doc, "нет такого")["results"] == []
+    limited = ed.search_deck(doc, "озер", limit=2)
+    assert limited["total"] == 4 and len(limited["results"]) == 2
+
+
+def test_index_rebuilds_only_changed_sections(deck, client):
+    assert client.get("/search?q=рыб").status_code == 200
+    before = dict(deck.search)
+    assert client.post("/api/HOBBIES", json={"value": "Рыбалка зимой"}).status_code == 201
+    after = dict(deck.search)
+    assert after["HOBBIES"] is not before["HOBBIES"]
+    assert all(after[name] is before[name] for name in before if name != "HOBBIES")
+    r = client.get("/search?q=рыбалка зим&section=HOBBIES&limit=5")
+    assert [x["text"] for x in r.json["results"]] == ["Рыбалка зимой"]
+
+
+def test_near_duplicates(deck):
+    report = ed.near_duplicates(ed.cached_document(TEXT))
+    pairs = {(p["kind"], p["a"]["text"], p["b"]["text"]) for p in report["pairs"]}
+    assert ("contained", "Аптечка", "Аптечка первой помощи") in pairs
+    assert any(a == "Рыбалка на озере" and b == "Рыбалка на озере ночью" for _, a, b in pairs)
+    assert not any("Вязание" in (a, b) for _, a, b in pairs)
+    assert report["total"] == len(report["pairs"]) and report["entries"] == 4 + 3 + 3 + 1
+    assert ed.near_duplicates(ed.cached_document(TEXT)) is report   # тот же документ — из кэша
+
+
+def test_duplicates_endpoint(client):
+    r = client.get("/duplicates?threshold=2&limit=3")
+    assert r.status_code == 200 and r.json["threshold"] == 1.0 and len(r.json["pairs"]) <= 3
+    assert all(p["kind"] == "contained" or p["score"] >= 1.0 for p in r.json["pairs"])
@@ -0,0 +1,70 @@
+import os
+
+import pytest
+
+from conftest import ed
+
+
+@pytest.fixture
+def sharded(deck, monkeypatch):
+    """Колода deck в режиме CARDS_STORAGE=shards; кэш моделей пуст — иначе модель
+    того же текста из других тестов подменила бы разбор шардов."""
+    monkeypatch.setattr(ed, "STORAGE", "shards")
+    monkeypatch.setattr(ed, "_DOC_CACHE", ed.OrderedDict())
+    return deck
+
+
+def _touch_later(path):
+    # на грубых ФС запись в ту же секунду не сдвигает mtime
+    st = path.stat()
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+
+
+def test_cards_js_is_split_into_shards(sharded):
+    original = sharded.path.read_text(encoding="utf-8")
+    doc = ed.load_document()
+    assert doc["hash"] == ed.text_hash(original) and doc["text"] == original
+    names = {p.stem for p in sharded.shard_dir.glob("*.js")}
+    assert names == {ed.SHARD_FRAME, *(n for n in ed.SHARD_NAMES if n in ed.index_text(original).spans)}
+    assert ed.read_shard("HOBBIES") == ed.extract_verbatim(original, "HOBBIES")
+    assert ed.assemble_shards() == original
+    assert ed.load_document() is doc
+
+
+def test_edit_rewrites_one_shard(sharded, client):
+    original = sharded.path.read_text(encoding="utf-8")
+    client.get("/api/HOBBIES?limit=1")
+    before = {p.name: p.stat().st_mtime_ns for p in sharded.shard_dir.glob("*.js")}
+    assert client.patch("/api/HOBBIES/0", json={"value": "Шард"}).status_code == 200
+    after = {p.name: p.stat().st_mtime_ns for p in sharded.shard_dir.glob("*.js")}
+    assert [n for n in after if after[n] != before[n]] == ["HOBBIES.js"]
+    text = sharded.path.read_text(encoding="utf-8")
+    items = ["Шард"] + ed.parse_array(original, "HOBBIES")[1:]
+    # cards.js — тот же, что записал бы режим одного файла
+    assert text == ed.splice_blocks(original, {"HOBBIES": ed.edit_block(original, "HOBBIES", items)})
+    assert client.get("/api/HOBBIES/0").json["item"] == "Шард"
+
+
+def test_hand_edited_shard_is_assembled_and_parsed_alone(sharded, monkeypatch):
+    ed.load_document()
+    path = sharded.shard_dir / "GENDERS.js"
+    path.write_text(path.read_text(encoding="utf-8").replace("[", "[\n  'Новый',", 1), encoding="utf-8")
+    _touch_later(path)
+    parsed = []
+    real = ed.parse_array
+    monkeypatch.setattr(ed, "parse_array", lambda text, key: parsed.append(key) or real(text, key))
+    doc = ed.load_document()
+    assert doc["arrays"]["GENDERS"][0] == "Новый" and parsed == ["GENDERS"]
+    assert "'Новый'" in sharded.path.read_text(encoding="utf-8")
+
+
+def test_external_cards_js_is_split_again(sharded):
+    ed.load_document()
+    text = sharded.path.read_text(encoding="utf-8")
+    bunkers = [{"description": "Внешний", "items": ["a"], "sizeM2": 1, "stayText": "", "foodText": "", "places": 2}]
+    new = ed.replace_bunkers(text, bunkers)
+    sharded.path.write_text(new, encoding="utf-8")
+    _touch_later(sharded.path)
+    doc = ed.load_document()
+    assert doc["bunkers"][0]["description"] == "Внешний" and doc["text"] == new
+    assert "Внешний" in ed.read_shard("BUNKERS") and ed.assemble_shards() == new
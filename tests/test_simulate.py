@@ -0,0 +1,85 @@
+import re
+
+import pytest
+
+from conftest import ed
+
+TEXT = """const HOBBIES = ['a', 'b', 'c', 'd', 'a'];
+const ABILITIES = ['x', 'y', 'z', 'w'];
+const BUNKERS = [
+  { description: 'Малый', sizeM2: 10, stayText: '', foodText: '', places: 2, items: [] },
+  { description: 'Большой', sizeM2: 90, stayText: '', foodText: '', places: 6, items: [] },
+];
+module.exports = { HOBBIES, ABILITIES, BUNKERS };
+"""
+
+
+def test_same_seed_gives_same_report():
+    a = ed.simulate_deck(TEXT, rooms=2000, players=[2, 4], seed=7)
+    b = ed.simulate_deck(TEXT, rooms=2000, players=[2, 4], seed=7)
+    a.pop("seconds"), b.pop("seconds")
+    assert a == b
+
+
+def test_collisions_and_repeated_cards():
+    hobbies = ed.simulate_deck(TEXT, rooms=40000, players=[2, 3], seed=1)["categories"]["HOBBIES"]
+    assert (hobbies["size"], hobbies["distinct"], hobbies["repeated"]) == (5, 4, ["a"])
+    # карты тянутся с возвратом; 'a' выпадает с вероятностью 0.4, остальные — 0.2:
+    # n=2: 0.4² + 3·0.2² = 0.28; n=3: 1 − 3!·(3·0.4·0.2² + 0.2³) = 0.664
+    for n, expected in [(2, 0.28), (3, 0.664)]:
+        row = hobbies["by_players"][n]
+        assert row["collision_rate"] == pytest.approx(expected, abs=0.01)
+        assert row["collision_rate"] > row["ideal_rate"] == pytest.approx(ed._ideal_collision(4, n))
+
+
+def test_ability_pairs_never_repeat_a_card():
+    report = ed.simulate_deck(TEXT, rooms=20000, players=[2], seed=3)["abilities"]
+    assert report["same_pair_rate"] == 0 and report["pairs"] == 6
+    assert sum(report["per_ability"].values()) == pytest.approx(2.0)
+    assert report["pair_share_min"] == pytest.approx(1 / 6, abs=0.01)
+    assert report["pair_share_max"] == pytest.approx(1 / 6, abs=0.01)
+
+
+def test_bunker_places_are_exact():
+    bunkers = ed.simulate_deck(TEXT, rooms=1, players=[2, 4, 8], seed=0)["bunkers"]
+    assert bunkers["places_hist"] == {2: 1, 6: 1}
+    assert [bunkers["by_players"][n]["covered_rate"] for n in (2, 4, 8)] == [1.0, 0.5, 0.0]
+    assert bunkers["by_players"][4]["survivors_share"] == pytest.approx((2 / 4 + 4 / 4) / 2)
+    assert [bunkers["by_players"][n]["server_places"] for n in (2, 4, 8)] == [1, 2, 4]
+
+
+@pytest.mark.parametrize("spec, players", [("8", [8]), ("4,6, 8", [4, 6, 8]), ("2-4,3", [2, 3, 4]),
+                                           ("0-2", [1, 2]), ("60-99", [60, 61, 62, 63, 64])])
+def test_parse_players(spec, players):
+    assert ed.parse_players(spec) == players
+
+
+@pytest.mark.parametrize("spec", ["", " , ", "x", "5-y"])
+def test_parse_players_rejects_garbage(spec):
+    with pytest.raises(ValueError):
+        ed.parse_players(spec)
+
+
+# ---------- Числа на краях ----------
+@pytest.mark.parametrize("value, stored", [(-5, 0), (0, 0)])
+def test_bunker_numbers_are_clamped(deck, client, value, stored):
+    r = client.patch("/api/bunkers/0", json={"places": value, "sizeM2": value})
+    assert r.status_code == 200
+    assert r.json["item"]["places"] == r.json["item"]["sizeM2"] == stored
+
+
+def test_hand_edited_negative_numbers(deck):
+    text = deck.path.read_text(encoding="utf-8")
+    text = re.sub(r"places:\s*\d+", "places: -3", text, count=1)
+    report = ed.simulate_deck(text, rooms=20, seed=1)["bunkers"]
+    assert report["places_hist"][0] >= 1
+    assert ed.normalize_bunkers([{"places": -3, "sizeM2": -1, "description": "x"}])[0]["places"] == 0
+
+
+def test_simulate_endpoint(client):
+    r = client.get("/simulate?format=json&rooms=-10&seed=1")
+    assert r.status_code == 200 and r.json["rooms"] == 1
+    r = client.get("/simulate?format=json&rooms=100&players=2-3&seed=1")
+    assert r.json["players"] == [2, 3] and set(r.json["categories"]["HOBBIES"]["by_players"]) == {"2", "3"}
+    assert client.get("/simulate?format=json&players=abc").status_code == 400
+    assert client.get("/simulate?rooms=50&seed=1").status_code == 200
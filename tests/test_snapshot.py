@@ -0,0 +1,51 @@
+import json
+import re
+
+import pytest
+
+from conftest import ed
+
+
+def test_save_writes_matching_json_and_binary_snapshots(deck, client):
+    assert client.post("/api/HOBBIES", json={"value": "Хобби для снапшота"}).status_code == 201
+    data = json.loads(deck.snapshot_json_path.read_text(encoding="utf-8"))
+    binary = ed.load_snapshot()
+    assert "Хобби для снапшота" in binary["arrays"]["HOBBIES"]
+    for key in ("hash", "arrays", "abilities", "bunkers", "cataclysms"):
+        assert binary[key] == data[key], key
+    assert ed.read_snapshot_hash() == data["hash"] == ed.snapshot_hash(ed.snapshot_data(deck.path.read_text(encoding="utf-8")))
+
+
+def test_unchanged_data_does_not_rewrite_snapshot(deck):
+    text = deck.path.read_text(encoding="utf-8")
+    digest = ed.write_snapshot(text)
+    before = deck.snapshot_bin_path.stat().st_mtime_ns, deck.snapshot_json_path.stat().st_mtime_ns
+    # комментарий меняет файл, но не данные колоды
+    assert ed.write_snapshot(text + "\n// комментарий\n") == digest
+    assert (deck.snapshot_bin_path.stat().st_mtime_ns, deck.snapshot_json_path.stat().st_mtime_ns) == before
+
+
+def test_foreign_file_is_not_a_snapshot(deck, tmp_path):
+    other = tmp_path / "other.bin"
+    other.write_bytes(b"not a snapshot" * 4)
+    assert ed.read_snapshot_hash(other) is None
+    with pytest.raises(ValueError):
+        ed.load_snapshot(other)
+
+
+@pytest.mark.parametrize("value, stored", [(2**31 - 1, 2**31 - 1), (2**40, 2**31 - 1)])
+def test_bunker_numbers_fit_int32(deck, client, value, stored):
+    r = client.patch("/api/bunkers/0", json={"places": value, "sizeM2": value})
+    assert r.status_code == 200
+    assert r.json["item"]["places"] == r.json["item"]["sizeM2"] == stored
+    assert ed.load_snapshot()["bunkers"][0]["places"] == stored
+
+
+def test_hand_edited_numbers_round_trip_signed(deck):
+    text = deck.path.read_text(encoding="utf-8")
+    text = re.sub(r"places:\s*\d+", "places: -3", text, count=1)
+    text = re.sub(r"sizeM2:\s*\d+", "sizeM2: -99999999999", text, count=1)
+    assert ed.write_snapshot(text)
+    bunker = ed.load_snapshot()["bunkers"][0]
+    assert (bunker["places"], bunker["sizeM2"]) == (-3, -2**31)
+    assert json.loads(deck.snapshot_json_path.read_text(encoding="utf-8"))["bunkers"][0]["sizeM2"] == -2**31
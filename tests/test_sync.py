@@ -0,0 +1,186 @@
+import functools
+import http.server
+import json
+import threading
+import time
+import zipfile
+
+import pytest
+
+from conftest import CARDS_JS, ROOT, ed
+
+IMAGES = sorted((ROOT / "client" / "public" / "cataclysms").iterdir())[:4]
+
+
+class _Quiet(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def _build(path, cards=CARDS_JS, images=IMAGES):
+    with zipfile.ZipFile(path, "w") as z:
+        z.write(cards, "YGsere-main/data/cards.js")
+        for img in images:
+            z.write(img, f"YGsere-main/client/public/cataclysms/{img.name}")
+
+
+@pytest.fixture
+def archive(deck, tmp_path, monkeypatch):
+    """Локальный сервер с архивом репозитория вместо codeload.github.com;
+    возвращает путь к main.zip — тест может пересобрать архив."""
+    root = tmp_path / "server"
+    root.mkdir()
+    _build(root / "main.zip")
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(_Quiet, directory=str(root)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(ed, "GITHUB_ARCHIVE_URL", f"http://127.0.0.1:{server.server_port}/{{branch}}.zip")
+    yield root / "main.zip"
+    job = deck.image_job["future"]
+    if job is not None:   # картинки после синхронизации готовятся в фоне — дождаться до удаления tmp
+        job.result(timeout=60)
+    server.shutdown()
+    server.server_close()
+
+
+# ---------- Условное скачивание ----------
+def test_unchanged_archive_is_not_downloaded_again(deck, archive):
+    first = ed.sync_from_github("x/y", "main")
+    assert not first["not_modified"] and first["bytes"] == archive.stat().st_size
+    assert first["changed"] == len(IMAGES)   # cards.js в архиве тот же, что и локальный
+    second = ed.sync_from_github("x/y", "main")
+    assert second["not_modified"] and second["bytes"] == 0 and second["changed"] == 0
+    assert "304" in ed.format_sync_report(second)
+
+
+def test_missing_cards_js_forces_full_download(deck, archive):
+    ed.sync_from_github("x/y", "main")
+    deck.path.unlink()
+    report = ed.sync_from_github("x/y", "main")
+    assert not report["not_modified"] and report["changed"] == 1
+    assert deck.path.read_bytes() == CARDS_JS.read_bytes()
+
+
+# ---------- Манифест ----------
+def test_manifest_skips_unchanged_files(deck, tmp_path, monkeypatch):
+    zip_path = tmp_path / "repo.zip"
+    _build(zip_path)
+    assert ed._extract_and_copy(zip_path) == len(IMAGES)
+    stamps = {p: p.stat().st_mtime_ns for p in deck.images.iterdir()}
+    manifest = ed._load_manifest()
+    assert str(deck.path) in manifest and len(manifest) == len(IMAGES) + 1
+    # файлы не менялись после синхронизации: хватает манифеста, локальный CRC не считается
+    monkeypatch.setattr(ed, "_file_crc32", lambda path: pytest.fail(f"прочитан {path}"))
+    assert ed._extract_and_copy(zip_path) == 0
+    assert {p: p.stat().st_mtime_ns for p in deck.images.iterdir()} == stamps
+
+
+def test_local_edit_is_overwritten(deck, tmp_path):
+    zip_path = tmp_path / "repo.zip"
+    _build(zip_path)
+    ed._extract_and_copy(zip_path)
+    damaged = deck.images / IMAGES[0].name
+    damaged.write_bytes(b"x" * damaged.stat().st_size)   # тот же размер, другое содержимое
+    assert ed._extract_and_copy(zip_path) == 1
+    assert damaged.read_bytes() == IMAGES[0].read_bytes()
+
+
+def test_prune_removes_only_images_dropped_from_archive(deck, tmp_path):
+    zip_path = tmp_path / "repo.zip"
+    _build(zip_path)
+    ed._extract_and_copy(zip_path)
+    own = deck.images / "своя.jpg"
+    own.write_bytes(b"local")
+    _build(zip_path, images=IMAGES[1:])
+    assert ed._extract_and_copy(zip_path) == 0   # без prune ничего не удаляется
+    assert (deck.images / IMAGES[0].name).exists()
+    assert ed._extract_and_copy(zip_path, prune=True) == 1
+    assert not (deck.images / IMAGES[0].name).exists() and own.exists()
+
+
+# ---------- Параллельная распаковка ----------
+def test_parallel_extract_matches_sequential(deck, tmp_path, monkeypatch):
+    zip_path = tmp_path / "repo.zip"
+    _build(zip_path, images=sorted((ROOT / "client" / "public" / "cataclysms").iterdir()))
+    deck.path.unlink()
+    written = []
+    real = ed._write_member
+
+    def write_member(zf, info, dst):
+        # у каждого потока свой дескриптор архива, а колода — та же, что у вызывающего
+        written.append((threading.current_thread().name, id(zf), ed.current_deck()))
+        real(zf, info, dst)
+
+    monkeypatch.setattr(ed, "_write_member", write_member)
+    changed = ed._extract_and_copy(zip_path, workers=4)
+    assert changed == len(written) > 4
+    assert {deck} == {d for _, _, d in written}
+    assert all(name.startswith("cards-sync") for name, _, _ in written)
+    assert len({zf for _, zf, _ in written}) == len({name for name, _, _ in written})
+    parallel = ed._load_manifest()
+    for src in sorted((ROOT / "client" / "public" / "cataclysms").iterdir()):
+        assert (deck.images / src.name).read_bytes() == src.read_bytes()
+    assert not [p for p in deck.images.iterdir() if p.name.endswith(".tmp")]
+
+    for p in [deck.path, deck.sync_manifest_path, *deck.images.iterdir()]:
+        p.unlink()
+    assert ed._extract_and_copy(zip_path, workers=1) == changed
+    sequential = ed._load_manifest()
+    assert list(sequential) == list(parallel)
+    assert [e["crc"] for e in sequential.values()] == [e["crc"] for e in parallel.values()]
+
+
+def test_images_are_prepared_after_sync(deck, archive):
+    assert ed.sync_from_github("x/y", "main")["changed"]
+    job = deck.image_job["future"]
+    assert job is not None
+    job.result(timeout=60)
+    index = ed._load_image_index()
+    assert {img.name for img in IMAGES} <= set(index)
+
+
+# ---------- Фоновые задачи ----------
+def _wait(client, job_id):
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        job = client.get(f"/sync/{job_id}").json
+        if job["state"] in ("done", "failed"):
+            return job
+        time.sleep(0.05)
+    pytest.fail(f"задача {job_id} не завершилась")
+
+
+def test_sync_runs_in_background(deck, archive, client):
+    r = client.post("/sync", data={"repo": "x/y", "branch": "main"}, headers={"Accept": "application/json"})
+    assert r.status_code == 202 and r.headers["Location"].endswith(f"/sync/{r.json['id']}")
+    job = _wait(client, r.json["id"])
+    assert job["state"] == "done" and job["result"]["changed"] == len(IMAGES)
+    assert job["files_done"] == job["files_total"] == len(IMAGES) + 1
+    assert job["files_written"] == len(IMAGES) and job["bytes"] == archive.stat().st_size
+    saved = json.loads((deck.jobs_dir / f"{job['id']}.json").read_text(encoding="utf-8"))
+    assert saved["state"] == "done"
+
+
+def test_repeated_request_joins_running_job(deck, client, monkeypatch):
+    release = threading.Event()
+
+    def slow_sync(*args, **kwargs):
+        release.wait(10)
+        return {"not_modified": True, "bytes": 0, "seconds": 0.0, "changed": 0}
+
+    monkeypatch.setattr(ed, "sync_from_github", slow_sync)
+    first = ed.start_sync_job("x/y", "main")
+    assert ed.start_sync_job("x/y", "main")["id"] == first["id"]
+    release.set()
+    assert _wait(client, first["id"])["state"] == "done"
+    assert ed.start_sync_job("x/y", "main")["id"] != first["id"]
+
+
+def test_failed_and_foreign_jobs(deck, client, monkeypatch):
+    monkeypatch.setattr(ed, "GITHUB_ARCHIVE_URL", "http://127.0.0.1:9/{branch}.zip")
+    job = _wait(client, ed.start_sync_job("x/y", "main")["id"])
+    assert job["state"] == "failed" and job["error"]
+    # задача другого воркера видна по снимку в jobs_dir
+    (deck.jobs_dir / "0123456789ab.json").write_text(json.dumps({"id": "0123456789ab", "state": "running"}))
+    assert client.get("/sync/0123456789ab").json["state"] == "running"
+    assert client.get("/sync/nope").status_code == 404
+    assert client.get("/sync/..%2Fcards").status_code == 404
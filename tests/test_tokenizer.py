@@ -0,0 +1,72 @@
+import pytest
+
+from conftest import CARDS_JS, ed
+
+SOURCE = r"""// const FAKE = ['из комментария'];
+/* const FAKE2 = [ 'x' ]; ] } ) */
+const NOTE = 'строка с ] и [ и // внутри';
+const HOBBIES = [
+  'Рыбалка', // 'не элемент' ]
+  "Двойные \"кавычки\"",
+  'Escape \' \\ \n A \x42 \u{1F600}',
+  `шаблон ] с ${'вставкой'}`,
+  /* ] */ 'После комментария',
+  ['вложенный'],
+  'Последний'
+];
+const GENDERS = ['М', 'Ж']
+const URL = "http://x/y"; const EMPTY = [];
+module.exports = { HOBBIES, GENDERS };
+"""
+
+
+def test_index_skips_comments_strings_and_nested_arrays():
+    idx = ed.index_text(SOURCE)
+    assert sorted(idx.spans) == ["EMPTY", "GENDERS", "HOBBIES"]
+    assert SOURCE[idx.exports:].startswith("module.exports")
+    assert ed.extract_verbatim(SOURCE, "GENDERS") == "const GENDERS = ['М', 'Ж']"
+    assert ed.parse_array(SOURCE, "FAKE") == [] and ed.parse_array(SOURCE, "EMPTY") == []
+
+
+def test_parse_array_unescapes_literals():
+    assert ed.parse_array(SOURCE, "HOBBIES") == [
+        "Рыбалка", 'Двойные "кавычки"', "Escape ' \\ \n A B \U0001F600",
+        "шаблон ] с ${'вставкой'}", "После комментария", "Последний"]
+
+
+@pytest.mark.parametrize("value", ["просто", "кавычка ' и \" обе", "слэш \\ в конце\\", "две\nстроки",
+                                   "${шаблон}", "*/ и // и ]"])
+def test_escape_round_trip(value):
+    text = ed.replace_array(SOURCE, "GENDERS", [value])
+    assert ed.parse_array(text, "GENDERS") == [value]
+    assert ed.parse_array(text, "HOBBIES") == ed.parse_array(SOURCE, "HOBBIES")
+
+
+def test_replace_keeps_the_rest_byte_identical():
+    text = ed.replace_array(SOURCE, "HOBBIES", ["Одно"])
+    before, after = SOURCE.split("const HOBBIES")[0], SOURCE.split("];\nconst GENDERS")[1]
+    assert text.startswith(before) and text.endswith(after)
+    # индекс, выведенный из старого при подстановке, совпадает с полной токенизацией
+    assert ed.index_text(text) == ed._tokenize(text)
+
+
+def test_missing_block_is_inserted_before_exports():
+    text = ed.replace_array(SOURCE, "TRAITS", ["Смелый"])
+    assert text.index("const TRAITS") < text.index("module.exports")
+    assert ed.parse_array(text, "TRAITS") == ["Смелый"]
+    assert ed.replace_array("const A = [];", "TRAITS", ["x"]) == "const A = [];"
+
+
+def test_unterminated_input_does_not_hang():
+    for text in ["const HOBBIES = ['a', 'b'", "const HOBBIES = ['a /* ]", "/* const X = ['a'];"]:
+        assert ed.parse_array(text, "HOBBIES") == []
+
+
+def test_splice_of_unchanged_blocks_is_byte_identical():
+    text = CARDS_JS.read_text(encoding="utf-8")
+    model = ed._deck_model(ed.parse_document(text))
+    names = {s: ed.BATCH_SECTIONS.get(s, s) for s in ed.deck_sections()}
+    blocks = {names[s]: ed.edit_block(text, names[s], model[s]) for s in names}
+    assert ed.splice_blocks(text, blocks) == text
+    spans = ed.index_text(text).spans
+    assert ed.splice_blocks(text, {n: text[sp.start:sp.end] for n, sp in spans.items()}) == text
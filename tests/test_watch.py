@@ -0,0 +1,97 @@
+import json
+import os
+import shutil
+import time
+
+from conftest import ROOT, ed
+
+
+def _edit_externally(path, old, new):
+    """Правка мимо редактора, как её пишут git и редакторы: временный файл и rename
+    (иначе слежение может застать файл обрезанным). mtime сдвигается явно — на
+    грубых ФС запись в ту же секунду его не меняет."""
+    st = path.stat()
+    tmp = path.with_name(path.name + ".tmp")
+    tmp.write_text(path.read_text(encoding="utf-8").replace(old, new, 1), encoding="utf-8")
+    os.utime(tmp, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+    os.replace(tmp, path)
+
+
+def _watch_from_now(deck):
+    # то же исходное состояние, что готовит start_watcher, но без фонового потока
+    doc = ed.load_document()
+    deck.watch.update(key=ed._deck_key(), hash=doc["hash"], versions=ed.section_versions(doc),
+                      images=ed._image_signature())
+
+
+def test_check_deck_publishes_changed_sections(deck):
+    _watch_from_now(deck)
+    sub = ed.subscribe()
+    try:
+        assert ed.check_deck() is None
+        _edit_externally(deck.path, "const HOBBIES = [", "const HOBBIES = [\n  'Снаружи',")
+        event = ed.check_deck()
+        assert event["type"] == "deck" and event["changed"] == ["HOBBIES"]
+        assert event["versions"]["HOBBIES"] == ed.section_version("HOBBIES", ed.load_document()["arrays"]["HOBBIES"])
+        assert sub.get_nowait() == event
+        # тот же текст с новым mtime — не событие
+        _edit_externally(deck.path, "", "")
+        assert ed.check_deck() is None and sub.empty()
+    finally:
+        ed.unsubscribe(sub)
+    assert sub not in deck.watch["subs"]
+
+
+def test_slow_subscriber_keeps_latest_events(deck):
+    sub = ed.subscribe()
+    try:
+        for i in range(ed.WATCH_QUEUE + 5):
+            ed.publish({"type": "deck", "n": i})
+        got = [sub.get_nowait()["n"] for _ in range(sub.qsize())]
+        assert got == list(range(5, ed.WATCH_QUEUE + 5))
+    finally:
+        ed.unsubscribe(sub)
+
+
+def test_check_images_reports_paths(deck):
+    deck.images.mkdir()
+    _watch_from_now(deck)
+    src = sorted((ROOT / "client" / "public" / "cataclysms").iterdir())[0]
+    shutil.copyfile(src, deck.images / "new.jpg")
+    event = ed.check_images()
+    assert event == {"type": "images", "paths": [ed.IMAGE_URL_PREFIX + "new.jpg"]}
+    assert ed.check_images() is None
+
+
+def test_events_are_disabled_without_watcher(client):
+    assert client.get("/events").status_code == 404
+
+
+def _next_event(chunks, kind, deadline):
+    buf = ""
+    while time.monotonic() < deadline:
+        buf += next(chunks).decode("utf-8")
+        for part in buf.split("\n\n")[:-1]:
+            lines = dict(line.split(": ", 1) for line in part.splitlines() if ": " in line)
+            if lines.get("event") == kind:
+                return json.loads(lines["data"])
+        buf = buf.split("\n\n")[-1]
+    raise AssertionError(f"нет события {kind}")
+
+
+def test_events_stream_external_edits(deck, client, monkeypatch):
+    monkeypatch.setattr(ed, "WATCH_ENABLED", True)
+    monkeypatch.setattr(ed, "WATCH_POLL", 0.05)
+    monkeypatch.setattr(ed, "EVENTS_KEEPALIVE", 0.1)
+    resp = client.get("/events", buffered=False)
+    try:
+        assert resp.mimetype == "text/event-stream" and resp.headers["Cache-Control"] == "no-cache"
+        chunks = iter(resp.response)
+        first = _next_event(chunks, "deck", time.monotonic() + 5)
+        assert first["changed"] == [] and first["mode"] in ("inotify", "poll")
+        _edit_externally(deck.path, "const BODIES = [", "const BODIES = [\n  'Снаружи',")
+        event = _next_event(chunks, "deck", time.monotonic() + 10)
+        assert event["changed"] == ["BODIES"] and event["hash"] == ed.load_document()["hash"]
+    finally:
+        resp.close()
+    assert deck.watch["subs"] == []
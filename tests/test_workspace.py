@@ -0,0 +1,82 @@
+import json
+import os
+import shutil
+import sys
+import threading
+
+import pytest
+
+from conftest import CARDS_JS, ed
+
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    """decks.json с двумя колодами; у каждой своя копия cards.js."""
+    monkeypatch.setattr(ed, "_DECK_STATES", {})
+    for name in ("main", "season"):
+        (tmp_path / "decks" / name).mkdir(parents=True)
+        shutil.copyfile(CARDS_JS, tmp_path / "decks" / name / "cards.js")
+    path = tmp_path / "decks.json"
+    path.write_text(json.dumps({"default": "main", "decks": {"main": {}, "season": {"branch": "season"}}}))
+    return path
+
+
+def test_decks_are_served_from_their_own_files(workspace):
+    environ = dict(os.environ)
+    client = ed.create_workspace(str(workspace)).test_client()
+    # колоды не получают своей копии модуля и не подменяют окружение
+    assert [m for m in sys.modules if m.startswith("cards_editor")] == ["cards_editor_no_abilities"]
+    assert dict(os.environ) == environ
+    main, season = (workspace.parent / "decks" / n / "cards.js" for n in ("main", "season"))
+    before = season.read_bytes()
+    r = client.post("/d/main/api/HOBBIES", json={"value": "Только в main"})
+    assert r.status_code == 201
+    assert "Только в main" in main.read_text(encoding="utf-8") and season.read_bytes() == before
+    assert client.get("/d/season/api/HOBBIES?q=только в main").get_json()["total"] == 0
+    assert ed.current_deck() is ed.PRIMARY_DECK   # контекст запроса не протекает к вызывающему
+
+
+def test_workspace_index_and_deck_list(workspace):
+    client = ed.create_workspace(str(workspace)).test_client()
+    assert client.get("/").headers["Location"].endswith("/d/main/")
+    decks = client.get("/decks", headers={"Accept": "application/json"}).get_json()
+    assert [d["name"] for d in decks["decks"]] == ["main", "season"]
+    assert decks["decks"][1]["branch"] == "season" and all(d["exists"] for d in decks["decks"])
+    page = client.get("/d/season/").get_data(as_text=True)
+    assert 'const BASE = "/d/season"' in page
+
+
+def test_load_deck_keeps_one_state_per_deck(workspace):
+    ws = ed.load_workspace(workspace)
+    main = ed.load_deck("main", ws)
+    assert ed.load_deck("main", ws) is main and ed.load_deck("season", ws) is not main
+    assert main.image_store == ws["image_store"]
+    with pytest.raises(ValueError, match="nope"):
+        ed.load_deck("nope", ws)
+
+
+def test_in_deck_carries_the_deck_into_threads(workspace):
+    season = ed.load_deck("season", ed.load_workspace(workspace))
+    seen = []
+    with ed.use_deck(season):
+        task = ed.in_deck(lambda: seen.append(ed.current_deck()))
+    thread = threading.Thread(target=task)
+    thread.start()
+    thread.join()
+    assert seen == [season] and ed.current_deck() is ed.PRIMARY_DECK
+
+
+@pytest.mark.parametrize("data, message", [
+    ({"decks": {"main": "cards.js"}}, "'main'"),
+    ({"decks": {"main": ["a"]}}, "'main'"),
+    ({"decks": ["main"]}, "decks"),
+    ({"decks": {}}, "нет ни одной колоды"),
+    ({"decks": {"bad name": {}}}, "bad name"),
+    ({"decks": {"a": {"path": "x.js"}, "b": {"path": "x.js"}}}, "один путь"),
+    ({"default": "c", "decks": {"a": {}}}, "'c'"),
+])
+def test_bad_workspace_config(tmp_path, data, message):
+    path = tmp_path / "decks.json"
+    path.write_text(json.dumps(data))
+    with pytest.raises(ValueError, match=message):
+        ed.load_workspace(path)
@@ -0,0 +1,69 @@
+import html
+import re
+import subprocess
+import sys
+
+from werkzeug.datastructures import MultiDict
+
+from conftest import ed
+
+
+def _open_form(client):
+    """Поля формы /full и base_versions — как их отправил бы только что открытый браузер."""
+    page = client.get("/full").get_data(as_text=True)
+    base = html.unescape(re.search(r"name=\"base_versions\" value='([^']*)'", page).group(1))
+    doc = ed.load_document()
+    fields = [(f"{key}_item", v) for key in ed.ARRAY_KEYS for v in doc["arrays"][key]]
+    for i, b in enumerate(doc["bunkers"]):
+        fields += [("bunk_idx", str(i)), (f"bunk_desc_{i}", b["description"]),
+                   (f"bunk_size_{i}", str(b["sizeM2"])), (f"bunk_stay_{i}", b["stayText"]),
+                   (f"bunk_food_{i}", b["foodText"]), (f"bunk_places_{i}", str(b["places"]))]
+        fields += [(f"bunk_item_{i}", it) for it in b["items"]]
+    for c in doc["cats"]:
+        fields += [("cat_id", c["id"]), ("cat_title", c["title"]),
+                   ("cat_description", c["description"]), ("cat_image", c["image"])]
+    return fields + [("base_versions", base)]
+
+
+def _post_form(client, fields):
+    return client.post("/", data=MultiDict(fields), follow_redirects=True).get_data(as_text=True)
+
+
+def _replace(fields, name, value):
+    return [(k, value if k == name else v) for k, v in fields]
+
+
+def test_stale_form_keeps_concurrent_api_edit(deck, client):
+    form = _open_form(client)
+    places = int(dict(form)["bunk_places_0"]) + 1
+    assert client.post("/api/HOBBIES", json={"value": "Хобби из другой вкладки"}).status_code == 201
+    page = _post_form(client, _replace(form, "bunk_places_0", str(places)))
+    assert "Изменения сохранены" in page and "Не сохранено" not in page
+    doc = ed.load_document()
+    assert "Хобби из другой вкладки" in doc["arrays"]["HOBBIES"]
+    assert doc["bunkers"][0]["places"] == places
+
+
+def test_stale_form_editing_same_section_is_rejected(deck, client):
+    form = _open_form(client)
+    assert client.post("/api/HOBBIES", json={"value": "Хобби из другой вкладки"}).status_code == 201
+    before = deck.path.read_bytes()
+    page = _post_form(client, form + [("HOBBIES_item", "Хобби из формы")])
+    assert "Не сохранено" in page and "HOBBIES" in page
+    assert deck.path.read_bytes() == before
+
+
+def test_lock_timeout_returns_503(deck, client, monkeypatch):
+    monkeypatch.setattr(ed, "LOCK_TIMEOUT", 0.2)
+    holder = subprocess.Popen(
+        [sys.executable, "-c", "import fcntl, sys, time; f = open(sys.argv[1], 'a+b'); "
+         "fcntl.flock(f, fcntl.LOCK_EX); print('held', flush=True); time.sleep(5)", str(deck.lock_path)],
+        stdout=subprocess.PIPE, text=True)
+    try:
+        assert holder.stdout.readline().strip() == "held"
+        r = client.post("/api/HOBBIES", json={"value": "x"})
+        assert r.status_code == 503 and r.headers["Retry-After"]
+    finally:
+        holder.kill()
+        holder.wait()
+    assert client.post("/api/HOBBIES", json={"value": "x"}).status_code == 201